@@ -1,12 +1,67 @@
 from . import coeffstore
 from . import expressions
 from . import caching
+from . import checkpoint_storage
 import libadjoint
 from dolfin_adjoint import backend
 
+class Adjointer(libadjoint.Adjointer):
+    '''The libadjoint Adjointer, extended to keep a record of the variable each
+    equation solves for and the variables it depends on. This lets the forward
+    replay skip the equations that do not depend on the controls.'''
+
+    def __init__(self, *args, **kwargs):
+        libadjoint.Adjointer.__init__(self, *args, **kwargs)
+        self.equation_vars = []
+        self.equation_deps = []
+
+    def register_equation(self, equation, *args, **kwargs):
+        cs = libadjoint.Adjointer.register_equation(self, equation, *args, **kwargs)
+
+        self.equation_vars.append(getattr(equation, "var", None))
+        self.equation_deps.append(_equation_dependencies(equation))
+
+        return cs
+
+    def reset(self):
+        libadjoint.Adjointer.reset(self)
+        self.equation_vars = []
+        self.equation_deps = []
+
+    def affected_equations(self, variables):
+        '''Return the set of equations whose solution depends on any of the given
+        variables: the equations solving for them, and everything downstream.
+        Equations with unknown dependencies are assumed to be affected.'''
+
+        affected_vars = set(str(var) for var in variables)
+        affected = set()
+        for i in range(len(self.equation_vars)):
+            var = str(self.equation_vars[i])
+            deps = self.equation_deps[i]
+            if var in affected_vars or deps is None or len(deps & affected_vars) > 0:
+                affected.add(i)
+                affected_vars.add(var)
+
+        return affected
+
+def _equation_dependencies(equation):
+    # The variables an equation depends on, or None if they can not be determined
+    try:
+        deps = set()
+        for block in equation.blocks:
+            deps.update(str(dep) for dep in block.dependencies or [])
+        deps.update(str(target) for target in equation.targets)
+        if equation.rhs is not None:
+            deps.update(str(dep) for dep in equation.rhs.dependencies())
+        deps.discard(str(equation.var))
+    except AttributeError:
+        return None
+
+    return deps
+
 # Create the adjointer, the central object that records the forward solve
 # as it happens.
-adjointer = libadjoint.Adjointer()
+adjointer = Adjointer()
 
 mem_checkpoints = set()
 disk_checkpoints = set()
@@ -51,6 +106,8 @@ def adj_inc_timestep(time=None, finished=False):
 
 # A dictionary that saves the functionspaces of all checkpoint variables that have been saved to disk
 checkpoint_fs = {}
+# The local dof arrays of the checkpoint variables that have been saved to disk
+checkpoint_store = checkpoint_storage.TieredStorage()
 
 function_names = set()
 
@@ -60,14 +117,17 @@ def adj_check_checkpoints():
 def adj_reset_cache():
     if backend.parameters["adjoint"]["debug_cache"]:
         backend.info_blue("Resetting solver cache")
+        caching.assembled_adj_forms.info()
 
-    caching.assembled_fwd_forms.clear()
-    caching.assembled_adj_forms.clear()
+    # Assembled forms are keyed on the values they were assembled from, so only
+    # the entries that are tied to the annotation have to go
+    caching.assembled_adj_forms.clear_canonical()
     caching.lu_solvers.clear()
     caching.localsolvers.clear()
 
     caching.pis_fwd_to_tlm.clear()
     caching.pis_fwd_to_adj.clear()
+    caching.l2_riesz_maps.clear()
 
     if backend.__name__ == "dolfin":
         from .petsc_krylov_solver import reset_petsc_krylov_solvers
@@ -94,6 +154,10 @@ def adj_reset():
     adj_variables.__init__()
     function_names.__init__()
     adj_reset_cache()
+    caching.assembled_fwd_forms.clear()
+    caching.assembled_adj_forms.clear()
+    checkpoint_store.clear()
+    checkpoint_fs.clear()
     backend.parameters["adjoint"]["stop_annotating"] = False
 
 # Map from FunctionSpace to LUSolver that has factorised the fsp mass matrix
@@ -221,46 +221,29 @@ class Vector(libadjoint.Vector):
             raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to get values.")
 
     def write(self, var):
-        filename = str(var)
-        suffix = "h5"
-
-        # Change naming scheme for compatibility with HDF5File routines
-        filename = filename.replace(":","-")
-
-        #if not os.path.isfile(filename+".%s" % suffix):
-        #  backend.info_red("Warning: Overwriting checkpoint file "+filename+"."+suffix)
-        file = backend.HDF5File(backend.comm_world, filename+".%s" % suffix, "w")
-        file.write(self.data, filename)
-        file.close()
+        key = str(var)
+        adjglobals.checkpoint_store[key] = self.data.vector().get_local()
 
         # Save the function space into adjglobals.checkpoint_fs. It will be needed when reading the variable back in.
-        adjglobals.checkpoint_fs[filename] = self.data.function_space()
+        adjglobals.checkpoint_fs[key] = self.data.function_space()
 
     @staticmethod
     def read(var):
-        filename = str(var)
-        filename = filename.replace(":","-")
-        suffix = "h5"
+        key = str(var)
 
-        V = adjglobals.checkpoint_fs[filename]
+        V = adjglobals.checkpoint_fs[key]
         v = backend.Function(V)
-        file = backend.HDF5File(backend.comm_world, filename+".%s" % suffix, "r")
-        file.read(v, filename)
-        file.close()
+        vec = v.vector()
+        vec.set_local(adjglobals.checkpoint_store[key])
+        vec.apply("insert")
 
         return Vector(v)
 
     @staticmethod
     def delete(var):
-        try:
-            filename = str(var)
-            filename = filename.replace(":","-")
-            suffix = "h5"
-
-            import os
-            os.remove(filename+".%s" % suffix)
-        except OSError:
-            pass
+        key = str(var)
+        if key in adjglobals.checkpoint_store:
+            del adjglobals.checkpoint_store[key]
 
 class Matrix(libadjoint.Matrix):
     '''This class implements the libadjoint.Matrix abstract base class for the Dolfin adjoint.
@@ -268,7 +251,7 @@ class Matrix(libadjoint.Matrix):
     together, duplicating matrices, etc., that occur in the process of constructing
     the adjoint equations.'''
 
-    def __init__(self, data, bcs=None, solver_parameters=None, adjoint=None, cache=False):
+    def __init__(self, data, bcs=None, solver_parameters=None, adjoint=None, cache=False, key=None):
 
         if bcs is None:
             self.bcs = []
@@ -284,6 +267,10 @@ class Matrix(libadjoint.Matrix):
 
         self.cache = cache
 
+        # The canonical key of the operator, if the block it belongs to has one.
+        # Used to share assembled matrices and factorisations across timesteps.
+        self.key = key
+
     def assemble_data(self):
         assert not isinstance(self.data, IdentityMatrix)
         if backend.__name__ == "firedrake":
@@ -299,16 +286,18 @@ class Matrix(libadjoint.Matrix):
         if not self.cache:
             return assemble(self.data)
         else:
-            if self.data in caching.assembled_adj_forms:
+            key = self.data if self.key is None else self.key
+            M = caching.assembled_adj_forms.get(key)
+            if M is not None:
                 if backend.parameters["adjoint"]["debug_cache"]:
                     backend.info_green("Got an assembly cache hit")
-                return caching.assembled_adj_forms[self.data]
+                return M
             else:
                 if backend.parameters["adjoint"]["debug_cache"]:
                     backend.info_red("Got an assembly cache miss")
 
                 M = assemble(self.data)
-                caching.assembled_adj_forms[self.data] = M
+                caching.assembled_adj_forms[key] = M
                 return M
 
     def basic_solve(self, var, b):
@@ -397,7 +386,8 @@ class Matrix(libadjoint.Matrix):
                     assembled_rhs = b.data
             [bc.apply(assembled_rhs) for bc in bcs]
 
-            if not var in caching.lu_solvers:
+            key = var if self.key is None else self.key
+            if not key in caching.lu_solvers:
                 if backend.parameters["adjoint"]["debug_cache"]:
                     backend.info_red("Got a cache miss for %s" % var)
 
@@ -409,14 +399,14 @@ class Matrix(libadjoint.Matrix):
                     [bc.apply(assembled_lhs) for bc in bcs]
 
                 solver_method = "mumps" if "mumps" in backend.lu_solver_methods().keys() else "default"
-                caching.lu_solvers[var] = compatibility.LUSolver(assembled_lhs,
+                caching.lu_solvers[key] = compatibility.LUSolver(assembled_lhs,
                         solver_method)
-                caching.lu_solvers[var].parameters["reuse_factorization"] = True
+                caching.lu_solvers[key].parameters["reuse_factorization"] = True
             else:
                 if backend.parameters["adjoint"]["debug_cache"]:
                     backend.info_green("Got a cache hit for %s" % var)
 
-            caching.lu_solvers[var].solve(output.data.vector(), assembled_rhs)
+            caching.lu_solvers[key].solve(output.data.vector(), assembled_rhs)
 
         return output
 
@@ -1,7 +1,13 @@
 import re
+import hashlib
+import collections
+import numpy
 import ufl.algorithms
 from ufl import Form
+import backend
 from backend import Constant
+from . import expressions
+from . import compatibility
 
 ### A general dictionary that applies a key function before lookup
 class KeyedDict(dict):
@@ -31,8 +37,8 @@ class KeyedDict(dict):
         def _comparable(key):
             # Form may be None when this is called during process cleanup
             if Form and isinstance(key, Form):
-                return form.signature()
-            return key
+                return key.signature()
+            return str(key)
         try:
             keys = self.keys()
             for k in sorted(keys, key=_comparable):
@@ -55,6 +61,10 @@ soa_to_adj = re.compile(r'\[(?P<func>Functional:.*?):.*\]')
 def lu_canonicalisation(var):
     # Return a string representation of var for indexing into the LU cache.
 
+    # Operators annotated with a canonical block key are already canonical
+    if isinstance(var, str):
+        return var
+
     s = str(var)
 
     # Since the SOA operator is always the same as the ADM, we can replace all
@@ -68,16 +78,193 @@ lu_solvers = KeyedDict(keyfunc=lu_canonicalisation)
 
 ### Stuff for preassembly caching
 
-def form_constants(form):
-    constants = tuple([float(x) for x in ufl.algorithms.extract_coefficients(form) if isinstance(x, Constant)])
-    return constants
+def _function_state(function):
+    # A unique id for function, and a counter which is increased whenever its
+    # values change
+    if backend.__name__ == "dolfin":
+        return (function.id(), backend.as_backend_type(function.vector()).vec().stateGet())
+    else:
+        return (function.count(), function.dat.dat_version)
+
+def form_fingerprint(form):
+    '''Return a digest of everything besides its signature that the assembly of form
+    depends on. The mesh and the coefficients are identified by their ids and, for
+    Functions, the state counter of their values, so that the fingerprint costs
+    O(1) per coefficient. Constants are identified by their values. The ids and
+    the state counters are changed by collective operations, and so agree across
+    processes. The dolfin mesh geometry is not part of the fingerprint, so the
+    cache must be cleared after a mesh is moved.'''
+
+    md5 = hashlib.md5()
+    for domain in form.ufl_domains():
+        md5.update(str(domain.ufl_id()).encode('utf8'))
+        if backend.__name__ != "dolfin":
+            md5.update(str(_function_state(domain.coordinates)).encode('utf8'))
+
+    for coeff in form.coefficients():
+        if isinstance(coeff, Constant):
+            md5.update(numpy.asarray(coeff.values(), dtype=numpy.float64).tobytes())
+        elif isinstance(coeff, compatibility.function_type) or isinstance(coeff, backend.MultiMeshFunction):
+            md5.update(str(_function_state(coeff)).encode('utf8'))
+        else:
+            # An Expression: identify it by the object and its recorded parameters
+            attrs = expressions.expression_attrs.get(coeff, ())
+            md5.update('{}{}'.format(hash(coeff), [(attr, repr(getattr(coeff, attr))) for attr in sorted(attrs)]).encode('utf8'))
+
+    return md5.hexdigest()
+
+def content_key(form):
+    # Operators annotated with a canonical block key are already canonical
+    if isinstance(form, str):
+        return form
+
+    return (form.signature(), form_fingerprint(form))
+
+def storage_bytes(tensor):
+    '''Estimate the storage of an assembled tensor in bytes: a double and a column
+    index per nonzero of a matrix, a double per entry of a vector. The estimate
+    is global, so that all processes evict the same entries.'''
+
+    if hasattr(tensor, "petscmat"):
+        info = tensor.petscmat.getInfo(tensor.petscmat.InfoType.GLOBAL_SUM)
+        return int(info["nz_used"]) * 12
+    elif hasattr(tensor, "nnz"):
+        return tensor.nnz() * 12
+    elif hasattr(tensor, "size"):
+        return tensor.size() * 8
+    else:
+        return 0
+
+class AssemblyCache(object):
+    '''A cache of assembled forms. Entries are keyed on the form signature and a
+    fingerprint of the coefficients (see form_fingerprint), so an entry stays
+    valid for as long as the data it was assembled from is unchanged, across any
+    number of functional evaluations. Once the stored tensors exceed the
+    parameters["adjoint"]["assembly_cache_size"] budget (in megabytes) the least
+    recently used entries are evicted.'''
+
+    def __init__(self, keyfunc=content_key):
+        self.keyfunc = keyfunc
+        self.entries = collections.OrderedDict()
+        self.nbytes = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def max_bytes(self):
+        return backend.parameters["adjoint"]["assembly_cache_size"] * 1024 * 1024
+
+    def _lookup(self, x):
+        key = self.keyfunc(x)
+        return (key, key in self.entries)
+
+    def _use(self, key):
+        # Mark the entry as the most recently used
+        (tensor, nbytes) = self.entries.pop(key)
+        self.entries[key] = (tensor, nbytes)
+        return tensor
+
+    def get(self, x):
+        '''Return the tensor assembled from x, or None on a cache miss.'''
+
+        (key, hit) = self._lookup(x)
+        if hit:
+            self.hits += 1
+            return self._use(key)
+        else:
+            self.misses += 1
+            return None
+
+    def __contains__(self, x):
+        return self._lookup(x)[1]
+
+    def __getitem__(self, x):
+        return self._use(self.keyfunc(x))
+
+    def __setitem__(self, x, tensor):
+        key = self.keyfunc(x)
+        if key in self.entries:
+            self.nbytes -= self.entries.pop(key)[1]
+
+        nbytes = storage_bytes(tensor)
+        self.entries[key] = (tensor, nbytes)
+        self.nbytes += nbytes
+
+        max_bytes = self.max_bytes()
+        while max_bytes > 0 and self.nbytes > max_bytes and len(self.entries) > 1:
+            (_, (_, evicted_nbytes)) = self.entries.popitem(last=False)
+            self.nbytes -= evicted_nbytes
+            self.evictions += 1
+
+    def __delitem__(self, x):
+        (_, nbytes) = self.entries.pop(self.keyfunc(x))
+        self.nbytes -= nbytes
+
+    def __len__(self):
+        return len(self.entries)
+
+    def clear_canonical(self):
+        '''Delete the entries stored under canonical block keys. These identify
+        an operator by the state at annotation time, and so are only valid until
+        the tape is replayed with new control values.'''
+
+        for key in [key for key in self.entries if isinstance(key, str)]:
+            (_, nbytes) = self.entries.pop(key)
+            self.nbytes -= nbytes
 
-def form_key(form):
-    constants = form_constants(form)
-    return (form, constants)
+    def clear(self):
+        ''' Delete all items, least recently used first. The order is the same
+            on all processes, which avoids MPI deadlocks when destroying the
+            assembled objects.'''
+        while len(self.entries) > 0:
+            self.entries.popitem(last=False)
+        self.nbytes = 0
+
+    def stats(self):
+        return {"entries": len(self.entries), "bytes": self.nbytes,
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def info(self):
+        backend.info("Assembly cache: %i entries, %i bytes, %i hits, %i misses, %i evictions" %
+                     (len(self.entries), self.nbytes, self.hits, self.misses, self.evictions))
 
 assembled_fwd_forms = set()
-assembled_adj_forms = KeyedDict(keyfunc=form_key)
+assembled_adj_forms = AssemblyCache()
+
+### Stuff for canonical block names
+
+def _coefficient_state(form):
+    # The values of the non-Function coefficients of form, which are not
+    # replaced on replay and hence determine the assembled operator.
+    state = []
+    for coeff in ufl.algorithms.extract_coefficients(form):
+        if isinstance(coeff, Constant):
+            state.append(tuple(coeff.values()))
+        elif coeff in expressions.expression_attrs:
+            attrs = expressions.expression_attrs[coeff]
+            state.append(tuple((attr, repr(getattr(coeff, attr))) for attr in sorted(attrs)))
+    return tuple(state)
+
+def operator_key(form, bcs, solver_parameters, matrix_class):
+    '''Return a string identifying the operator assembled from form. Structurally
+    identical solves (same form, boundary conditions and solver parameters) annotated
+    at different timesteps get the same key.'''
+
+    key = '{}{}{}{}{}'.format(hash(form), _coefficient_state(form),
+                              [hash(bc) for bc in bcs or []], solver_parameters,
+                              matrix_class.__name__).encode('utf8')
+    return hashlib.md5(key).hexdigest()
+
+def block_name(op_key, u, frozen_expressions, frozen_constants):
+    '''Return the name of the libadjoint.Block for the operator op_key solving for u.
+    The callbacks attached to a block restore the frozen expressions and constants,
+    so blocks may only be shared between solves that froze the same state.'''
+
+    frozen_state = (sorted((hash(e), repr(sorted(d.items()))) for e, d in frozen_expressions.items()),
+                    sorted((str(c.adj_name), repr(v)) for c, v in frozen_constants.items()))
+    key = '{}{}{}'.format(op_key, u, frozen_state).encode('utf8')
+    return hashlib.md5(key).hexdigest()
 
 ### Stuff for PointIntegralSolver caching
 pis_fwd_to_tlm = {}
@@ -85,3 +272,8 @@ pis_fwd_to_adj = {}
 
 # LocalSolver Cache
 localsolvers = {}
+
+# The L2 Riesz maps used to project gradients, keyed on the function space id,
+# from least to most recently used
+l2_riesz_maps = collections.OrderedDict()
+max_l2_riesz_maps = 8
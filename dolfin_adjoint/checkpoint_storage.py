@@ -0,0 +1,230 @@
+import os
+import zlib
+import atexit
+import collections
+import multiprocessing.pool
+import tempfile
+import threading
+import numpy
+import backend
+from . import compatibility
+
+try:
+    import blosc
+except ImportError:
+    blosc = None
+
+def _compress(array):
+    data = numpy.ascontiguousarray(array)
+    if blosc is not None:
+        return blosc.compress(data.tobytes(), typesize=data.itemsize, cname="zstd")
+    else:
+        return zlib.compress(data.tobytes(), 1)
+
+def _decompress(data, dtype, shape):
+    if blosc is not None:
+        data = blosc.decompress(data)
+    else:
+        data = zlib.decompress(data)
+    return numpy.frombuffer(data, dtype=dtype).reshape(shape).copy()
+
+# The maximum number of queued background writes
+_max_pending_writes = 4
+
+class TieredStorage(object):
+    '''Storage for the local dof arrays of the variables libadjoint checkpoints
+    to disk. Arrays are kept in three tiers: as raw arrays in memory, as
+    losslessly compressed blocks in memory, and in a single append-only file per
+    process, created with a unique name in dirname. New and recently read arrays are raw; once the memory tiers exceed
+    the parameters["adjoint"]["checkpoint_memory_budget"] budget (in megabytes)
+    the least recently used raw arrays are compressed, and once there are no raw
+    arrays left the least recently used compressed blocks are written to disk.
+    If parameters["adjoint"]["asynchronous_checkpoint_writes"] is set the disk
+    writes are performed, in order, by a single background thread, and reading a
+    block waits for its write to complete. Space in the file freed by reading or
+    deleting blocks is reclaimed by compacting the file once at least half of it
+    is unused. The file is removed by clear, and at interpreter exit.'''
+
+    def __init__(self, dirname="."):
+        self.dirname = dirname
+
+        self.raw = collections.OrderedDict()
+        self.compressed = collections.OrderedDict()
+        self.on_disk = {}
+        self.nbytes = 0
+
+        self.file = None
+        self.file_name = None
+        self.file_size = 0
+        self.file_live = 0
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pending = collections.OrderedDict()
+
+        atexit.register(self._close_file)
+
+    def max_bytes(self):
+        return backend.parameters["adjoint"]["checkpoint_memory_budget"] * 1024 * 1024
+
+    def _open_file(self):
+        (fd, filename) = tempfile.mkstemp(prefix="adjoint_checkpoints-%i-" % compatibility.rank(backend.comm_world),
+                                          suffix=".bin", dir=self.dirname)
+        return (os.fdopen(fd, "w+b"), filename)
+
+    def _close_file(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            try:
+                os.remove(self.file_name)
+            except OSError:
+                pass
+            self.file_name = None
+        self.file_size = 0
+        self.file_live = 0
+
+    def _write(self, offset, data):
+        with self.lock:
+            self.file.seek(offset)
+            self.file.write(data)
+
+    def _append(self, key, data):
+        if self.file is None:
+            (self.file, self.file_name) = self._open_file()
+        offset = self.file_size
+        self.file_size += len(data)
+        self.file_live += len(data)
+
+        if backend.parameters["adjoint"]["asynchronous_checkpoint_writes"]:
+            if self.pool is None:
+                self.pool = multiprocessing.pool.ThreadPool(1)
+            while len(self.pending) >= _max_pending_writes:
+                self._wait(next(iter(self.pending)))
+            self.pending[key] = self.pool.apply_async(self._write, (offset, data))
+        else:
+            self._write(offset, data)
+        return (offset, len(data))
+
+    def _wait(self, key=None):
+        '''Wait for the pending write of key, or for all pending writes if key is None.'''
+        if key is None:
+            keys = list(self.pending.keys())
+        elif key in self.pending:
+            keys = [key]
+        else:
+            keys = []
+        for key in keys:
+            try:
+                self.pending.pop(key).get()
+            except Exception as e:
+                raise IOError("Background checkpoint write failed: %s" % e)
+
+    def _load(self, key, offset, length):
+        self._wait(key)
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(length)
+
+    def _demote(self):
+        if len(self.raw) > 0:
+            (key, array) = self.raw.popitem(last=False)
+            data = _compress(array)
+            self.compressed[key] = (data, array.dtype, array.shape)
+            self.nbytes += len(data) - array.nbytes
+        else:
+            (key, (data, dtype, shape)) = self.compressed.popitem(last=False)
+            self.on_disk[key] = self._append(key, data) + (dtype, shape)
+            self.nbytes -= len(data)
+
+    def _balance(self):
+        max_bytes = self.max_bytes()
+        while max_bytes > 0 and self.nbytes > max_bytes and len(self.raw) + len(self.compressed) > 0:
+            self._demote()
+
+    def __contains__(self, key):
+        return key in self.raw or key in self.compressed or key in self.on_disk
+
+    def __setitem__(self, key, array):
+        if key in self:
+            del self[key]
+
+        array = numpy.array(array, copy=True)
+        self.raw[key] = array
+        self.nbytes += array.nbytes
+        self._balance()
+
+    def __getitem__(self, key):
+        if key in self.raw:
+            array = self.raw.pop(key)
+        elif key in self.compressed:
+            (data, dtype, shape) = self.compressed.pop(key)
+            self.nbytes -= len(data)
+            array = _decompress(data, dtype, shape)
+            self.nbytes += array.nbytes
+        else:
+            (offset, length, dtype, shape) = self.on_disk.pop(key)
+            array = _decompress(self._load(key, offset, length), dtype, shape)
+            self.nbytes += array.nbytes
+            self.file_live -= length
+            self._compact()
+
+        # Promote the array to the most recently used raw entry
+        self.raw[key] = array
+        self._balance()
+        return array
+
+    def __delitem__(self, key):
+        if key in self.raw:
+            self.nbytes -= self.raw.pop(key).nbytes
+        elif key in self.compressed:
+            self.nbytes -= len(self.compressed.pop(key)[0])
+        else:
+            self.file_live -= self.on_disk.pop(key)[1]
+            self._compact()
+
+    def __len__(self):
+        return len(self.raw) + len(self.compressed) + len(self.on_disk)
+
+    def _compact(self):
+        # The file is append-only, so space freed by reading or deleting blocks
+        # is reclaimed by copying the live blocks to a new file once at least
+        # half of the file is unused
+        if self.file is None or self.file_size == 0 or 2 * self.file_live > self.file_size:
+            return
+
+        self._wait()
+        if self.file_live == 0:
+            self.file.seek(0)
+            self.file.truncate()
+            self.file_size = 0
+            return
+
+        (file, filename) = self._open_file()
+        offset = 0
+        for key in sorted(self.on_disk.keys(), key=lambda key: self.on_disk[key][0]):
+            (block_offset, length, dtype, shape) = self.on_disk[key]
+            self.file.seek(block_offset)
+            file.write(self.file.read(length))
+            self.on_disk[key] = (offset, length, dtype, shape)
+            offset += length
+        self._close_file()
+        (self.file, self.file_name) = (file, filename)
+        self.file_size = self.file_live = offset
+
+    def clear(self):
+        self._wait()
+        self.raw.clear()
+        self.compressed.clear()
+        self.on_disk.clear()
+        self.nbytes = 0
+
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+
+        self._close_file()
+
+    def stats(self):
+        return {"raw": len(self.raw), "compressed": len(self.compressed),
+                "disk": len(self.on_disk), "bytes": self.nbytes}
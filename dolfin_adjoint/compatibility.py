@@ -142,6 +142,29 @@ def gather(vec):
 
     return arr
 
+def local_array(vec):
+    """Return the locally owned values of a distributed vector or Function. Where the
+    backend exposes its storage this is a view, so no data are copied."""
+    if backend.__name__ == "dolfin":
+        if isinstance(vec, cpp.Function):
+            vec = vec.vector()
+
+        try:
+            return backend.as_backend_type(vec).vec().array
+        except (AttributeError, ImportError, RuntimeError):
+            return vec.get_local()
+    else:
+        return vec.dat.data
+
+def allreduce(comm, value, op="sum"):
+    """Reduce a scalar over all processes of comm. op is one of "sum", "max" and "min"."""
+    if backend.__name__ == "dolfin":
+        return getattr(backend.MPI, op)(comm, value)
+    else:
+        from mpi4py import MPI
+        ops = {"sum": MPI.SUM, "max": MPI.MAX, "min": MPI.MIN}
+        return comm.allreduce(value, op=ops[op])
+
 if backend.__name__ == "dolfin":
     from backend import LUSolver
 else:
@@ -171,6 +194,21 @@ def rank(comm):
         return comm.rank
 
 
+def size(comm):
+    if backend.__name__ == "dolfin":
+        return backend.MPI.size(comm)
+    else:
+        return comm.size
+
+
+def function_comm(function):
+    """Return the communicator associated with a function."""
+    if backend.__name__ == "dolfin":
+        return function.function_space().mesh().mpi_comm()
+    else:
+        return function.comm
+
+
 def form_comm(form):
     """Return the communicator associated with a form."""
     if backend.__name__ == "dolfin":
@@ -11,6 +11,10 @@ from .enlisting import enlist, delist
 from numpy import ndarray
 from .functional import Functional
 from . import misc
+from . import adjlinalg
+from . import caching
+from .memo_store import value_hash
+from .optimization import riesz_maps
 
 def replay_dolfin(forget=False, tol=0.0, stop=False):
 
@@ -188,13 +192,17 @@ def rename(J, dJdparam, param):
 
 def project_test(func):
     if isinstance(func, backend.Function):
+        # The L2 Riesz maps keep the factorised mass matrices of the most recently
+        # used function spaces. They are discarded by adj_reset_cache.
         V = func.function_space()
-        u = backend.TrialFunction(V)
-        v = backend.TestFunction(V)
-        M = backend.assemble(backend.inner(u, v)*backend.dx)
-        proj = backend.Function(V)
-        backend.solve(M, proj.vector(), func.vector())
-        return proj
+        if V.id() in caching.l2_riesz_maps:
+            l2_map = caching.l2_riesz_maps.pop(V.id())
+        else:
+            l2_map = riesz_maps.L2(V)
+        caching.l2_riesz_maps[V.id()] = l2_map
+        while len(caching.l2_riesz_maps) > caching.max_l2_riesz_maps:
+            caching.l2_riesz_maps.popitem(last=False)
+        return l2_map.apply_inverse(func)
     else:
         return func
 
@@ -216,101 +224,210 @@ def hessian(J, m, warn=True):
         H = BasicHessian(J, m, warn=warn)
     return H
 
+class HessianDirection(ListControl):
+    '''A perturbation of the controls used by a Hessian action. The k-th direction of every
+    action has the same name, so libadjoint overwrites the tangent linear and second-order
+    adjoint solutions of the previous action instead of keeping them alongside the new ones.'''
+    def __init__(self, controls, k):
+        ListControl.__init__(self, controls)
+        self.k = k
+
+    def __str__(self):
+        return "HessianDirection%i" % self.k
+
 class BasicHessian(libadjoint.Matrix):
     '''A basic implementation of the Hessian class that recomputes the tangent linear, adjoint and second-order adjoint
-    equations on each action. Should be the slowest, but safest, with the lowest memory requirements.'''
+    equations on each action. Should be the slowest, but safest, with the lowest memory requirements.
+
+    If parameters["adjoint"]["cache_hessian_adjoint"] is set, the adjoint solutions computed by the last
+    derivative or Hessian action are kept, and reused by subsequent actions at the same control values.
+    Copies of adjoint solutions which libadjoint does not keep are limited to
+    parameters["adjoint"]["hessian_adjoint_cache_size"] megabytes, and adjoint solutions beyond this are
+    recomputed. The tangent linear solutions of each action are not checkpointed, and are held for
+    the whole action.'''
     def __init__(self, J, m, warn=True):
         self.J = J
 
         self.enlisted_controls = enlist(m)
         self.m = ListControl(self.enlisted_controls)
 
+        self.adjoint_cache = {}
+        self.adjoint_cache_bytes = 0
+        self.adjoint_key = None
+
         if warn:
             backend.info_red("Warning: Hessian computation is still experimental and is known to not work for some problems. Please Taylor test thoroughly.")
 
     def __call__(self, m_dot, project=False):
+        return self.block([m_dot], project=project)[0]
+
+    def control_key(self):
+        '''Return a hash of the current control values, which identifies the point at which
+        cached adjoint solutions were computed.'''
+        return value_hash(self.m.data())
+
+    def record_adjoint(self, key, adj_var, adj, held=False):
+        '''Cache the adjoint solution adj of adj_var, computed at the control values identified
+        by key. If held is True then libadjoint keeps its own value of adj_var, and only the
+        control values at which it was computed are recorded. Solutions cached at other control
+        values are discarded.'''
+        if not parameters["adjoint"]["cache_hessian_adjoint"]:
+            return
+
+        if key != self.adjoint_key:
+            self.clear_adjoint_cache()
+            self.adjoint_key = key
+
+        old = self.adjoint_cache.pop(str(adj_var), None)
+        if old is not None:
+            self.adjoint_cache_bytes -= self.adjoint_nbytes(old.data)
+
+        if held:
+            self.adjoint_cache[str(adj_var)] = None
+        else:
+            nbytes = self.adjoint_nbytes(adj)
+            max_bytes = parameters["adjoint"]["hessian_adjoint_cache_size"] * 1024 * 1024
+            if max_bytes > 0 and self.adjoint_cache_bytes + nbytes > max_bytes:
+                # Over budget: the adjoint solution is recomputed when needed
+                return
+            if isinstance(adj, backend.Function):
+                adj = adj.copy(deepcopy=True)
+            self.adjoint_cache[str(adj_var)] = adjlinalg.Vector(adj)
+            self.adjoint_cache_bytes += nbytes
+
+    def clear_adjoint_cache(self):
+        '''Discard all cached adjoint solutions.'''
+        self.adjoint_cache.clear()
+        self.adjoint_cache_bytes = 0
+
+    def adjoint_nbytes(self, adj):
+        if isinstance(adj, backend.Function):
+            return adj.vector().local_size() * 8
+        return 8
+
+    def block(self, m_dots, project=False):
+        '''Compute the Hessian actions in each of the directions m_dots. The tangent linear and
+        second-order adjoint equations for all directions are solved equation by equation, so that
+        the forward and first-order adjoint solutions of each equation are fetched once for all
+        directions. libadjoint assembles and solves each equation for each direction separately, so
+        there is no multi-RHS solve: operators and factorisations are only shared between directions
+        through the assembly cache and, if parameters["adjoint"]["cache_factorizations"] is set, the
+        factorisation cache. Otherwise the cost is that of one Hessian action per direction.'''
         flag = misc.pause_annotation()
         hess_action_timer = backend.Timer("Hessian action")
 
-        m_p = self.m.set_perturbation(m_dot)
+        m_ps = [HessianDirection(self.m.set_perturbation(m_dot).controls, k) for (k, m_dot) in enumerate(m_dots)]
+        key = self.control_key() if parameters["adjoint"]["cache_hessian_adjoint"] else None
+        if key is not None and key != self.adjoint_key:
+            # The adjoint values held by libadjoint were computed at other control values
+            self.clear_adjoint_cache()
+            self.adjoint_key = key
         last_timestep = adjglobals.adjointer.timestep_count
 
-        m_dot = enlist(m_dot)
-        Hm = []
-        for m_dot_cmp in m_dot:
-            if hasattr(m_dot_cmp, 'function_space'):
-                Hm.append(backend.Function(m_dot_cmp.function_space()))
-            elif isinstance(m_dot_cmp, float):
-                Hm.append(0.0)
-            else:
-                raise NotImplementedError("Sorry, don't know how to handle this")
+        m_dots = [enlist(m_dot) for m_dot in m_dots]
+        Hms = []
+        for m_dot in m_dots:
+            Hm = []
+            for m_dot_cmp in m_dot:
+                if hasattr(m_dot_cmp, 'function_space'):
+                    Hm.append(backend.Function(m_dot_cmp.function_space()))
+                elif isinstance(m_dot_cmp, float):
+                    Hm.append(0.0)
+                else:
+                    raise NotImplementedError("Sorry, don't know how to handle this")
+            Hms.append(Hm)
 
         tlm_timer = backend.Timer("Hessian action (TLM)")
-        # run the tangent linear model
-        for (tlm, tlm_var) in compute_tlm(m_p, forget=None):
-            pass
+        # run the tangent linear models
+        for i in range(adjglobals.adjointer.equation_count):
+            for m_p in m_ps:
+                (tlm_var, output) = adjglobals.adjointer.get_tlm_solution(i, m_p)
+                if output.data:
+                    output.data.rename(str(tlm_var), "a Function from dolfin-adjoint")
+
+                storage = libadjoint.MemoryStorage(output)
+                storage.set_overwrite(True)
+                adjglobals.adjointer.record_variable(tlm_var, storage)
 
         tlm_timer.stop()
 
+        def hess_inner(Hm, out):
+            assert len(out) == len(Hm)
+            for i in range(len(out)):
+                if out[i] is not None:
+                    if isinstance(Hm[i], backend.Function):
+                        Hm[i].vector().axpy(1.0, out[i].vector())
+                    elif isinstance(Hm[i], float):
+                        Hm[i] += out[i]
+                    else:
+                        raise ValueError("Do not know what to do with this")
+            return Hm
+
         # run the adjoint and second-order adjoint equations.
         for i in range(adjglobals.adjointer.equation_count)[::-1]:
             adj_var = adjglobals.adjointer.get_forward_variable(i).to_adjoint(self.J)
-            # Only recompute the adjoint variable if we do not have it yet
-            try:
-                adj = adjglobals.adjointer.get_variable_value(adj_var)
-            except (libadjoint.exceptions.LibadjointErrorHashFailed, libadjoint.exceptions.LibadjointErrorNeedValue):
+            # Only recompute the adjoint variable if we do not have it yet. With the cache, only
+            # values computed at the current control values are used.
+            adj = None
+            if key is None or str(adj_var) in self.adjoint_cache:
+                if key is not None:
+                    adj = self.adjoint_cache[str(adj_var)]
+                if adj is None:
+                    try:
+                        adj = adjglobals.adjointer.get_variable_value(adj_var)
+                    except (libadjoint.exceptions.LibadjointErrorHashFailed, libadjoint.exceptions.LibadjointErrorNeedValue):
+                        pass
+            if adj is None:
                 adj_timer = backend.Timer("Hessian action (ADM)")
                 adj = adjglobals.adjointer.get_adjoint_solution(i, self.J)[1]
                 adj_timer.stop()
 
-                storage = libadjoint.MemoryStorage(adj)
-                adjglobals.adjointer.record_variable(adj_var, storage)
+            if key is not None:
+                # The adjoint value is recorded with libadjoint below
+                self.record_adjoint(key, adj_var, adj.data, held=True)
+
+            storage = libadjoint.MemoryStorage(adj)
+            storage.set_overwrite(True)
+            adjglobals.adjointer.record_variable(adj_var, storage)
 
             adj = adj.data
 
-            soa_timer = backend.Timer("Hessian action (SOA)")
-            (soa_var, soa_vec) = adjglobals.adjointer.get_soa_solution(i, self.J, m_p)
-            soa_timer.stop()
-            soa = soa_vec.data
-
-            def hess_inner(Hm, out):
-                assert len(out) == len(Hm)
-                for i in range(len(out)):
-                    if out[i] is not None:
-                        if isinstance(Hm[i], backend.Function):
-                            Hm[i].vector().axpy(1.0, out[i].vector())
-                        elif isinstance(Hm[i], float):
-                            Hm[i] += out[i]
-                        else:
-                            raise ValueError("Do not know what to do with this")
-                return Hm
-
-            func_timer = backend.Timer("Hessian action (derivative formula)")
-            # now implement the Hessian action formula.
-            out = self.m.equation_partial_derivative(adjglobals.adjointer, soa, i, soa_var.to_forward())
-            Hm = hess_inner(Hm, out)
-
-            out = self.m.equation_partial_second_derivative(adjglobals.adjointer, adj, i, soa_var.to_forward(), m_dot)
-            Hm = hess_inner(Hm, out)
-
-            if last_timestep > adj_var.timestep:
-                # We have hit a new timestep, and need to compute this timesteps' \partial^2 J/\partial m^2 contribution
+            new_timestep = last_timestep > adj_var.timestep
+            if new_timestep:
                 last_timestep = adj_var.timestep
-                out = self.m.functional_partial_second_derivative(adjglobals.adjointer, self.J, adj_var.timestep, m_dot)
-                Hm = hess_inner(Hm, out)
 
-            func_timer.stop()
+            for (k, m_p) in enumerate(m_ps):
+                soa_timer = backend.Timer("Hessian action (SOA)")
+                (soa_var, soa_vec) = adjglobals.adjointer.get_soa_solution(i, self.J, m_p)
+                soa_timer.stop()
+                soa = soa_vec.data
 
-            storage = libadjoint.MemoryStorage(soa_vec)
-            storage.set_overwrite(True)
-            adjglobals.adjointer.record_variable(soa_var, storage)
+                func_timer = backend.Timer("Hessian action (derivative formula)")
+                # now implement the Hessian action formula.
+                out = self.m.equation_partial_derivative(adjglobals.adjointer, soa, i, soa_var.to_forward())
+                Hms[k] = hess_inner(Hms[k], out)
+
+                out = self.m.equation_partial_second_derivative(adjglobals.adjointer, adj, i, soa_var.to_forward(), m_dots[k])
+                Hms[k] = hess_inner(Hms[k], out)
+
+                if new_timestep:
+                    # We have hit a new timestep, and need to compute this timesteps' \partial^2 J/\partial m^2 contribution
+                    out = self.m.functional_partial_second_derivative(adjglobals.adjointer, self.J, adj_var.timestep, m_dots[k])
+                    Hms[k] = hess_inner(Hms[k], out)
+
+                func_timer.stop()
+
+                storage = libadjoint.MemoryStorage(soa_vec)
+                storage.set_overwrite(True)
+                adjglobals.adjointer.record_variable(soa_var, storage)
 
-        for Hm_cmp in Hm:
-            if isinstance(Hm_cmp, backend.Function):
-                Hm_cmp.rename("d^2(%s)/d(%s)^2" % (str(self.J), str(self.m)), "a Function from dolfin-adjoint")
+        for Hm in Hms:
+            for Hm_cmp in Hm:
+                if isinstance(Hm_cmp, backend.Function):
+                    Hm_cmp.rename("d^2(%s)/d(%s)^2" % (str(self.J), str(self.m)), "a Function from dolfin-adjoint")
 
         misc.continue_annotation(flag)
-        return postprocess(Hm, project, list_type=self.enlisted_controls)
+        return [postprocess(Hm, project, list_type=self.enlisted_controls) for Hm in Hms]
 
     def action(self, x, y):
         assert isinstance(x.data, backend.Function)
@@ -0,0 +1,94 @@
+import numpy as np
+from .reduced_functional_numpy import ReducedFunctionalNumPy
+
+class Ensemble(object):
+    ''' Splits the processes of comm into ensemble members of M processes each.
+
+    Each member runs its own copy of the model on the spatial communicator
+    ensemble.comm, so the tape annotated by every process is a replica of the
+    tape of the other members:
+
+    ensemble = Ensemble(M=4)
+    mesh = UnitSquareMesh(ensemble.comm, 64, 64)
+
+    The processes with the same rank in ensemble.comm are connected by
+    ensemble.ensemble_comm, over which the results of the members are
+    exchanged. '''
+
+    def __init__(self, M, comm=None):
+        from mpi4py import MPI
+
+        if comm is None:
+            comm = MPI.COMM_WORLD
+
+        if M < 1 or comm.size % M != 0:
+            raise ValueError("Cannot split %i processes into ensemble members of %i processes." % (comm.size, M))
+
+        self.global_comm = comm
+        self.comm = comm.Split(color=comm.rank // M, key=comm.rank)
+        self.ensemble_comm = comm.Split(color=comm.rank % M, key=comm.rank)
+
+    @property
+    def member(self):
+        ''' The index of the ensemble member of this process. '''
+        return self.ensemble_comm.rank
+
+    @property
+    def members(self):
+        ''' The number of ensemble members. '''
+        return self.ensemble_comm.size
+
+    def map(self, f, xs):
+        ''' Return the list of f(x) for each x in xs. The evaluations are dealt
+            out to the members round-robin, and the results exchanged so that every
+            process returns all of them. '''
+
+        local = [(i, f(xs[i])) for i in range(self.member, len(xs), self.members)]
+
+        results = [None]*len(xs)
+        for member_results in self.ensemble_comm.allgather(local):
+            for (i, result) in member_results:
+                results[i] = result
+        return results
+
+    def bcast(self, f):
+        ''' Overwrite the values of the Function f with those of f on the first
+            member. '''
+
+        values = self.ensemble_comm.bcast(f.vector().get_local(), root=0)
+        f.vector().set_local(values)
+        f.vector().apply("insert")
+
+class EnsembleReducedFunctional(object):
+    ''' Evaluates a reduced functional at a batch of control values, sharing the
+    evaluations between the members of an ensemble.
+
+    rf is the ReducedFunctional of the tape annotated by this process, on the
+    spatial communicator of its ensemble member. Control values are passed as
+    arrays of scalars, laid out as by ReducedFunctionalNumPy. The evaluations
+    are shared out with Ensemble.map, so each member replays its own tape and
+    every process returns the values (and gradients) at all control values. '''
+
+    def __init__(self, rf, ensemble):
+        if not isinstance(rf, ReducedFunctionalNumPy):
+            rf = ReducedFunctionalNumPy(rf)
+
+        self.rf = rf
+        self.ensemble = ensemble
+
+    def __call__(self, m_arrays):
+        ''' Return the array of functional values at each of the control values
+            in m_arrays. '''
+
+        return np.array(self.ensemble.map(self.rf, m_arrays))
+
+    def value_and_gradient(self, m_arrays, forget=True, project=False):
+        ''' Return the array of functional values and the list of gradients at
+            each of the control values in m_arrays. '''
+
+        results = self.ensemble.map(lambda m_array: self.rf.value_and_gradient(m_array, forget=forget, project=project), m_arrays)
+
+        return (np.array([j for (j, dj) in results]), [dj for (j, dj) in results])
+
+    def get_controls(self):
+        return self.rf.get_controls()
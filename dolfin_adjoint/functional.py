@@ -82,6 +82,12 @@ class Functional(libadjoint.Functional):
         self.verbose = verbose
         self.name = name
 
+        # The compiled terms used to evaluate the functional
+        self._compiled_terms = {}
+        # The coefficients of each term known to the adjointer, and their
+        # libadjoint variables
+        self._term_dependencies = {}
+
     def __add__(self, other):
         timeform = self.timeform + other.timeform
         verbose = self.verbose or other.verbose
@@ -113,19 +119,12 @@ class Functional(libadjoint.Functional):
 
     def __call__(self, adjointer, timestep, dependencies, values):
 
-        functional_value = self._substitute_form(adjointer, timestep, dependencies, values)
+        functional_value = None
+        for (term, weight, replace) in self._substitutions(adjointer, timestep, dependencies, values):
+            functional_value = _add(functional_value, self._assemble_term(term, weight, replace))
 
         if functional_value is not None:
-            args = ufl.algorithms.extract_arguments(functional_value)
-            if len(args) > 0:
-                backend.info_red("The form passed into Functional must be rank-0 (a scalar)! You have passed in a rank-%s form." % len(args))
-                raise libadjoint.exceptions.LibadjointErrorInvalidInputs
-
-            from .utils import _has_multimesh
-            if _has_multimesh(functional_value):
-                return backend.assemble_multimesh(functional_value)
-            else:
-                return backend.assemble(functional_value)
+            return functional_value
         else:
             return 0.0
 
@@ -179,11 +178,27 @@ class Functional(libadjoint.Functional):
         ''' Perform the substitution of the dependencies and values
         provided. This is common to __call__ and __derivative__'''
 
+        functional_value = None
+        for (term, weight, replace) in self._substitutions(adjointer, timestep, dependencies, values):
+            for (coeff, combination) in replace.items():
+                replace[coeff] = _combine(combination)
+
+            form = term.form if weight is None else weight*term.form
+            functional_value = _add(functional_value, backend.replace(form, replace))
+
+        return functional_value
+
+    def _substitutions(self, adjointer, timestep, dependencies, values):
+        ''' Yield the terms of the functional contributing at the given timestep,
+        as tuples (term, weight, replace). weight is the quadrature weight of the
+        term, or None for point evaluations, and replace maps each coefficient of
+        the term to the linear combination of values substituted for it, as a list
+        of (factor, Function) pairs.'''
+
         deps = {}
         for dep, val in zip(dependencies, values):
             deps[str(dep)] = val.data
 
-        functional_value = None
         final_time = _time_levels(adjointer, adjointer.timestep_count - 1)[1]
 
         # Get the necessary timestep information about the adjointer.
@@ -211,27 +226,30 @@ class Functional(libadjoint.Functional):
                         # Dependency replacement dictionary.
                         replace={}
 
-                        term_deps = _coeffs(adjointer, term.form)
-                        term_vars = _vars(adjointer, term.form)
+                        (term_deps, term_vars) = self._dependencies_of(adjointer, term)
 
                         for term_dep, term_var in zip(term_deps,term_vars):
                             this_var = self.get_vars(adjointer, timestep, term_var)[iteration]
-                            replace[term_dep] = deps[str(this_var)]
+                            replace[term_dep] = [(1.0, deps[str(this_var)])]
 
                         # Trapezoidal rule over given interval.
                         quad_weight = 0.5*(this_interval.stop-this_interval.start)
 
-                        return backend.replace(quad_weight*term.form, replace)
+                        return (term, quad_weight, replace)
 
                 # Calculate the integral contribution from the previous time level.
-                functional_value = _add(functional_value, trapezoidal(integral_interval, 0))
+                substitution = trapezoidal(integral_interval, 0)
+                if substitution is not None:
+                    yield substitution
 
                 # On the final occasion, also calculate the contribution from the
                 # current time level.
                 if adjointer.finished and timestep == adjointer.timestep_count - 1: # we're at the end, and need to add the extra terms
                                                                                     # associated with that
                     final_interval = slice(timestep_start, timestep_end)
-                    functional_value = _add(functional_value, trapezoidal(final_interval, 1))
+                    substitution = trapezoidal(final_interval, 1)
+                    if substitution is not None:
+                        yield substitution
 
             else:
                 # Point evaluation.
@@ -239,44 +257,86 @@ class Functional(libadjoint.Functional):
                 if point_interval.start < term.time < point_interval.stop:
                     replace = {}
 
-                    term_deps = _coeffs(adjointer, term.form)
-                    term_vars = _vars(adjointer, term.form)
+                    (term_deps, term_vars) = self._dependencies_of(adjointer, term)
 
                     for term_dep, term_var in zip(term_deps, term_vars):
                         (start, end) = self.get_vars(adjointer, timestep, term_var)
                         theta = float(1.0 - (term.time - point_interval.start)/(point_interval.stop - point_interval.start))
-                        replace[term_dep] = theta*deps[str(start)] + (1-theta)*deps[str(end)]
+                        replace[term_dep] = [(theta, deps[str(start)]), (1-theta, deps[str(end)])]
 
-                    functional_value = _add(functional_value, backend.replace(term.form, replace))
+                    yield (term, None, replace)
 
                 # Special case for evaluation at the end of time: we can't pass over to the
                 # right-hand timestep, so have to do it here.
                 elif (term.time == final_time or isinstance(term.time, FinishTimeConstant)) and point_interval.stop == final_time:
                     replace = {}
 
-                    term_deps = _coeffs(adjointer, term.form)
-                    term_vars = _vars(adjointer, term.form)
+                    (term_deps, term_vars) = self._dependencies_of(adjointer, term)
 
                     for term_dep, term_var in zip(term_deps, term_vars):
                         end = self.get_vars(adjointer, timestep, term_var)[1]
-                        replace[term_dep] = deps[str(end)]
+                        replace[term_dep] = [(1.0, deps[str(end)])]
 
-                    functional_value = _add(functional_value, backend.replace(term.form, replace))
+                    yield (term, None, replace)
 
                 # Another special case for the start of a timestep.
                 elif (isinstance(term.time, StartTimeConstant) and timestep == 0) or point_interval.start == term.time:
                     replace = {}
 
-                    term_deps = _coeffs(adjointer, term.form)
-                    term_vars = _vars(adjointer, term.form)
+                    (term_deps, term_vars) = self._dependencies_of(adjointer, term)
 
                     for term_dep, term_var in zip(term_deps, term_vars):
                         end = self.get_vars(adjointer, timestep, term_var)[0]
-                        replace[term_dep] = deps[str(end)]
+                        replace[term_dep] = [(1.0, deps[str(end)])]
+
+                    yield (term, None, replace)
+
+    def _dependencies_of(self, adjointer, term):
+        ''' Return the coefficients of term known to the adjointer, and their
+        libadjoint variables. These are computed once per term, and recomputed
+        only once further equations have been annotated. The variables are
+        shared, and must be copied before they are modified.'''
+
+        equation_count = adjointer.equation_count
+        if id(term) not in self._term_dependencies or self._term_dependencies[id(term)][0] != equation_count:
+            self._term_dependencies[id(term)] = (equation_count, _coeffs(adjointer, term.form), _vars(adjointer, term.form))
+        return self._term_dependencies[id(term)][1:]
+
+    def _assemble_term(self, term, weight, replace):
+        ''' Assemble a term of the functional with the given substitution. Each
+        term is compiled once, with a slot Function in place of each substituted
+        coefficient, so that evaluating it only copies the values into the slots
+        and assembles the compiled form.'''
+
+        from .utils import _has_multimesh
+        if _has_multimesh(term.form):
+            form = term.form if weight is None else weight*term.form
+            for (coeff, combination) in replace.items():
+                replace[coeff] = _combine(combination)
+            return backend.assemble_multimesh(backend.replace(form, replace))
+
+        key = (id(term), tuple(sorted(coeff.count() for coeff in replace)))
+        if key not in self._compiled_terms:
+            args = ufl.algorithms.extract_arguments(term.form)
+            if len(args) > 0:
+                backend.info_red("The form passed into Functional must be rank-0 (a scalar)! You have passed in a rank-%s form." % len(args))
+                raise libadjoint.exceptions.LibadjointErrorInvalidInputs
 
-                    functional_value = _add(functional_value, backend.replace(term.form, replace))
+            slots = dict((coeff, backend.Function(coeff.function_space())) for coeff in replace)
+            form = backend.replace(term.form, slots)
+            if hasattr(backend, "Form"):
+                form = backend.Form(form)
+            self._compiled_terms[key] = (term, slots, form)
 
-        return functional_value
+        (term, slots, form) = self._compiled_terms[key]
+        for (coeff, combination) in replace.items():
+            slot = slots[coeff].vector()
+            slot.zero()
+            for (factor, value) in combination:
+                slot.axpy(factor, value.vector())
+
+        value = backend.assemble(form)
+        return value if weight is None else weight*value
 
     def get_vars(self, adjointer, timestep, model):
         # Using the adjointer, get the start and end variables associated
@@ -328,22 +388,22 @@ class Functional(libadjoint.Functional):
                 # Get adj_variables for dependencies. Time level is not yet specified.
 
                 if _slice_intersect(integral_interval, term.time):
-                    integral_deps.update(_vars(adjointer, term.form))
+                    integral_deps.update(var.copy() for var in self._dependencies_of(adjointer, term)[1])
 
             else:
 
                 # Point evaluation.
                 if point_interval.start < term.time < point_interval.stop:
-                    point_deps.update(_vars(adjointer, term.form))
+                    point_deps.update(var.copy() for var in self._dependencies_of(adjointer, term)[1])
 
                 # Special case for evaluation at the end of time: we can't pass over to the
                 # right-hand timestep, so have to do it here.
                 elif (term.time == final_time or isinstance(term.time, FinishTimeConstant)) and point_interval.stop == final_time:
-                    final_deps.update(_vars(adjointer, term.form))
+                    final_deps.update(var.copy() for var in self._dependencies_of(adjointer, term)[1])
 
                 # Another special case for evaluation at the START_TIME, or the start of the timestep.
                 elif (isinstance(term.time, StartTimeConstant) and timestep == 0) or point_interval.start == term.time:
-                    start_deps.update(_vars(adjointer, term.form))
+                    start_deps.update(var.copy() for var in self._dependencies_of(adjointer, term)[1])
 
         integral_deps = list(integral_deps)
         point_deps = list(point_deps)
@@ -426,6 +486,15 @@ def _coeffs(adjointer, form):
             for coeff in ufl.algorithms.extract_coefficients(form)
             if (hasattr(coeff, "function_space")) and adjointer.variable_known(adjglobals.adj_variables[coeff])]
 
+def _combine(combination):
+    # Return the linear combination given as a list of (factor, Function) pairs.
+    if len(combination) == 1 and combination[0][0] == 1.0:
+        return combination[0][1]
+    value = None
+    for (factor, f) in combination:
+        value = _add(value, factor*f)
+    return value
+
 def _add(value, increment):
     # Add increment to value correctly taking into account None.
     if increment is None:
@@ -5,7 +5,8 @@ import backend
 from . import controls
 import math
 
-def compute_gst(ic, final, nsv, ic_norm="mass", final_norm="mass", which=1):
+def compute_gst(ic, final, nsv, ic_norm="mass", final_norm="mass", which=1, method="slepc",
+                oversampling=10, power_iterations=1):
     '''This function computes the generalised stability analysis of a simulation.
     Generalised stability theory computes the perturbations to a field (such as an
     initial condition, forcing term, etc.) that /grow the most/ over the finite
@@ -18,6 +19,11 @@ def compute_gst(ic, final, nsv, ic_norm="mass", final_norm="mass", which=1):
     - :py:data:`ic_norm` -- a symmetric positive-definite bilinear form that defines the norm on the input space
     - :py:data:`final_norm` -- a symmetric positive-definite bilinear form that defines the norm on the output space
     - :py:data:`which` -- which singular vectors to compute. Use e.g. slepc4py.SLEPc.EPS.Which.LARGEST_REAL
+    - :py:data:`method` -- :py:data:`"slepc"` to solve the eigenvalue problem with SLEPc, or :py:data:`"randomised"` to compute
+      the dominant singular vectors with a randomised SVD. The randomised SVD needs only a few blocks of
+      :py:data:`nsv` + :py:data:`oversampling` tangent linear and adjoint solves, and ignores :py:data:`which`.
+      :py:data:`ic` and :py:data:`final` must then be Functions.
+    - :py:data:`oversampling`, :py:data:`power_iterations` -- the parameters of the randomised SVD
 
     You can supply :py:data:`"mass"` for :py:data:`ic_norm` and :py:data:`final_norm` to use the (default) mass matrices associated
     with these spaces.
@@ -31,6 +37,11 @@ def compute_gst(ic, final, nsv, ic_norm="mass", final_norm="mass", which=1):
         (sigma, u, v) = gst.get_gst(i, return_vectors=True)
     '''
 
+    if method == "randomised":
+        return _randomised_gst(ic, final, nsv, ic_norm, final_norm, oversampling, power_iterations)
+    elif method != "slepc":
+        raise ValueError("Unknown GST method %s" % method)
+
     ic_var = adjglobals.adj_variables[ic]; ic_var.c_object.timestep = 0; ic_var.c_object.iteration = 0
     final_var = adjglobals.adj_variables[final]
 
@@ -56,6 +67,46 @@ def compute_gst(ic, final, nsv, ic_norm="mass", final_norm="mass", which=1):
 
     return adjglobals.adjointer.compute_gst(ic_var, ic_norm, final_var, final_norm, nsv, which)
 
+def _randomised_gst(ic, final, nsv, ic_norm, final_norm, oversampling, power_iterations):
+    from . import drivers, lowrank
+    from .functional import Functional
+    from .timeforms import dt, FINISH_TIME
+
+    V_ic = ic.function_space()
+    V_final = final.function_space()
+    final_name = str(adjglobals.adj_variables[final].name)
+    ic_map = lowrank.Norm(V_ic, ic_norm)
+    final_map = lowrank.Norm(V_final, final_norm)
+    mass = lowrank.Norm(V_final, "mass")
+
+    def action(xs):
+        # The propagator maps the perturbation of ic to that of final
+        ys = []
+        for x in xs:
+            param = controls.FunctionControl(ic, perturbation=x)
+            for (tlm, tlm_var) in drivers.compute_tlm(param, forget=False):
+                if tlm_var.name == final_name:
+                    y = tlm.copy(deepcopy=True)
+            ys.append(y)
+        return ys
+
+    # The adjoint propagator is the gradient of the functional <w, final> in the
+    # final norm, mapped back to the ic space with the inverse of the ic norm.
+    # w is reused so that the functional always has the same dependencies
+    w = backend.Function(V_final, name="GSTAdjointDirection")
+    J = Functional(backend.inner(w, final)*backend.dx*dt[FINISH_TIME], name="GSTAdjointAction")
+    def adjoint_action(ys):
+        xs = []
+        for y in ys:
+            w.assign(mass.apply_inverse(final_map.apply(y)))
+            dJ = drivers.compute_gradient(J, controls.FunctionControl(ic), forget=False)
+            xs.append(ic_map.apply_inverse(dJ.vector()))
+        return xs
+
+    return lowrank.randomised_svd(action, adjoint_action, V_ic, V_final, nsv,
+                                  input_norm=ic_norm, output_norm=final_norm,
+                                  oversampling=oversampling, power_iterations=power_iterations)
+
 orig_get_gst = libadjoint.GSTHandle.get_gst
 def new_get_gst(self, *args, **kwargs):
     '''Process the output of get_gst to return backend.Function's instead of adjlinalg.Vector's.'''
@@ -0,0 +1,247 @@
+import numpy
+import backend
+from . import compatibility
+from .optimization import riesz_maps
+
+class _FormRieszMap(riesz_maps.BaseRieszMap):
+    '''The Riesz map of a user supplied bilinear form.'''
+    def __init__(self, V, norm):
+        riesz_maps.BaseRieszMap.__init__(self, V)
+        self.norm = norm
+
+    def form(self):
+        return self.norm
+
+class Norm(object):
+    '''An inner product on the function space V. norm is "mass" for the L2 inner
+    product, None for the l2 inner product of the dof vectors, or a symmetric
+    positive-definite bilinear form.'''
+
+    def __init__(self, V, norm="mass"):
+        self.V = V
+        if isinstance(norm, str) and norm == "mass":
+            self.map = riesz_maps.L2(V)
+        elif norm is None:
+            self.map = None
+        else:
+            self.map = _FormRieszMap(V, norm)
+
+    def apply(self, x):
+        '''Apply the Gram matrix to the Function x. Returns a vector.'''
+        if self.map is None:
+            return x.vector().copy()
+        return self.map.apply(x)
+
+    def apply_inverse(self, b):
+        '''Solve with the Gram matrix for the vector b. Returns a Function.'''
+        if self.map is None:
+            x = backend.Function(self.V)
+            x.vector().axpy(1.0, b)
+            return x
+        return self.map.apply_inverse(b)
+
+    def inner(self, x, y):
+        return x.vector().inner(self.apply(y))
+
+def _combine(xs, C):
+    # Return the Functions sum_i C[i, j]*xs[i] for each column j of C.
+    ys = []
+    for j in range(C.shape[1]):
+        y = backend.Function(xs[0].function_space())
+        for i in range(C.shape[0]):
+            y.vector().axpy(float(C[i, j]), xs[i].vector())
+        ys.append(y)
+    return ys
+
+def _gram(xs, ys, norm):
+    return numpy.array([[norm.inner(x, y) for y in ys] for x in xs])
+
+def _orthonormalise_once(xs, norm):
+    G = _gram(xs, xs, norm)
+    G = 0.5*(G + G.T)
+    (lmbda, V) = numpy.linalg.eigh(G)
+
+    # Drop the directions that are numerically linearly dependent
+    keep = lmbda > lmbda.max()*1.0e-14
+    (lmbda, V) = (lmbda[keep], V[:, keep])
+
+    Q = _combine(xs, V/numpy.sqrt(lmbda))
+    R = numpy.sqrt(lmbda)[:, numpy.newaxis]*V.T
+    return (Q, R)
+
+def orthonormalise(xs, norm):
+    '''Return (Q, R), where the Functions Q are orthonormal in norm and
+    xs[j] = sum_i R[i, j]*Q[i]. The Gram matrix is factorised twice, which
+    restores the orthogonality lost in the first pass.'''
+    (Q, R1) = _orthonormalise_once(xs, norm)
+    (Q, R2) = _orthonormalise_once(Q, norm)
+    return (Q, numpy.dot(R2, R1))
+
+def _random_functions(V, n):
+    xs = []
+    for i in range(n):
+        x = backend.Function(V)
+        compatibility.randomise(x)
+        xs.append(x)
+    return xs
+
+class LowRankFactorisation(object):
+    '''A low-rank approximation
+
+      A x ~= sum_i s[i] U[i] (V[i], x)
+
+    of a linear operator A, where the Functions U are orthonormal in
+    output_norm, the Functions V are orthonormal in input_norm, and (., .) is
+    the input_norm inner product. For a self-adjoint operator, such as a
+    Hessian, V is U and s holds its dominant eigenvalues; otherwise s holds the
+    dominant singular values. The singular vectors can be fetched with get_gst,
+    as from the handle returned by compute_gst.'''
+
+    def __init__(self, s, U, V=None, input_norm=None, output_norm=None):
+        self.s = numpy.asarray(s)
+        self.U = U
+        self.V = U if V is None else V
+        self.input_norm = input_norm if input_norm is not None else Norm(self.V[0].function_space(), None)
+        self.output_norm = output_norm if output_norm is not None else self.input_norm
+        self.ncv = len(self.s)
+
+    def __coefficients(self, x):
+        Mx = self.input_norm.apply(x)
+        return numpy.array([v.vector().inner(Mx) for v in self.V])
+
+    def apply(self, x):
+        '''Apply the approximation to the Function x. Returns a Function.'''
+        c = self.s*self.__coefficients(x)
+        return _combine(self.U, c[:, numpy.newaxis])[0]
+
+    def apply_inverse(self, x, shift=1.0):
+        '''Apply the inverse of shift*I + A to the Function x, for a self-adjoint
+        approximation. With the Hessian of the data misfit preconditioned by the
+        prior covariance this is the posterior covariance of the Laplace
+        approximation, relative to the prior, and it is a cheap preconditioner
+        for Newton-CG. Returns a Function.'''
+        if self.V is not self.U:
+            raise ValueError("Can only invert the approximation of a self-adjoint operator.")
+
+        c = -self.s/(shift + self.s)*self.__coefficients(x)
+        y = _combine(self.U, c[:, numpy.newaxis])[0]
+        vec = y.vector()
+        vec.axpy(1.0, x.vector())
+        vec *= 1.0/shift
+        return y
+
+    def get_gst(self, i, return_vectors=False, return_residual=False):
+        retvals = [float(self.s[i])]
+        if return_vectors:
+            retvals += [self.U[i], self.V[i]]
+        if return_residual:
+            retvals.append(0.0)
+        if len(retvals) == 1:
+            return retvals[0]
+        return retvals
+
+    def save(self, filename):
+        '''Store the factorisation, with the dof values owned by each process in
+        a file of its own.'''
+        if compatibility.rank(backend.comm_world) > 0:
+            filename = "%s.%i" % (filename, compatibility.rank(backend.comm_world))
+        with open(filename, "wb") as f:
+            numpy.savez(f, s=self.s,
+                        U=numpy.array([u.vector().get_local() for u in self.U]),
+                        V=numpy.array([v.vector().get_local() for v in self.V]))
+
+    @staticmethod
+    def load(filename, input_space, output_space=None, input_norm="mass", output_norm=None):
+        '''Load a factorisation stored with save.'''
+        if output_space is None:
+            output_space = input_space
+        if output_norm is None:
+            output_norm = input_norm
+        if compatibility.rank(backend.comm_world) > 0:
+            filename = "%s.%i" % (filename, compatibility.rank(backend.comm_world))
+        data = numpy.load(filename)
+
+        def functions(V, arrays):
+            fs = []
+            for a in arrays:
+                f = backend.Function(V)
+                f.vector().set_local(a)
+                f.vector().apply("insert")
+                fs.append(f)
+            return fs
+
+        U = functions(output_space, data["U"])
+        if numpy.array_equal(data["U"], data["V"]) and input_space == output_space:
+            V = None
+        else:
+            V = functions(input_space, data["V"])
+        return LowRankFactorisation(data["s"], U, V, Norm(input_space, input_norm),
+                                    Norm(output_space, output_norm))
+
+def randomised_eig(action, V, rank, norm="mass", oversampling=10, power_iterations=1):
+    '''Compute the dominant eigenpairs of a self-adjoint operator on the function
+    space V, with the randomised algorithm of Halko, Martinsson and Tropp.
+    action takes a list of Functions x and returns the list of Functions A x.
+    The operator must be self-adjoint in norm (see Norm). The actions are
+    requested in blocks of rank + oversampling Functions, and each power
+    iteration costs one extra block. Returns a LowRankFactorisation.'''
+
+    norm = Norm(V, norm)
+    Y = action(_random_functions(V, rank + oversampling))
+    for i in range(power_iterations):
+        (Q, R) = orthonormalise(Y, norm)
+        Y = action(Q)
+
+    (Q, R) = orthonormalise(Y, norm)
+    T = _gram(Q, action(Q), norm)
+    (lmbda, S) = numpy.linalg.eigh(0.5*(T + T.T))
+
+    order = numpy.argsort(-numpy.abs(lmbda))[:rank]
+    return LowRankFactorisation(lmbda[order], _combine(Q, S[:, order]), input_norm=norm)
+
+def randomised_svd(action, adjoint_action, V_in, V_out, rank, input_norm="mass", output_norm="mass",
+                   oversampling=10, power_iterations=1):
+    '''Compute the dominant singular triplets of a linear operator from the
+    function space V_in to V_out, with the randomised algorithm of Halko,
+    Martinsson and Tropp. action takes a list of Functions x on V_in and returns
+    the Functions A x, and adjoint_action takes a list of Functions y on V_out
+    and returns the Functions A* y, where A* is the adjoint of A in the given
+    norms (see Norm). Returns a LowRankFactorisation.'''
+
+    input_norm = Norm(V_in, input_norm)
+    output_norm = Norm(V_out, output_norm)
+
+    Y = action(_random_functions(V_in, rank + oversampling))
+    for i in range(power_iterations):
+        (Q, R) = orthonormalise(Y, output_norm)
+        (P, R) = orthonormalise(adjoint_action(Q), input_norm)
+        Y = action(P)
+
+    # With Q orthonormal, A ~= Q Q* A = Q R^T P*, where A* Q = P R
+    (Q, R) = orthonormalise(Y, output_norm)
+    (P, R) = orthonormalise(adjoint_action(Q), input_norm)
+    (W, s, Zt) = numpy.linalg.svd(R.T, full_matrices=False)
+
+    return LowRankFactorisation(s[:rank], _combine(Q, W[:, :rank]), _combine(P, Zt.T[:, :rank]),
+                                input_norm, output_norm)
+
+def low_rank_hessian(rf, rank, norm="mass", oversampling=10, power_iterations=1):
+    '''Compute a low-rank approximation of the Hessian of the reduced functional
+    rf, at its most recent evaluation, from its dominant eigenpairs. The control
+    must be a single Function. The eigenvalue problem is posed in norm, so with
+    the default L2 norm the approximation satisfies H x ~= M sum_i s[i] U[i] (U[i], x),
+    where M is the mass matrix. Hessian actions are computed in blocks through
+    ReducedFunctional.hessian_block.'''
+
+    if len(rf.controls) != 1 or not isinstance(rf.controls[0].data(), backend.Function):
+        raise NotImplementedError("Low-rank Hessians are only implemented for a single Function control.")
+
+    V = rf.controls[0].data().function_space()
+    norm_map = Norm(V, norm)
+
+    def action(xs):
+        Hxs = rf.hessian_block(xs)
+        return [norm_map.apply_inverse(Hx.vector()) for Hx in Hxs]
+
+    return randomised_eig(action, V, rank, norm=norm, oversampling=oversampling,
+                          power_iterations=power_iterations)
@@ -0,0 +1,207 @@
+import os
+import json
+import binascii
+import zlib
+import struct
+import hashlib
+import collections
+import numpy
+import backend
+from . import compatibility
+from .enlisting import enlist
+
+# A record is a fixed size header (magic, length of the JSON description,
+# length of the payload, CRC32 of both), a JSON description of the record and
+# the float64 payload
+_MAGIC = b"DAMS"
+_HEADER = struct.Struct("<4sIII")
+
+class MemoStore(object):
+    '''A persistent store of reduced functional evaluations. Each entry holds a
+    list of float64 arrays, and is identified by a kind ("functional",
+    "derivative" or "hessian") and a hash of the control values.
+
+    Entries are appended to a log file, one per process, and located through an
+    in-memory index that is rebuilt from the log when the store is opened. Every
+    record carries a checksum and is flushed to disk when it is written, so a
+    crash at most loses the record being written. Once the store holds more than
+    parameters["adjoint"]["memoization_cache_size"] entries, or its records
+    exceed parameters["adjoint"]["memoization_cache_budget"] megabytes, the least
+    recently used are evicted, and the log is compacted once it is mostly evicted
+    records.'''
+
+    def __init__(self, filename):
+        if compatibility.rank(backend.comm_world) > 0:
+            filename = "%s.%i" % (filename, compatibility.rank(backend.comm_world))
+        self.filename = filename
+
+        self.entries = collections.OrderedDict()
+        self.live = 0
+
+        self.file = open(filename, "a+b")
+        self._load()
+        self._evict()
+
+    def max_entries(self):
+        return backend.parameters["adjoint"]["memoization_cache_size"]
+
+    def max_bytes(self):
+        return backend.parameters["adjoint"]["memoization_cache_budget"] * 1024 * 1024
+
+    def _load(self):
+        self.file.seek(0)
+        offset = 0
+        while True:
+            head = self.file.read(_HEADER.size)
+            if len(head) < _HEADER.size:
+                break
+            (magic, desc_len, payload_len, crc) = _HEADER.unpack(head)
+            if magic != _MAGIC:
+                break
+            body = self.file.read(desc_len + payload_len)
+            if len(body) < desc_len + payload_len or zlib.crc32(body) & 0xffffffff != crc:
+                break
+
+            desc = json.loads(body[:desc_len].decode("utf8"))
+            key = (desc["kind"], desc["key"])
+            if key in self.entries:
+                self.live -= self.entries.pop(key)[1]
+            length = _HEADER.size + desc_len + payload_len
+            self.entries[key] = (offset, length, desc)
+            self.live += length
+            offset += length
+
+        # Drop a record that was only partially written
+        self.file.seek(0, os.SEEK_END)
+        if self.file.tell() > offset:
+            self.file.truncate(offset)
+        self.size = offset
+
+    def _record(self, desc, arrays):
+        desc = json.dumps(desc).encode("utf8")
+        payload = b"".join(a.tobytes() for a in arrays)
+        crc = zlib.crc32(desc + payload) & 0xffffffff
+        return _HEADER.pack(_MAGIC, len(desc), len(payload), crc) + desc + payload
+
+    def _write(self, data):
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def _evict(self):
+        max_entries = self.max_entries()
+        while max_entries > 0 and len(self.entries) > max_entries:
+            (_, (_, length, _)) = self.entries.popitem(last=False)
+            self.live -= length
+
+        # Keep the most recent entry, even if it exceeds the budget on its own
+        max_bytes = self.max_bytes()
+        while max_bytes > 0 and self.live > max_bytes and len(self.entries) > 1:
+            (_, (_, length, _)) = self.entries.popitem(last=False)
+            self.live -= length
+
+        if 2 * self.live < self.size:
+            self._compact()
+
+    def _compact(self):
+        tmp_filename = "%s.tmp" % self.filename
+        with open(tmp_filename, "wb") as tmp:
+            offset = 0
+            for key in self.entries:
+                (old_offset, length, desc) = self.entries[key]
+                self.file.seek(old_offset)
+                tmp.write(self.file.read(length))
+                self.entries[key] = (offset, length, desc)
+                offset += length
+            tmp.flush()
+            os.fsync(tmp.fileno())
+
+        self.file.close()
+        os.rename(tmp_filename, self.filename)
+        self.file = open(self.filename, "a+b")
+        self.size = offset
+        self.live = offset
+
+    def __contains__(self, key):
+        return key in self.entries
+
+    def get(self, kind, key):
+        '''Return the list of arrays stored for the given kind and key, or None.'''
+
+        if (kind, key) not in self.entries:
+            return None
+
+        # Mark the entry as the most recently used
+        (offset, length, desc) = self.entries.pop((kind, key))
+        self.entries[(kind, key)] = (offset, length, desc)
+
+        self.file.seek(offset + length - 8 * sum(desc["sizes"]))
+        payload = numpy.frombuffer(self.file.read(8 * sum(desc["sizes"])), dtype=numpy.float64)
+        arrays = []
+        start = 0
+        for size in desc["sizes"]:
+            arrays.append(payload[start:start + size].copy())
+            start += size
+        return arrays
+
+    def put(self, kind, key, arrays):
+        '''Store the list of arrays for the given kind and key.'''
+
+        arrays = [numpy.asarray(a, dtype=numpy.float64).reshape(-1) for a in arrays]
+        desc = {"kind": kind, "key": key, "sizes": [int(a.shape[0]) for a in arrays]}
+        data = self._record(desc, arrays)
+        self._write(data)
+
+        if (kind, key) in self.entries:
+            self.live -= self.entries.pop((kind, key))[1]
+        self.entries[(kind, key)] = (self.size, len(data), desc)
+        self.size += len(data)
+        self.live += len(data)
+
+        self._evict()
+
+    def __len__(self):
+        return len(self.entries)
+
+def value_hash(value):
+    '''Return an exact hash of the given Constant, Function or list of these.
+    Each process hashes the locally owned dof values of the Functions, together
+    with its rank and the number of processes, and the hashes are combined with a
+    single reduction. The hash therefore identifies the parallel decomposition
+    as well as the values, as the arrays stored by cache_store are process
+    local. All Functions must share a communicator.'''
+    m = hashlib.md5()
+    comm = None
+    for v in enlist(value):
+        if isinstance(v, backend.Constant):
+            m.update(b"Constant")
+            m.update(numpy.asarray(v.values(), dtype=numpy.float64).tobytes())
+        elif isinstance(v, backend.Function):
+            comm = compatibility.function_comm(v)
+            m.update(b"Function")
+            m.update(struct.pack("<ii", compatibility.rank(comm), compatibility.size(comm)))
+            m.update(numpy.asarray(compatibility.local_array(v), dtype=numpy.float64).tobytes())
+        else:
+            raise Exception("Don't know how to take a hash of %s" % v)
+
+    if comm is None or compatibility.size(comm) == 1:
+        return m.hexdigest()
+
+    # Summation (modulo 2**64 in each word) does not depend on the order in which
+    # the hashes are combined
+    from mpi4py import MPI
+    digest = numpy.frombuffer(m.digest(), dtype=numpy.uint64)
+    combined = numpy.empty_like(digest)
+    comm.Allreduce(digest, combined, op=MPI.SUM)
+    return binascii.hexlify(combined.tobytes()).decode("ascii")
+
+_stores = {}
+
+def open_store(filename):
+    '''Return the MemoStore for filename. Reduced functionals sharing a cache file
+    share the store.'''
+
+    filename = os.path.abspath(filename)
+    if filename not in _stores:
+        _stores[filename] = MemoStore(filename)
+    return _stores[filename]
@@ -1,11 +1,17 @@
 
 from __future__ import print_function
+import collections
+import libadjoint
+from ..adjglobals import adjointer
+from ..controls import FunctionControl
+from ..memo_store import value_hash
 __all__ = ["MoolaOptimizationProblem"]
 
 def MoolaOptimizationProblem(rf, memoize=1):
     """Build the moola problem from the OptimizationProblem instance.
        memoize describes the number of the function and derivative
-       calls to be memoized
+       calls to be memoized. Evaluations are identified by an exact hash of
+       the control values, and the least recently used are discarded first.
     """
 
     try:
@@ -15,78 +21,80 @@ def MoolaOptimizationProblem(rf, memoize=1):
         raise
 
     class Functional(moola.Functional):
-        latest_eval_hash = []
-        latest_eval_eval = []
-        latest_deriv_hash = []
-        latest_deriv_eval = []
-
-        def __call__(self, x):
-            ''' Evaluates the functional for the given control value. '''
+        def __init__(self):
+            # Memoized functional values and derivatives, keyed by a hash of
+            # the control values and ordered from least to most recently used
+            self.evals = collections.OrderedDict()
+            self.derivs = collections.OrderedDict()
+
+        def lookup(self, table, key):
+            if key in table:
+                table[key] = table.pop(key)
+                return table[key]
+            return None
+
+        def store(self, table, key, value):
             if memoize > 0:
-                hashx = hash(x)
-
-                for hashp in self.latest_eval_hash:
-                    if hashp == hashx:
-                        moola.events.increment("Cached functional evaluation")
-                        return self.latest_eval_eval[self.latest_eval_hash.index(hashp)]
-
-                if len(self.latest_eval_hash) == memoize:
-                    self.latest_eval_hash.pop(0)
-                    self.latest_eval_eval.pop(0)
-
-                self.latest_eval_hash.append(hashx)
-                self.latest_eval_eval.append(rf(x.data))
+                table[key] = value
+                while len(table) > memoize:
+                    table.popitem(last=False)
+
+        def current(self):
+            ''' Returns the hash of the control values of the latest forward run
+            of rf, by any caller, or None if they have been forgotten. Function
+            control values are read from the tape, as a control with a value
+            returns that value whatever the tape holds. '''
+            try:
+                return value_hash([adjointer.get_variable_value(c.var).data if isinstance(c, FunctionControl) else c.data()
+                                   for c in rf.controls])
+            except libadjoint.exceptions.LibadjointErrorNeedValue:
+                return None
+
+        def replay(self, x, key):
+            ''' Runs the forward model at x, unless it was the latest point evaluated. '''
+            if key != self.current():
                 moola.events.increment("Functional evaluation")
-                return self.latest_eval_eval[-1]
+                self.store(self.evals, key, rf(x.data))
 
-            else:
-                moola.events.increment("Functional evaluation")
-                return rf(x.data)
+        def __call__(self, x):
+            ''' Evaluates the functional for the given control value. '''
+            key = value_hash(x.data)
+            j = self.lookup(self.evals, key)
+            if j is not None:
+                moola.events.increment("Cached functional evaluation")
+                return j
 
+            moola.events.increment("Functional evaluation")
+            j = rf(x.data)
+            self.store(self.evals, key, j)
+            return j
 
         def derivative(self, x):
             ''' Evaluates the gradient for the control values. '''
+            key = value_hash(x.data)
+            deriv = self.lookup(self.derivs, key)
+            if deriv is not None:
+                moola.events.increment("Cached derivative evaluation")
+                return deriv
 
-            if memoize > 0:
-                hashx = hash(x)
-
-                for hashp in self.latest_deriv_hash:
-                    if hashp == hashx:
-                        moola.events.increment("Cached derivative evaluation")
-                        deriv = self.latest_deriv_eval[self.latest_deriv_hash.index(hashp)]
-                        return deriv
-
-                if len(self.latest_deriv_hash) == memoize:
-                    self.latest_deriv_hash.pop(0)
-                    self.latest_deriv_eval.pop(0)
-
-                moola.events.increment("Derivative evaluation")
-                D = rf.derivative(forget=False)
-
-                if isinstance(x, moola.DolfinPrimalVector):
-                    deriv = moola.DolfinDualVector(D[0], riesz_map = x.riesz_map)
-                else:
-                    deriv = moola.DolfinDualVectorSet([moola.DolfinDualVector(di, riesz_map = xi.riesz_map) for (di, xi) in zip(D, x.vector_list)], riesz_map = x.riesz_map)
+            # The adjoint equations need the forward solutions at x
+            self.replay(x, key)
 
-                self.latest_deriv_hash.append(hashx)
-                self.latest_deriv_eval.append(deriv)
-                return deriv
+            moola.events.increment("Derivative evaluation")
+            D = rf.derivative(forget=False)
 
+            if isinstance(x, moola.DolfinPrimalVector):
+                deriv = moola.DolfinDualVector(D[0], riesz_map = x.riesz_map)
             else:
-                moola.events.increment("Derivative evaluation")
-                D = rf.derivative(forget=False)
+                deriv = moola.DolfinDualVectorSet([moola.DolfinDualVector(di, riesz_map = xi.riesz_map) for (di, xi) in zip(D, x.vector_list)], riesz_map = x.riesz_map)
 
-                if isinstance(x, moola.DolfinPrimalVector):
-                    deriv = moola.DolfinDualVector(D[0], riesz_map = x.riesz_map)
-                else:
-                    deriv = moola.DolfinDualVectorSet([moola.DolfinDualVector(di, riesz_map = xi.riesz_map) for (di, xi) in zip(D, x.vector_list)], riesz_map = x.riesz_map)
-
-                return deriv
+            self.store(self.derivs, key, deriv)
+            return deriv
 
         def hessian(self, x):
-            ''' Evaluates the gradient for the control values. '''
+            ''' Evaluates the Hessian for the control values. '''
 
-            self(x)
+            self.replay(x, value_hash(x.data))
 
             def moola_hessian(direction):
                 assert isinstance(direction, (moola.DolfinPrimalVector,
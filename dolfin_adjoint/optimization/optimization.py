@@ -4,7 +4,7 @@ import backend
 from ..reduced_functional_numpy import ReducedFunctionalNumPy, get_global
 from ..reduced_functional import ReducedFunctional
 from ..utils import gather
-from ..compatibility import rank
+from ..compatibility import rank, size
 from ..misc import noannotations
 import six
 
@@ -22,7 +22,7 @@ def serialise_bounds(rf_np, bounds):
         for j in range(len(bounds[i])):
             bound = bounds[i][j]
             if type(bound) in [int,  float, np.int32, np.int64, np.float32, np.float64]:
-                bound_len = len(get_global(rf_np.controls[j].data()))
+                bound_len = len(rf_np.obj_to_array(rf_np.controls[j].data()))
                 const_bound = bound*np.ones(bound_len)
 
                 bounds_arr[i] += const_bound.tolist()
@@ -76,8 +76,13 @@ def minimize_scipy_generic(rf_np, method, bounds = None, **kwargs):
     if method == "SLSQP" and "iprint" not in kwargs["options"]:
         kwargs["options"]["iprint"] = 2
 
-    # For gradient-based methods add the derivative function to the argument list
-    if method not in ["COBYLA", "Nelder-Mead", "Anneal", "Powell"]:
+    # For gradient-based methods add the derivative function to the argument list.
+    # Methods that always need both at the same point evaluate them together, and
+    # never need the forward state again once the gradient is computed.
+    if method in ["L-BFGS-B", "TNC"]:
+        J = lambda m: rf_np.value_and_gradient(m, forget=True, project=project)
+        kwargs["jac"] = True
+    elif method not in ["COBYLA", "Nelder-Mead", "Anneal", "Powell"]:
         kwargs["jac"] = dJ
 
     # For Hessian-based methods add the Hessian action function to the argument list
@@ -180,7 +185,7 @@ def print_optimization_methods():
         print(function_name, ': ', description)
 
 @noannotations
-def minimize(rf, method='L-BFGS-B', scale=1.0, **kwargs):
+def minimize(rf, method='L-BFGS-B', scale=1.0, distributed=False, **kwargs):
     ''' Solves the minimisation problem with PDE constraint:
 
            min_m func(u, m)
@@ -197,6 +202,7 @@ def minimize(rf, method='L-BFGS-B', scale=1.0, **kwargs):
         * 'method' specifies the optimization method to be used to solve the problem. The available methods can be listed with the print_optimization_methods function.
         * 'scale' is a factor to scale to problem (default: 1.0).
         * 'bounds' is an optional keyword parameter to support control constraints: bounds = (lb, ub). lb and ub must be of the same type than the parameters m.
+        * 'distributed' passes each process only the control values it owns, as a DistributedArray (default: False). See ReducedFunctionalNumPy. scipy's optimisation algorithms do not support this in parallel, so it is only supported there with the 'Custom' method and a NumPy based algorithm.
 
         Additional arguments specific for the optimization algorithms can be added to the minimize functions (e.g. iprint = 2). These arguments will be passed to the underlying optimization algorithm. For detailed information about which arguments are supported for each optimization algorithm, please refer to the documentaton of the optimization algorithm.
         '''
@@ -205,7 +211,7 @@ def minimize(rf, method='L-BFGS-B', scale=1.0, **kwargs):
     if isinstance(rf, ReducedFunctionalNumPy):
         rf_np = rf
     elif isinstance(rf, ReducedFunctional):
-        rf_np = ReducedFunctionalNumPy(rf)
+        rf_np = ReducedFunctionalNumPy(rf, distributed=distributed)
     else:
         # Assume the user knows what he is doing - he might for example written
         # his own reduced functional class.
@@ -217,6 +223,9 @@ def minimize(rf, method='L-BFGS-B', scale=1.0, **kwargs):
         raise KeyError('Unknown optimization method ' + method + '. Use print_optimization_methods() to get a list of the available methods.')
 
     if algorithm == minimize_scipy_generic:
+        if getattr(rf_np, "distributed", False) and size(rf_np.mpi_comm()) > 1:
+            raise ValueError("scipy's optimisation algorithms require the global control values on every process, and do not support distributed=True in parallel.")
+
         # For scipy's generic inteface we need to pass the optimisation method as a parameter.
         kwargs["method"] = method
 
@@ -1,42 +1,136 @@
-# Dummy objects that allow for a compact notation in the
-# configuration of Riesz maps.
+# Riesz maps for the compact configuration of optimisation algorithms.
+# Each map assembles its Gram matrix once and keeps a solver for it, so
+# mapping gradients to their representers only costs a solve.
 
-from backend import TrialFunction, TestFunction, grad, inner, dx, assemble, Constant
+import backend
+from backend import TrialFunction, TestFunction, Function, DirichletBC, grad, inner, dx, assemble, Constant
 
 __all__ = ["BaseRieszMap", "L2", "H10", "H1"]
 
 class BaseRieszMap(object):
-    def __init__(self, V):
+    '''The Riesz map of an inner product on the function space V, represented by
+    its Gram matrix. The matrix is assembled on first use, and its solver is set up
+    once and reused. If the mesh of V is moved then invalidate must be called, so
+    that the matrix is assembled again. solver is "lu" to reuse a factorisation of
+    the matrix, or "amg" to solve with the conjugate gradient method and an
+    algebraic multigrid preconditioner.'''
+
+    def __init__(self, V, solver="lu"):
+        if solver not in ["lu", "amg"]:
+            raise ValueError("Unknown Riesz map solver %s" % solver)
+
         self.V = V
+        self.solver_type = solver
+
+        self.__matrix = None
+        self.__solver = None
+
+    def form(self):
+        '''Return the bilinear form of the inner product.'''
+        raise NotImplementedError
+
+    def bcs(self):
+        '''Return the homogeneous Dirichlet boundary conditions of the function
+        space on which the inner product is defined.'''
+        return []
+
+    def invalidate(self):
+        '''Discard the assembled Gram matrix and its solver, for example after the
+        mesh has moved.'''
+        self.__matrix = None
+        self.__solver = None
 
-class L2(BaseRieszMap):
     def assemble(self):
+        '''Return the assembled Gram matrix.'''
+        if self.__matrix is None:
+            bcs = self.bcs()
+            if len(bcs) == 0:
+                self.__matrix = assemble(self.form())
+            else:
+                # Apply the boundary conditions symmetrically
+                v = TestFunction(self.V)
+                (self.__matrix, _) = backend.assemble_system(self.form(), inner(Function(self.V), v)*dx, bcs)
+        return self.__matrix
+
+    def solver(self):
+        '''Return the solver for the Gram matrix.'''
+        A = self.assemble()
+        if self.__solver is None:
+            if self.solver_type == "lu":
+                if hasattr(backend, "lu_solver_methods") and "mumps" in backend.lu_solver_methods().keys():
+                    solver = backend.LUSolver(A, "mumps")
+                else:
+                    solver = backend.LUSolver(A)
+                solver.parameters["symmetric"] = True
+                solver.parameters["reuse_factorization"] = True
+            else:
+                solver = backend.KrylovSolver("cg", "amg")
+                solver.set_operator(A)
+                solver.parameters["relative_tolerance"] = 1.0e-12
+                solver.parameters["absolute_tolerance"] = 1.0e-16
+            self.__solver = solver
+        return self.__solver
+
+    def apply(self, x):
+        '''Apply the Gram matrix to x, a Function or vector, or a list of these.
+        Returns vectors.'''
+        if isinstance(x, (list, tuple)):
+            return [self.apply(xi) for xi in x]
+
+        if hasattr(x, "vector"):
+            x = x.vector()
+        y = x.copy()
+        self.assemble().mult(x, y)
+        return y
+
+    def apply_inverse(self, b):
+        '''Solve with the Gram matrix for the right-hand side b, a Function or
+        vector, or for each of a list of these. Returns Functions on V.'''
+        if isinstance(b, (list, tuple)):
+            return [self.apply_inverse(bi) for bi in b]
+
+        if hasattr(b, "vector"):
+            b = b.vector()
+        bcs = self.bcs()
+        if len(bcs) > 0:
+            b = b.copy()
+            for bc in bcs:
+                bc.apply(b)
+        x = Function(self.V)
+        self.solver().solve(x.vector(), b)
+        return x
+
+class L2(BaseRieszMap):
+    def form(self):
         u = TrialFunction(self.V)
         v = TestFunction(self.V)
 
-        A = inner(u, v)*dx
-        return assemble(A)
+        return inner(u, v)*dx
 
 class H10(BaseRieszMap):
-    def assemble(self):
+    '''The Riesz map of the H^1_0 inner product. The stiffness matrix is singular
+    without boundary conditions, so homogeneous Dirichlet boundary conditions are
+    applied on the whole boundary.'''
+    def bcs(self):
+        return [DirichletBC(self.V, Function(self.V), "on_boundary")]
+
+    def form(self):
         u = TrialFunction(self.V)
         v = TestFunction(self.V)
 
-        A = inner(grad(u), grad(v))*dx
-        return assemble(A)
+        return inner(grad(u), grad(v))*dx
 
 class H1(BaseRieszMap):
-    def __init__(self, V, alpha=None):
-        BaseRieszMap.__init__(self, V)
+    def __init__(self, V, alpha=None, solver="lu"):
+        BaseRieszMap.__init__(self, V, solver=solver)
 
         if alpha is not None:
             self.alpha = alpha
         else:
             self.alpha = Constant(1.0)
 
-    def assemble(self):
+    def form(self):
         u = TrialFunction(self.V)
         v = TestFunction(self.V)
 
-        A = inner(u, v)*dx + alpha*inner(grad(u), grad(v))*dx
-        return assemble(A)
+        return inner(u, v)*dx + self.alpha*inner(grad(u), grad(v))*dx
@@ -5,6 +5,7 @@ from .optimization_solver import OptimizationSolver
 import numpy as np
 from dolfin_adjoint import compatibility
 from ..misc import noannotations
+from ..enlisting import enlist, delist
 
 from backend import *
 import backend
@@ -45,13 +46,20 @@ class TAOSolver(OptimizationSolver):
         # Use PETSc forms
         if riesz_map is not None:
 
-            # Handle the case where the user supplied riesz_maps.L2(V)
+            # Handle the case where the user supplied riesz_maps.L2(V), whose
+            # solver is reused to apply the inverse Riesz map
+            if hasattr(riesz_map, "solver"):
+                self.riesz_solver = riesz_map.solver()
+            else:
+                self.riesz_solver = None
+
             if hasattr(riesz_map, "assemble"):
                 riesz_map = riesz_map.assemble()
 
             self.riesz_map = as_backend_type(riesz_map).mat()
         else:
             self.riesz_map = None
+            self.riesz_solver = None
 
         if len(prefix) > 0 and prefix[-1] != "_":
             prefix += "_"
@@ -70,18 +78,24 @@ class TAOSolver(OptimizationSolver):
         PETSc = self.PETSc
         rf = self.problem.reduced_functional
 
-        # Map each control to a PETSc Vec...
-        ctrl_vecs = []
-        for control in rf.controls:
-            as_vec = self.__control_as_vec(control)
-            ctrl_vecs.append(as_vec)
+        # Each control is represented by a PETSc Vec: Function controls by the
+        # vector of a copy of the Function, which TAO reads and writes in place,
+        # and Constant controls by a small Vec owned by the first process
+        self.ctrl_data = [self.__control_data(control) for control in rf.controls]
+        ctrl_vecs = [self.__data_as_vec(data) for data in self.ctrl_data]
+
+        # ...then combine them into one nested Vec without copying
+        ctrl_vec = self.__petsc_vec_nest(ctrl_vecs)
 
-        # ...then concatenate
-        ctrl_vec = self.__petsc_vec_concatenate(ctrl_vecs)
+        if self.riesz_map is not None and len(ctrl_vecs) > 1:
+            raise NotImplementedError("The riesz_map is only supported for a single control")
 
         # Use value of control object as initial guess for the optimisation
-        self.initial_vec = ctrl_vec.copy()
-        #self.initial_vec = ctrl_vec.duplicate() # DSM temporary to reproduce dependency results
+        self.initial_vec = ctrl_vec
+        ctrl_data = self.ctrl_data
+        sub_vecs = self.__sub_vecs
+        data_from_vecs = self.__data_from_vecs
+        data_to_vecs = self.__data_to_vecs
 
         class AppCtx(object):
             ''' Implements the application context for the TAO solver '''
@@ -105,22 +119,16 @@ class TAOSolver(OptimizationSolver):
             def objective(self, x):
                 ''' Evaluates the functional. '''
                 self.update(x)
-                # TODO: Multiple controls
-                return rf(rf.controls[0].data())
+                return rf(ctrl_data)
 
             def objective_and_gradient(self, tao, x, G):
                 ''' Evaluates the functional and gradient for the parameter choice x. '''
-                j = self.objective(x)
-                # TODO: Concatenated gradient vector
-                gradient = rf.derivative(forget=False)[0]
-
-                if isinstance(gradient, backend.Constant):
-                    G.set(float(gradient))
-                else:
-                    gradient_vec = as_backend_type(gradient.vector()).vec()
-                    G.set(0)
-                    G.axpy(1, gradient_vec)
+                self.update(x)
+                # The forward solutions are only kept for methods that apply the Hessian
+                forget = tao.getType() not in ["nls", "ntr", "ntl", "tron", "gpcg", "bqpip", "bnls", "bntr", "bntl"]
+                (j, gradient) = rf.value_and_gradient(ctrl_data, forget=forget)
 
+                data_to_vecs(gradient, sub_vecs(G))
                 return j
 
             def hessian(self, tao, x, H, HP):
@@ -141,6 +149,10 @@ class TAOSolver(OptimizationSolver):
                 return "(min, max): (%s, %s)" % (x.min()[-1], x.max()[-1])
 
             def apply(iself, pc, x, y):
+                if self.riesz_solver is not None:
+                    self.riesz_solver.solve(PETScVector(y), PETScVector(x))
+                    return
+
                 if iself.riesz_ksp is None:
                     iself.riesz_ksp = self.PETSc.KSP().create()
                     iself.riesz_ksp.setOperators(iself.riesz_map)
@@ -150,11 +162,8 @@ class TAOSolver(OptimizationSolver):
                 iself.riesz_ksp.solve(x, y)
 
             def mult(self, mat, x, y):
-                # TODO: Add multiple control support to Hessian stack and check for ConstantControl
-                x_wrap = compatibility.petsc_vec_as_function(
-                    rf.controls[0].data().function_space(), x)
+                x_wrap = data_from_vecs(sub_vecs(x))
                 hes = rf.hessian(x_wrap)
-                hes_vec = as_backend_type(hes.vector()).vec()
 
                 y.set(0.0)
                 if self.shift_ != 0.0:
@@ -164,58 +173,19 @@ class TAOSolver(OptimizationSolver):
                         y.axpy(1.0, x) # use the identity matrix
                     y.scale(self.shift_)
 
+                hes_vec = y.duplicate()
+                data_to_vecs(hes, sub_vecs(hes_vec))
                 y.axpy(1, hes_vec)
 
             def update(self, x):
-                ''' Split input vector and update all control values '''
-                x.copy(ctrl_vec) # Refresh concatenated control vector first
-
-                nvec = 0
-                for i in range(0,len(rf.controls)):
-                    control = rf.controls[i]
-
-                    if isinstance(control, FunctionControl):
-                        data_vec = as_backend_type(control.data().vector()).vec()
-
-                        # Map appropriate range of input vector to control
-                        ostarti, oendi = data_vec.owner_range
-                        rstarti = ostarti + nvec
-                        rendi = rstarti + data_vec.local_size
-                        data_vec.setValues(list(range(ostarti, oendi)), x[rstarti:rendi])
-                        data_vec.assemble()
-                        nvec += data_vec.size
-
-                    elif isinstance(control, ConstantControl):
-                        # Scalar case
-                        if control.data().shape() == ():
-                            vsize = 1
-                            val = float(x[nvec])
-
-                        # Vector case
-                        elif len(control.data().shape()) == 1:
-                            vsize = control.data().shape()[0]
-                            val = x[nvec:nvec+vsize]
-
-                        # Matrix case
-                        else:
-                            vsizex, vsizey = control.data().shape()
-                            vsize = vsizex*vsizey
-                            as_array = x[nvec:nvec+vsize]
-
-                            # Sort into matrix restoring rows and columns
-                            val = []
-                            for row in range(0,vsizex):
-                                val_inner = []
-
-                                for column in range(0,vsizey):
-                                    val_inner.append(as_array[row*vsizey + column])
-
-                                val.append(val_inner)
-
-                        # Replace control in rf
-                        cons = Constant(val)
-                        rf.controls[i].update(Constant(cons))
-                        nvec += vsize
+                ''' Update all control values from the input vector '''
+                # The Function controls are viewed by ctrl_vec, so there is
+                # nothing to copy when TAO passes its solution vector
+                if x.handle != ctrl_vec.handle:
+                    x.copy(ctrl_vec)
+
+                for (i, data) in enumerate(data_from_vecs(sub_vecs(ctrl_vec), functions=ctrl_data)):
+                    ctrl_data[i] = data
 
         # create user application context
         self.__user = AppCtx(self.riesz_map)
@@ -291,20 +261,18 @@ class TAOSolver(OptimizationSolver):
     def __get_bounds(self):
         """Convert bounds to PETSc vectors - TAO's accepted format"""
         bounds = self.problem.bounds
-        controls = self.problem.reduced_functional.controls
 
         lbvecs = []
         ubvecs = []
 
-        for (bound, control) in zip(bounds, controls):
+        for (bound, ctrl_vec) in zip(bounds, self.__sub_vecs(self.initial_vec)):
 
-            len_control = self.__control_as_vec(control).size
             (lb,ub) = bound # could be float, int, Constant, or Function
 
             if isinstance(lb, Function):
                 lbvec = as_backend_type(lb.vector()).vec()
             elif isinstance(lb, (float, int, Constant)):
-                lbvec = self.initial_vec.duplicate()
+                lbvec = ctrl_vec.duplicate()
                 lbvec.set(float(lb))
             else:
                 raise TypeError("Unknown lower bound type %s" % lb.__class__)
@@ -313,44 +281,32 @@ class TAOSolver(OptimizationSolver):
             if isinstance(ub, Function):
                 ubvec = as_backend_type(ub.vector()).vec()
             elif isinstance(ub, (float, int, Constant)):
-                ubvec = self.initial_vec.duplicate()
+                ubvec = ctrl_vec.duplicate()
                 ubvec.set(float(ub))
             else:
                 raise TypeError("Unknown upper bound type %s" % ub.__class__)
             ubvecs.append(ubvec)
 
-        lbvec = self.__petsc_vec_concatenate(lbvecs)
-        ubvec = self.__petsc_vec_concatenate(ubvecs)
+        lbvec = self.__petsc_vec_nest(lbvecs)
+        ubvec = self.__petsc_vec_nest(ubvecs)
         return (lbvec, ubvec)
 
     def __get_constraints(self):
         # TODO: Implement constraints handling
         return None
 
-    def __petsc_vec_concatenate(self, vecs):
-        """Concatenates the supplied list of PETSc Vecs."""
-        PETSc = self.PETSc
-
-        # Make a Vec with appropriate local/global sizes and copy in each rank's local entries
-        lsizes = [vec.sizes for vec in vecs]
-        nlocal, nglobal = map(sum, zip(*lsizes))
-
-        concat_vec = PETSc.Vec().create(PETSc.COMM_WORLD)
-        concat_vec.setSizes((nlocal,nglobal))
-        concat_vec.setFromOptions()
-        nvec = 0
-        for vec in vecs:
+    def __petsc_vec_nest(self, vecs):
+        """Combine the supplied list of PETSc Vecs into one nested Vec, which
+        views rather than copies them. A single Vec is used as it is."""
+        if len(vecs) == 1:
+            return vecs[0]
+        return self.PETSc.Vec().createNest(vecs, comm=self.PETSc.COMM_WORLD)
 
-            # Local range indices
-            ostarti, oendi = vec.owner_range
-            rstarti = ostarti + nvec
-            rendi = rstarti + vec.local_size
-
-            concat_vec.setValues(list(range(rstarti,rendi)), vec[ostarti:oendi])
-            concat_vec.assemble()
-            nvec += vec.size
-
-        return concat_vec
+    def __sub_vecs(self, vec):
+        """Return the Vecs of the individual controls in a Vec built by __petsc_vec_nest."""
+        if len(self.ctrl_data) == 1:
+            return [vec]
+        return vec.getNestSubVecs()
 
     def __constant_as_vec(self, cons):
         """Return a PETSc Vec representing the supplied Constant"""
@@ -375,29 +331,76 @@ class TAOSolver(OptimizationSolver):
 
             cvec.setSizes((PETSc.DECIDE,vec_length))
             cvec.setFromOptions()
+            self.__set_constant_values(cvec, cons)
 
-            # Can't iterate over vector calling float on each entry
-            # Instead evaluate with Numpy arrays of appropriate length
-            # See FEniCS Q&A #592
-            vals = np.zeros(vec_length)
-            cons.eval(vals, np.zeros(vec_length))
+        cvec.assemble()
+        return cvec
 
-            ostarti, oendi = cvec.owner_range
-            for i in range(ostarti, oendi):
-                cvec.setValue(i,vals[i])
+    def __set_constant_values(self, cvec, cons):
+        """Copy the values of the supplied Constant into the locally owned entries of cvec"""
+        # Can't iterate over vector calling float on each entry
+        # Instead evaluate with Numpy arrays of appropriate length
+        # See FEniCS Q&A #592
+        vals = np.zeros(cvec.size)
+        cons.eval(vals, np.zeros(cvec.size))
 
+        ostarti, oendi = cvec.owner_range
+        cvec.setValues(list(range(ostarti, oendi)), vals[ostarti:oendi])
         cvec.assemble()
-        return cvec
 
-    def __control_as_vec(self, control):
-        """Return a PETSc Vec representing the supplied Control"""
+    def __vec_as_constant(self, cvec, shape):
+        """Return a Constant with the values of the supplied Vec"""
+        PETSc = self.PETSc
+        scatter, vals = PETSc.Scatter.toAll(cvec)
+        scatter.scatter(cvec, vals, PETSc.InsertMode.INSERT, PETSc.ScatterMode.FORWARD)
+        vals = vals.getArray()
+
+        if shape == ():
+            return Constant(float(vals[0]))
+        return Constant(np.reshape(vals, shape).tolist())
+
+    def __control_data(self, control):
+        """Return a copy of the values of the supplied Control, which TAO uses as
+        its work vector. A Function supplied as the value of the Control is copied,
+        so that TAO does not overwrite it."""
         if isinstance(control, FunctionControl):
-            as_vec = as_backend_type(control.data().copy(deepcopy=True).vector()).vec()
+            if control.value is not None:
+                return control.value.copy(deepcopy=True)
+            return control.data().copy(deepcopy=True)
         elif isinstance(control, ConstantControl):
-            as_vec = self.__constant_as_vec(Constant(control.data()))
+            return Constant(control.data())
         else:
             raise TypeError("Unknown control type %s" % control.__class__)
-        return as_vec
+
+    def __data_as_vec(self, data):
+        """Return a PETSc Vec representing the values of a control"""
+        if isinstance(data, Function):
+            return as_backend_type(data.vector()).vec()
+        else:
+            return self.__constant_as_vec(data)
+
+    def __data_from_vecs(self, vecs, functions=None):
+        """Return the control values held by the supplied Vecs. The Vecs of
+        Function controls are wrapped, or, if functions is given, assumed to be
+        the vectors of those Functions."""
+        data = []
+        for (i, (vec, ctrl)) in enumerate(zip(vecs, self.ctrl_data)):
+            if isinstance(ctrl, Function):
+                if functions is not None:
+                    data.append(functions[i])
+                else:
+                    data.append(compatibility.petsc_vec_as_function(ctrl.function_space(), vec))
+            else:
+                data.append(self.__vec_as_constant(vec, ctrl.shape()))
+        return data
+
+    def __data_to_vecs(self, data, vecs):
+        """Copy the supplied control values, e.g. a gradient, into the Vecs"""
+        for (d, vec) in zip(enlist(data), vecs):
+            if isinstance(d, Function):
+                as_backend_type(d.vector()).vec().copy(vec)
+            else:
+                self.__set_constant_values(vec, d)
 
     def get_tao(self):
         """Returns the PETSc TAO instance associated with the solver"""
@@ -409,5 +412,4 @@ class TAOSolver(OptimizationSolver):
         sol_vec = self.tao.getSolution()
         self.__user.update(sol_vec)
 
-        # TODO: Multiple controls support
-        return self.problem.reduced_functional.controls[0].data()
+        return delist(self.ctrl_data, list_type=self.problem.reduced_functional.controls)
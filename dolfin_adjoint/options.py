@@ -10,5 +10,13 @@ adj_params.add("cache_factorizations", False)
 adj_params.add("debug_cache", False)
 adj_params.add("symmetric_bcs", False)
 adj_params.add("allow_zero_derivatives", False)
+adj_params.add("deterministic_block_names", False)
+adj_params.add("assembly_cache_size", 1024) # in megabytes, 0 for unbounded
+adj_params.add("checkpoint_memory_budget", 1024) # in megabytes, 0 for unbounded
+adj_params.add("asynchronous_checkpoint_writes", False)
+adj_params.add("memoization_cache_size", 1000) # in entries, 0 for unbounded
+adj_params.add("memoization_cache_budget", 1024) # in megabytes, 0 for unbounded
+adj_params.add("cache_hessian_adjoint", False)
+adj_params.add("hessian_adjoint_cache_size", 1024) # in megabytes, 0 for unbounded
 
 parameters.add(adj_params)
@@ -30,9 +30,14 @@ class PointwiseFunctional(functional.Functional):
         regularisation (Form): the regularisation term (will be evaluated at START_TIME)
         alpha (float): Constant to multiply the misfit terms with
 
+    The observations are a sparse linear operator on u, which is assembled once:
+    each point is located in the mesh, and the basis functions of its cell are
+    tabulated there. Evaluating the functional then costs a sparse matrix-vector
+    product, and its derivative a product with the transpose. In parallel each
+    point is observed by the lowest ranked process that owns a cell containing it.
+
     Limitations:
 
-        - This code need further development to run in parallel.
         - Taylor checks are not yet correct when using a regularisation term.
 
 
@@ -58,9 +63,6 @@ class PointwiseFunctional(functional.Functional):
             self.coords = [self.coords]
             self.refs = [self.refs]
 
-        self.basis    = [None]*len(self.coords)
-        self.skip     = [False]*len(self.coords)
-
         # Some conformity checks
         if self.times is None:
             self.times = ["FINISH_TIME"]
@@ -89,19 +91,75 @@ class PointwiseFunctional(functional.Functional):
               if len(self.ref) != len(self.times): # check compatibility inputs
                 raise RuntimeError("Number of timesteps and observations doesn't match %4i vs %4i" %(len(self.times), len(self.ref)))
 
-        for i in range(len(self.coords)):
-            # Prepare pointwise evals for derivative
-            if self.index[i] is None:
-                ps = backend.PointSource(self.func.function_space(), self.coords[i], 1.)
-            else:
-                ps = backend.PointSource(self.func.function_space().sub(self.index[i]), self.coords[i], 1.)
-            self.basis[i] = backend.Function(self.func.function_space()) # basis function for R
-            ps.apply(self.basis[i].vector())
-
-            # Failsaife for parallel
-            if sum(self.basis[i].vector().array())<1.e-12:
-                if self.verbose: print("coord %i not in domain" %i)
-                self.skip[i] = True
+        self.__build_observation_operator()
+
+    def __build_observation_operator(self):
+        V = self.func.function_space()
+        mesh = V.mesh()
+        comm = mesh.mpi_comm()
+        rank = backend.MPI.rank(comm)
+        size = backend.MPI.size(comm)
+        tree = mesh.bounding_box_tree()
+        local_to_global = V.dofmap().tabulate_local_to_global_dofs()
+
+        # Locate the points in the local cells
+        cells = [tree.compute_first_entity_collision(p) for p in self.coords]
+        found = np.array([c < mesh.num_cells() for c in cells], dtype=bool)
+
+        # Each point is observed by the lowest ranked process that found it
+        if size > 1:
+            from mpi4py import MPI
+            ranks = np.where(found, rank, size).astype(np.int32)
+            owners = np.empty_like(ranks)
+            comm.Allreduce(ranks, owners, op=MPI.MIN)
+        else:
+            owners = np.where(found, 0, 1)
+        self.skip = owners >= size
+        if self.verbose:
+            for i in np.nonzero(self.skip)[0]:
+                print("coord %i not in domain" % i)
+
+        # Tabulate the basis functions of the cell containing each point:
+        # observation k is sum_j vals[j]*u[cols[j]] over the entries with rows[j] == k
+        self.points = np.nonzero(owners == rank)[0]
+        rows = []
+        cols = []
+        vals = []
+        for (k, i) in enumerate(self.points):
+            Vi = V if self.index[i] is None else V.sub(self.index[i])
+            cell = backend.Cell(mesh, cells[i])
+            x = np.array([self.coords[i][d] for d in range(mesh.geometry().dim())])
+            basis = Vi.element().evaluate_basis_all(x, cell.get_vertex_coordinates(), cell.orientation())
+            dofs = Vi.dofmap().cell_dofs(cells[i])
+            rows += [k]*len(dofs)
+            cols += [local_to_global[dof] for dof in dofs]
+            vals += list(basis[:len(dofs)])
+
+        (self.cols, self.col_pos) = np.unique(np.array(cols, dtype='intc'), return_inverse=True)
+        self.rows = np.array(rows, dtype='intc')
+        self.vals = np.array(vals, dtype='d')
+        self.refs_array = np.array([[float(r) for r in self.refs[i]] for i in self.points], dtype='d').reshape(len(self.points), len(self.times))
+
+    def observe(self, u):
+        '''Return the values of u at the points observed by this process. This
+        is collective, as the values of u are gathered from the processes that own them.'''
+        u_cols = u.vector().gather(self.cols)
+        return np.bincount(self.rows, weights=self.vals*u_cols[self.col_pos], minlength=len(self.points))
+
+    def observe_transpose(self, c):
+        '''Return the Function whose vector is the transpose of the observation
+        operator applied to c, the weights of the points observed by this process.'''
+        from petsc4py import PETSc
+        v = backend.Function(self.func.function_space())
+        weights = np.bincount(self.col_pos, weights=self.vals*c[self.rows], minlength=len(self.cols))
+        vec = backend.as_backend_type(v.vector()).vec()
+        vec.setValues(self.cols, weights, addv=PETSc.InsertMode.ADD_VALUES)
+        vec.assemble()
+        return v
+
+    def __misfit(self, u, toi):
+        obs = self.observe(u)
+        return obs - self.refs_array[:, self.times.index(toi)]
 
     #-----------------------------------------------------------------------------------------------------
     # Evaluate functional
@@ -113,38 +171,34 @@ class PointwiseFunctional(functional.Functional):
             print("\r\n******************")
 
         toi = _time_levels(adjointer, timestep)[0] # time of interest
+        comm = self.func.function_space().mesh().mpi_comm()
+
+        my = 0.0
+        if not self.skip.all() and len(values) > 0:
+            if timestep is adjointer.timestep_count -1:
+
+                # add final contribution
+                misfit = self.__misfit(values[0].data, self.times[-1])
+                my = np.dot(misfit, misfit)
 
-        my   = [0.0]*len(self.coords)
-        for i in range(len(self.coords)):
-            if not self.skip[i] and len(values) > 0:
-                if timestep is adjointer.timestep_count -1:
-
-                    # add final contribution
-                    if self.index[i] is None: solu = values[0].data(self.coords[i])
-                    else: solu = values[0].data(self.coords[i])[self.index[i]]
-                    ref  = self.refs[i][self.times.index(self.times[-1])]
-                    my[i] = (solu - float(ref))*(solu - float(ref))
-
-                    # if necessary, add one but last contribution
-                    if toi in self.times and len(values) > 0:
-                        if self.index[i] is None: solu = values[-1].data(self.coords[i])
-                        else: solu = values[-1].data(self.coords[i])[self.index[i]]
-                        ref  = self.refs[i][self.times.index(toi)]
-                        my[i] += (solu - float(ref))*(solu - float(ref))
-
-                elif timestep is 0:
-                    return backend.assemble(self.regform)
-                else: # normal situation
-                    if self.index[i] is None: solu = values[-1].data(self.coords[i])
-                    else: solu = values[-1].data(self.coords[i])[self.index[i]]
-                    ref  = self.refs[i][self.times.index(toi)]
-                    my[i] = (solu - float(ref))*(solu - float(ref))
-
-            if self.verbose:
-                print("my eval ", my[i])
-                print("eval ", timestep, " times ", _time_levels(adjointer, timestep))
-
-        return self.alpha*sum(my)
+                # if necessary, add one but last contribution
+                if toi in self.times and len(values) > 0:
+                    misfit = self.__misfit(values[-1].data, toi)
+                    my += np.dot(misfit, misfit)
+
+            elif timestep is 0:
+                return backend.assemble(self.regform)
+            else: # normal situation
+                misfit = self.__misfit(values[-1].data, toi)
+                my = np.dot(misfit, misfit)
+
+            my = backend.MPI.sum(comm, float(my))
+
+        if self.verbose:
+            print("my eval ", my)
+            print("eval ", timestep, " times ", _time_levels(adjointer, timestep))
+
+        return self.alpha*my
 
     #-----------------------------------------------------------------------------------------------------
     # Evaluate functional derivative
@@ -166,39 +220,32 @@ class PointwiseFunctional(functional.Functional):
             if self.verbose: print("derive ", variable.timestep, " num values ", len(values))
             timesteps = self._derivative_timesteps(adjointer, variable)
 
-            ff    = [backend.Constant(0.0)]*len(self.coords)
-            for i in range(len(self.coords)):
-                if self.skip[i]:
-                    if self.verbose: print("skipped")
-                else:
-                    if len(timesteps) is 1: # only occurs at start and finish time
-                        tsoi = timesteps[-1]
-                        if tsoi is 0: toi = _time_levels(adjointer, tsoi)[0]; ind = -1
-                        else: toi = _time_levels(adjointer, tsoi)[-1]; ind = 0
-                    else:
-                        if len(values) is 1: # one value (easy)
-                            tsoi = timesteps[-1]
-                            toi = _time_levels(adjointer, tsoi)[0]
-                            ind = 0
-                        elif len(values) is 2: # two values (hard)
-                            tsoi = timesteps[-1]
-                            toi = _time_levels(adjointer, tsoi)[0]
-                            if _time_levels(adjointer, tsoi)[1] in self.times: ind = 0
-                            else: ind = 1
-                        else: # three values (easy)
-                            tsoi = timesteps[1]
-                            toi = _time_levels(adjointer, tsoi)[0]
-                            ind = 1
-                    coef = values[ind].data
-                    ref  = self.refs[i][self.times.index(toi)]
-                    if self.index[i] is None: solu = coef(self.coords[i])
-                    else: solu = coef(self.coords[i])[self.index[i]]
-                    ff[i] = backend.Constant(self.alpha*2.0*(solu - float(ref)))
-
-            # Set up linear combinations to be projected
-            form = ff[0]*self.basis[0]
-            for i in range(1, len(self.coords)): form += ff[i]*self.basis[i]
-
-            v = backend.project(form, self.func.function_space())
+            if self.skip.all():
+                if self.verbose: print("skipped")
+                return adjlinalg.Vector(backend.Function(self.func.function_space()))
+
+            if len(timesteps) is 1: # only occurs at start and finish time
+                tsoi = timesteps[-1]
+                if tsoi is 0: toi = _time_levels(adjointer, tsoi)[0]; ind = -1
+                else: toi = _time_levels(adjointer, tsoi)[-1]; ind = 0
+            else:
+                if len(values) is 1: # one value (easy)
+                    tsoi = timesteps[-1]
+                    toi = _time_levels(adjointer, tsoi)[0]
+                    ind = 0
+                elif len(values) is 2: # two values (hard)
+                    tsoi = timesteps[-1]
+                    toi = _time_levels(adjointer, tsoi)[0]
+                    if _time_levels(adjointer, tsoi)[1] in self.times: ind = 0
+                    else: ind = 1
+                else: # three values (easy)
+                    tsoi = timesteps[1]
+                    toi = _time_levels(adjointer, tsoi)[0]
+                    ind = 1
+
+            # The derivative of the misfit is the transposed observation
+            # operator applied to the weighted misfits, no projection is needed
+            misfit = self.__misfit(values[ind].data, toi)
+            v = self.observe_transpose(self.alpha*2.0*misfit)
 
             return adjlinalg.Vector(v)
@@ -1,14 +1,15 @@
 from __future__ import print_function
-import six.moves.cPickle as pickle
-import hashlib
+import numpy
 import libadjoint
 from . import utils
-from backend import Function, Constant, info_red, info_green, File
+from . import memo_store
+from .memo_store import value_hash
+from backend import Function, Constant, info_red, info_green, parameters
 from dolfin_adjoint import drivers, compatibility
 from dolfin_adjoint.adjglobals import adjointer, mem_checkpoints, disk_checkpoints, adj_reset_cache
 from .functional import Functional
 from .enlisting import enlist, delist
-from .controls import DolfinAdjointControl, ListControl
+from .controls import DolfinAdjointControl, ListControl, FunctionControl
 from .misc import noannotations
 
 
@@ -81,15 +82,17 @@ class ReducedFunctional(object):
         self.replay_cb = replay_cb
 
         #: If not None, caching (memoization) will be activated. The control->ouput pairs
-        #: are stored on disk in the filename given by cache.
+        #: are stored on disk in the filename given by cache, and are reused by
+        #: later runs with the same cache file.
         self.cache = cache
         if cache is not None:
-            try:
-                self._cache = pickle.load(open(cache, "r"))
-            except IOError: # didn't exist
-                self._cache = {"functional_cache": {},
-                                "derivative_cache": {},
-                                "hessian_cache": {}}
+            self._cache = memo_store.open_store(cache)
+
+        #: If True, evaluations only replay the equations that depend on the
+        #: controls, and reuse the stored forward solution for all others.
+        #: This requires that the forward solution from the previous evaluation
+        #: is still available; otherwise the whole tape is replayed.
+        self.incremental_replay = True
 
         #: Indicator if the user has overloaded the functional evaluation and
         #: hence re-annotates the forward model at every evaluation.
@@ -127,11 +130,6 @@ class ReducedFunctional(object):
             if not isinstance(cache, str):
                 raise TypeError("cache should be a filename")
 
-    def __del__(self):
-
-        if hasattr(self, 'cache') and self.cache is not None:
-            pickle.dump(self._cache, open(self.cache, "wb"))
-
     @noannotations
     def __call__(self, value):
         """ Evaluates the reduced functional for the given control value.
@@ -160,14 +158,24 @@ class ReducedFunctional(object):
         # Check if the result is already cached
         if self.cache:
             hash = value_hash(value)
-            if hash in self._cache["functional_cache"]:
+            cached = self._cache.get("functional", hash)
+            if cached is not None:
                 # Found a cache
                 info_green("Got a functional cache hit")
-                return self._cache["functional_cache"][hash]
+                return float(cached[0][0])
 
         # Replay the annotation and evaluate the functional
+        affected = self.__affected_equations()
         func_value = 0.
         for i in range(adjointer.equation_count):
+            if affected is not None and i not in affected:
+                # This equation does not depend on the controls, so its stored
+                # solution is still valid
+                timestep = adjointer.equation_vars[i].timestep
+                if i == adjointer.timestep_end_equation(timestep):
+                    func_value += adjointer.evaluate_functional(self.functional, timestep)
+                continue
+
             (fwd_var, output) = adjointer.get_forward_solution(i)
             if isinstance(output.data, Function):
                 output.data.rename(str(fwd_var), "a Function from dolfin-adjoint")
@@ -214,10 +222,43 @@ class ReducedFunctional(object):
         if self.cache:
             # Add result to cache
             info_red("Got a functional cache miss")
-            self._cache["functional_cache"][hash] = self.scale*func_value
+            self._cache.put("functional", hash, [numpy.array([self.scale*func_value])])
 
         return self.scale*func_value
 
+    def __affected_equations(self):
+        '''Return the set of equations that have to be replayed to evaluate the
+        functional at new control values, or None if the whole tape has to be
+        replayed.'''
+
+        if not self.incremental_replay or adjointer.get_checkpoint_strategy() != None:
+            return None
+
+        # Constants enter the equations directly through their forms,
+        # so we can only tell which equations depend on Function controls
+        if not all(isinstance(c, FunctionControl) for c in self.controls):
+            return None
+
+        if len(adjointer.equation_vars) != adjointer.equation_count:
+            return None
+
+        affected = adjointer.affected_equations([c.var for c in self.controls])
+
+        # The stored solutions of all other equations must still be available
+        for i in range(adjointer.equation_count):
+            if i in affected:
+                continue
+            var = adjointer.equation_vars[i]
+            if var is None:
+                return None
+            try:
+                adjointer.get_variable_value(var)
+            except (libadjoint.exceptions.LibadjointErrorNeedValue,
+                    libadjoint.exceptions.LibadjointErrorInvalidInputs):
+                return None
+
+        return affected
+
     def derivative(self, forget=True, project=False):
         """ Evaluates the derivative of the reduced functional at the most
             recently evaluated control value.
@@ -243,16 +284,25 @@ class ReducedFunctional(object):
             fnspaces = [p.data().function_space() if isinstance(p.data(),
                 Function) else None for p in self.controls]
 
-            if hash in self._cache["derivative_cache"]:
+            cached = self._cache.get("derivative", hash)
+            if cached is not None:
                 info_green("Got a derivative cache hit.")
-                return cache_load(self._cache["derivative_cache"][hash], fnspaces)
+                return cache_load(cached, fnspaces)
 
         # Call callback
         values = [p.data() for p in self.controls]
         self.derivative_cb_pre(delist(values, list_type=self.controls))
 
+        # Keep the adjoint solutions for Hessian actions at the same point
+        callback = lambda var, output: None
+        if hasattr(self, "H") and parameters["adjoint"]["cache_hessian_adjoint"]:
+            key = self.H.control_key()
+            # libadjoint keeps the adjoint values unless they are forgotten
+            callback = lambda var, output: self.H.record_adjoint(key, var, output, held=not forget)
+
         # Compute the gradient by solving the adjoint equations
-        dfunc_value = drivers.compute_gradient(self.functional, self.controls, forget=forget, project=project)
+        dfunc_value = drivers.compute_gradient(self.functional, self.controls, forget=forget,
+                                               callback=callback, project=project)
         dfunc_value = enlist(dfunc_value)
 
         # Reset the checkpointing state in dolfin-adjoint
@@ -278,10 +328,49 @@ class ReducedFunctional(object):
         # Cache the result
         if self.cache is not None:
             info_red("Got a derivative cache miss")
-            self._cache["derivative_cache"][hash] = cache_store(scaled_dfunc_value, self.cache)
+            self._cache.put("derivative", hash, cache_store(scaled_dfunc_value))
 
         return scaled_dfunc_value
 
+    def value_and_gradient(self, value, forget=True, project=False):
+        """ Evaluates the reduced functional and its derivative for the given
+        control value. The adjoint equations are solved straight after the
+        forward replay, and by default each forward solution is deleted as soon
+        as the remaining adjoint equations no longer need it, so the forward
+        history is never held in full beyond the replay itself.
+
+	Args:
+	    value: The point in control space where to evaluate the functional and its derivative. Must be of the same type as the Control (e.g. Function, Constant or lists of latter).
+	    forget (Optional[bool]): Delete the forward state while solving the
+                adjoint equations. If you want to evaluate the Hessian at this point
+                you will need to set this to False or None. Defaults to True.
+	    project (Optional[bool]): If True, the returned derivative will be the L2
+                Riesz representer, if False it will be the l2 Riesz representative.
+                Defaults to False.
+
+	Returns:
+	    tuple: The functional value and the functional derivative.
+        """
+
+        func_value = self(value)
+        dfunc_value = self._derivative_keeping_controls(forget=forget, project=project)
+
+        return (func_value, dfunc_value)
+
+    def _derivative_keeping_controls(self, forget=True, project=False):
+        ''' Evaluates the derivative as derivative does, but with the Function
+        control values marked as checkpoints before the adjoint sweep, so that
+        they are not forgotten along with the rest of the forward state. '''
+
+        if forget and adjointer.get_checkpoint_strategy() is None:
+            for c in self.controls:
+                if isinstance(c, FunctionControl) and c.value is None:
+                    storage = libadjoint.MemoryStorage(adjointer.get_variable_value(c.var), cs=True)
+                    storage.set_overwrite(True)
+                    adjointer.record_variable(c.var, storage)
+
+        return self.derivative(forget=forget, project=project)
+
     def hessian(self, m_dot, project=False):
         """ Evaluates the Hessian action at the most recently evaluated control
         value in direction m_dot.
@@ -306,13 +395,14 @@ class ReducedFunctional(object):
         # Check if we have the gradient already in the cash.
         # If so, return the cached value
         if self.cache is not None:
-            hash = value_hash([x.data() for x in self.controls] + [m_dot])
+            hash = value_hash([x.data() for x in self.controls] + enlist(m_dot))
             fnspaces = [p.data().function_space() if isinstance(p.data(),
                 Function) else None for p in self.controls]
 
-            if hash in self._cache["hessian_cache"]:
+            cached = self._cache.get("hessian", hash)
+            if cached is not None:
                 info_green("Got a Hessian cache hit.")
-                return cache_load(self._cache["hessian_cache"][hash], fnspaces)
+                return delist(cache_load(cached, fnspaces), list_type=self.controls)
             else:
                 info_red("Got a Hessian cache miss")
 
@@ -335,11 +425,52 @@ class ReducedFunctional(object):
 
         # Cache the result
         if self.cache is not None:
-            self._cache["hessian_cache"][hash] = cache_store(scaled_Hm, self.cache)
+            self._cache.put("hessian", hash, cache_store(enlist(scaled_Hm)))
 
         return scaled_Hm
 
-    def taylor_test(self, value=None, test_hessian=False, seed=None, perturbation_direction=None, size=None):
+    def hessian_block(self, m_dots, project=False):
+        """ Evaluates the Hessian action at the most recently evaluated control
+        value in each of the directions m_dots. The directions are computed
+        equation by equation, sharing the forward and adjoint solutions of each
+        equation. Each direction is still solved separately, so this is only
+        cheaper than calling hessian for each direction where the assembly and
+        factorisation caches apply.
+
+	Args:
+            m_dots: A list of directions in control space in which to compute the
+                Hessian. Each must be of the same type as the Control (e.g. Function,
+                Constant or lists of latter).
+
+            project (Optional[bool]): If True, the returned values will be the L2
+                Riesz representers, if False they will be the l2 Riesz representatives.
+                Defaults to False.
+
+	Returns:
+	    A list of the directional second derivatives. Each has the same type as the
+            control type.
+        """
+
+        Hms = self.H.block(m_dots, project=project)
+
+        # Apply the scaling factor
+        scaled_Hms = [utils.scale(Hm, self.scale) for Hm in Hms]
+
+        # Call callback
+        control_data = [p.data() for p in self.controls]
+        if self.current_func_value is not None:
+            current_func_value = self.scale * self.current_func_value
+        else:
+            current_func_value = None
+
+        for (m_dot, scaled_Hm) in zip(m_dots, scaled_Hms):
+            self.hessian_cb(current_func_value,
+                            delist(control_data, list_type=self.controls),
+                            m_dot, scaled_Hm)
+
+        return scaled_Hms
+
+    def taylor_test(self, value=None, test_hessian=False, seed=None, perturbation_direction=None, size=None, ensemble=None):
         """ Run a Taylor test to check that the functional, gradient and
         (optionally) Hessian are consistent by
         running the Taylor test.
@@ -358,6 +489,9 @@ class ReducedFunctional(object):
                 Function, Constant or lists of latter). Defaults to a random
                 direction.
             size (Optional[int]): Number of perturbations for the test
+            ensemble (Optional[Ensemble]): If given, the perturbed evaluations
+                are shared out between the members of the ensemble, each of
+                which replays its own copy of the tape.
 
 	Returns:
 	    float: The minimum (higher-order) convergence rate of all performed tests.
@@ -376,7 +510,8 @@ class ReducedFunctional(object):
             HJm = None
 
         return utils.taylor_test(self.__call__, self.controls, Jm, dJdm, HJm, seed=seed,
-                                 perturbation_direction=perturbation_direction, size=size)
+                                 perturbation_direction=perturbation_direction, size=size,
+                                 ensemble=ensemble)
 
     def mpi_comm(self):
         """ Return the MPI communicator associated with this reduced functional."""
@@ -389,44 +524,31 @@ class ReducedFunctional(object):
 
 
 
-def value_hash(value):
-    if isinstance(value, Constant):
-        return str(float(value))
-    elif isinstance(value, Function):
-        m = hashlib.md5()
-        m.update('{}{}{}'.format(
-            value.vector().norm("l2"),
-            value.vector().norm("l1"),
-            value.vector().norm("linf"),
-            ).encode('utf8')
-        )
-        return m.hexdigest()
-    elif isinstance (value, list):
-        return "".join(map(value_hash, value))
-    else:
-        raise Exception("Don't know how to take a hash of %s" % value)
-
-
 def cache_load(value, V):
-    if isinstance(value, (list, tuple)):
-        return [cache_load(value[i], V[i]) for i in range(len(value))]
-    elif isinstance(value, float):
-        return Constant(value)
-    elif isinstance(value, str):
-        return Function(V, value)
-    return
-
-
-def cache_store(value, cache):
-    if isinstance(value, (list, tuple)):
-        return tuple(cache_store(x, cache) for x in value)
-    elif isinstance(value, Constant):
-        return float(value)
-    elif isinstance(value, Function):
-        hash = value_hash(value)
-        filename = "%s_dir/%s.xml.gz" % (cache, hash)
-        File(filename) << value
-        return filename
-    else:
-        raise Exception("Don't know how to store %s" % value)
-    return
+    '''Convert the arrays stored by cache_store back into Constants and
+    Functions on the function spaces V.'''
+    out = []
+    for (array, fnspace) in zip(value, V):
+        if fnspace is None:
+            out.append(Constant(array[0]) if array.shape[0] == 1 else Constant(tuple(array)))
+        else:
+            f = Function(fnspace)
+            f.vector().set_local(array)
+            f.vector().apply("insert")
+            out.append(f)
+    return out
+
+
+def cache_store(value):
+    '''Convert a list of Constants and Functions to arrays of their (local)
+    values. These are only valid for the parallel decomposition they were stored
+    with, which is identified by the value_hash key they are stored under.'''
+    out = []
+    for v in value:
+        if isinstance(v, Constant):
+            out.append(numpy.asarray(v.values(), dtype=numpy.float64))
+        elif isinstance(v, Function):
+            out.append(v.vector().get_local())
+        else:
+            raise Exception("Don't know how to store %s" % v)
+    return out
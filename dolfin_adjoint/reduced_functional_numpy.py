@@ -5,6 +5,7 @@ from dolfin_adjoint import constant, utils
 from dolfin_adjoint.adjglobals import adjointer, adj_reset_cache
 from .reduced_functional import ReducedFunctional
 from .utils import gather
+from . import compatibility
 from functools import partial
 from . import misc
 
@@ -15,9 +16,15 @@ class ReducedFunctionalNumPy(ReducedFunctional):
     This "NumPy version" of the dolfin_adjoint.ReducedFunctional is created from
     an existing ReducedFunctional object:
     rf_np = ReducedFunctionalNumPy(rf = rf)
+
+    By default the arrays hold the values of all controls on every process. If
+    distributed is True, each process only holds the values it owns, as a
+    DistributedArray whose reductions are performed over all processes. In
+    parallel this requires NumPy >= 1.17, so that NumPy functions such as
+    np.dot dispatch to the DistributedArray.
     '''
 
-    def __init__(self, rf):
+    def __init__(self, rf, distributed=False):
         super(ReducedFunctionalNumPy, self).__init__(rf.functional,
                 rf.controls, scale=rf.scale,
                 eval_cb_pre=rf.eval_cb_pre,
@@ -32,9 +39,13 @@ class ReducedFunctionalNumPy(ReducedFunctional):
         self.__base_call__ = rf.__call__
         self.__base_derivative__ = rf.derivative
         self.__base_hessian__ = rf.hessian
+        self.__base_hessian_block__ = rf.hessian_block
 
         self.rf = rf
+        self.distributed = distributed
 
+        if distributed and not _array_function_dispatch and compatibility.size(self.mpi_comm()) > 1:
+            raise NotImplementedError("distributed=True requires NumPy >= 1.17 in parallel, as NumPy %s would compute np.dot and np.linalg.norm of a DistributedArray over the local values only" % np.__version__)
 
     def __call__(self, m_array):
         ''' An implementation of the reduced functional evaluation
@@ -54,10 +65,16 @@ class ReducedFunctionalNumPy(ReducedFunctional):
         return self.__base_call__(m)
 
     def set_local(self, m, m_array):
-        set_local(m, m_array)
+        if self.distributed:
+            set_owned(m, m_array, self.mpi_comm())
+        else:
+            set_local(m, m_array)
 
     def get_global(self, m):
-        return get_global(m)
+        if self.distributed:
+            return get_owned(m, self.mpi_comm())
+        else:
+            return get_global(m)
 
     def derivative(self, m_array=None, forget=True, project=False):
         ''' An implementation of the reduced functional derivative evaluation
@@ -75,17 +92,25 @@ class ReducedFunctionalNumPy(ReducedFunctional):
 
         dJdm = self.__base_derivative__(forget=forget, project=project)
 
-        if project:
-            dJdm_global = self.get_global(dJdm)
-        else:
-            dJdm_global = get_global(dJdm)
+        return self.get_global(dJdm)
 
-        return dJdm_global
+    def value_and_gradient(self, m_array, forget=True, project=False):
+        ''' An implementation of the fused reduced functional and derivative
+            evaluation that accepts the controls as an array of scalars. Unlike
+            calling derivative after __call__, this does not compare m_array
+            with the current controls. '''
+
+        j = self(m_array)
+        dJdm = self.rf._derivative_keeping_controls(forget=forget, project=project)
+
+        return (j, self.get_global(dJdm))
 
     def hessian(self, m_array, m_dot_array):
         ''' An implementation of the reduced functional hessian action evaluation
             that accepts the controls as an array of scalars. If m_array is None,
-            the Hessian action at the latest forward run is returned. '''
+            the Hessian action at the latest forward run is returned. If m_dot_array
+            is two-dimensional, each row is a direction and the Hessian actions in
+            all directions are computed by hessian_block and returned as the rows of an array. '''
 
         if not hasattr(self, "H"):
             raise NotImplementedError("Hessian computation not supported.")
@@ -104,11 +129,21 @@ class ReducedFunctionalNumPy(ReducedFunctional):
 
             self.set_local(m, m_array)
 
+        if np.ndim(m_dot_array) == 2:
+            m_dots = []
+            for m_dot_row in m_dot_array:
+                m_dot = [copy_data(p.data()) for p in self.controls]
+                self.set_local(m_dot, m_dot_row)
+                m_dots.append(m_dot)
+
+            hess = self.__base_hessian_block__(m_dots)
+            return np.array([self.get_global(h) for h in hess])
+
         m_dot = [copy_data(p.data()) for p in self.controls]
         self.set_local(m_dot, m_dot_array)
 
         hess = self.__base_hessian__(m_dot)
-        hess_array = get_global(hess)
+        hess_array = self.get_global(hess)
 
         return hess_array
 
@@ -116,8 +151,10 @@ class ReducedFunctionalNumPy(ReducedFunctional):
         return self.get_global(obj)
 
     def get_controls(self):
+        # In distributed mode obj_to_array may return a view on the controls,
+        # which the caller must be free to modify
         m = [p.data() for p in self.controls]
-        return self.obj_to_array(m)
+        return self.obj_to_array(m).copy()
 
     def set_controls(self, array):
         m = [p.data() for p in self.controls]
@@ -291,4 +328,178 @@ def set_local(coeffs, global_array):
             raise TypeError('Unknown type %s' % m.__class__)
 
 
+# Whether NumPy functions dispatch to __array_function__, which is enabled by
+# default from NumPy 1.17
+_array_function_dispatch = np.lib.NumpyVersion(np.__version__) >= "1.17.0"
+
+class DistributedArray(np.ndarray):
+    ''' A NumPy array holding the control values owned by this process. Reductions
+        over the whole array (sums, inner products, norms, minima and maxima) are
+        performed over all processes of comm, so optimisation algorithms written
+        for NumPy arrays see the values of the global vector. Elementwise operations
+        act on the local values only and need no communication. The methods are
+        always reduced over all processes, while NumPy functions such as np.dot
+        and np.linalg.norm are only reduced with NumPy >= 1.17. '''
+
+    def __new__(cls, array, comm):
+        obj = np.asarray(array).view(cls)
+        obj.comm = comm
+        return obj
+
+    def __array_finalize__(self, obj):
+        self.comm = getattr(obj, "comm", None)
+
+    def _reduce(self, value, op):
+        return compatibility.allreduce(self.comm, value, op)
+
+    def sum(self, axis=None, *args, **kwargs):
+        if axis is not None:
+            return np.ndarray.sum(self, axis, *args, **kwargs)
+        return self._reduce(float(self.view(np.ndarray).sum()), "sum")
+
+    def max(self, axis=None, *args, **kwargs):
+        if axis is not None:
+            return np.ndarray.max(self, axis, *args, **kwargs)
+        local = self.view(np.ndarray).max() if self.size > 0 else -np.inf
+        return self._reduce(float(local), "max")
+
+    def min(self, axis=None, *args, **kwargs):
+        if axis is not None:
+            return np.ndarray.min(self, axis, *args, **kwargs)
+        local = self.view(np.ndarray).min() if self.size > 0 else np.inf
+        return self._reduce(float(local), "min")
+
+    def any(self, axis=None, *args, **kwargs):
+        if axis is not None:
+            return np.ndarray.any(self, axis, *args, **kwargs)
+        return self._reduce(float(self.view(np.ndarray).any()), "max") > 0.5
+
+    def all(self, axis=None, *args, **kwargs):
+        if axis is not None:
+            return np.ndarray.all(self, axis, *args, **kwargs)
+        return self._reduce(float(self.view(np.ndarray).all()), "min") > 0.5
+
+    def dot(self, other):
+        return self._reduce(float(np.dot(self.view(np.ndarray), np.asarray(other).view(np.ndarray))), "sum")
+
+    def norm(self, ord=None):
+        local = self.view(np.ndarray)
+        if ord in (None, 2):
+            return np.sqrt(self._reduce(float(np.dot(local, local)), "sum"))
+        elif ord == np.inf:
+            return self._reduce(float(np.abs(local).max()) if self.size > 0 else 0.0, "max")
+        elif ord == 1:
+            return self._reduce(float(np.abs(local).sum()), "sum")
+        else:
+            raise ValueError("Unsupported norm order %s" % ord)
+
+    def global_size(self):
+        return int(self._reduce(float(self.size), "sum"))
+
+    def __array_function__(self, func, types, args, kwargs):
+        # Route the NumPy reductions used by optimisation algorithms to their
+        # distributed implementations
+        if func in _distributed_functions:
+            (nargs, impl) = _distributed_functions[func]
+            if len(args) == nargs and set(kwargs) <= set(["ord"]):
+                return impl(*args, **kwargs)
+        return super(DistributedArray, self).__array_function__(func, types, args, kwargs)
+
+def _distributed_dot(a, b):
+    if isinstance(a, DistributedArray):
+        return a.dot(b)
+    else:
+        return b.dot(a)
+
+# The NumPy functions computed over all processes, with the number of
+# positional arguments they take
+_distributed_functions = {
+    np.sum: (1, lambda a: a.sum()),
+    np.amax: (1, lambda a: a.max()),
+    np.amin: (1, lambda a: a.min()),
+    np.max: (1, lambda a: a.max()),
+    np.min: (1, lambda a: a.min()),
+    np.any: (1, lambda a: a.any()),
+    np.all: (1, lambda a: a.all()),
+    np.dot: (2, _distributed_dot),
+    np.vdot: (2, _distributed_dot),
+    np.inner: (2, _distributed_dot),
+    np.linalg.norm: (1, lambda x, ord=None: x.norm(ord)),
+}
+
+def get_owned(m_list, comm):
+    ''' Takes a list of distributed objects and returns a DistributedArray containing the
+        values owned by this process. Constants and floats are owned by process 0. For a
+        single Function the array is a view on its vector, so no data are copied. '''
+    if not isinstance(m_list, (list, tuple)):
+        m_list = [m_list]
+
+    root = compatibility.rank(comm) == 0
+    m_owned = []
+    for m in m_list:
+
+        # Parameters of type float
+        if m is None or type(m) == float:
+            m_owned.append(np.array([np.nan if m is None else m] if root else [], dtype='d'))
+
+        elif isinstance(m, np.ndarray):
+            m_owned.append(m)
+
+        # Control of type Function
+        elif hasattr(m, "vector") or hasattr(m, "gather"):
+            if not hasattr(m, "gather"):
+                m_v = m.vector()
+            else:
+                m_v = m
+            m_owned.append(compatibility.local_array(m_v))
+
+        # Parameters of type Constant
+        elif hasattr(m, "value_size"):
+            a = np.zeros(m.value_size())
+            p = np.zeros(m.value_size())
+            m.eval(a, p)
+            m_owned.append(a if root else np.zeros(0))
+
+        else:
+            raise TypeError('Unknown control type %s.' % str(type(m)))
+
+    if len(m_owned) == 1:
+        return DistributedArray(m_owned[0], comm)
+    return DistributedArray(np.concatenate(m_owned).astype('d'), comm)
+
+def set_owned(coeffs, owned_array, comm):
+    ''' Updates the values of coeffs (a list of dolfin.Coefficients) from an
+        array of the values owned by this process, as returned by get_owned
+    '''
+
+    if not isinstance(coeffs, (list, tuple)):
+        coeffs = [coeffs]
+
+    owned_array = np.asarray(owned_array).view(np.ndarray)
+    root = compatibility.rank(comm) == 0
+    offset = 0
+    for m in coeffs:
+        # Control of type dolfin.Function
+        if hasattr(m, "vector"):
+            n = m.vector().local_size()
+            m_a_local = owned_array[offset:offset + n]
+            # Nothing to do if the array is a view on the vector itself
+            if not np.may_share_memory(m_a_local, compatibility.local_array(m.vector())):
+                m.vector().set_local(m_a_local)
+                m.vector().apply('insert')
+            offset += n
+        # Parameters of type dolfin.Constant, which process 0 owns
+        elif hasattr(m, "value_size"):
+            n = m.value_size() if root else 0
+            values = [compatibility.allreduce(comm, float(owned_array[offset + i]) if root else 0.0, "sum")
+                      for i in range(m.value_size())]
+            m.assign(constant.Constant(np.reshape(values, m.ufl_shape)))
+            offset += n
+        elif isinstance(m, np.ndarray):
+            m[:] = owned_array[offset:offset+len(m)]
+            offset += len(m)
+        else:
+            raise TypeError('Unknown type %s' % m.__class__)
+
+
 ReducedFunctionalNumpy = ReducedFunctionalNumPy
@@ -130,11 +130,32 @@ def annotate(*args, **kwargs):
     # Set up the data associated with the matrix on the left-hand side. This goes on the diagonal
     # of the 'large' system that incorporates all of the timelevels, which is why it is prefixed
     # with diag.
-    key = '{}{}{}{}'.format(hash(eq_lhs), hash(eq_rhs), u, random.random()).encode('utf8')
-    diag_name = hashlib.md5(key).hexdigest() # we don't have a useful human-readable name, so take the md5sum of the string representation of the forms
     diag_deps = [adjglobals.adj_variables[coeff] for coeff in ufl.algorithms.extract_coefficients(eq_lhs) if isinstance(coeff, compatibility.function_type)]
     diag_coeffs = [coeff for coeff in ufl.algorithms.extract_coefficients(eq_lhs) if isinstance(coeff, compatibility.function_type)]
 
+    # Our equation may depend on Expressions, and those Expressions may have parameters
+    # (e.g. for time-dependent boundary conditions).
+    # In order to successfully replay the forward solve, we need to keep those parameters around.
+    # In expressions.py, we overloaded the Expression class to record all of the parameters
+    # as they are set. We're now going to copy that dictionary as it is at the annotation time,
+    # so that we can get back to this exact state:
+    frozen_expressions = expressions.freeze_dict()
+    frozen_constants = constant.freeze_dict()
+
+    # If requested, structurally identical solves share one canonical block, so that the
+    # assembled operators and factorisations cached on the way backwards are reused
+    # across timesteps. The operator only stays the same if it does not depend on
+    # previously computed variables.
+    cache_key = None
+    if backend.parameters["adjoint"]["deterministic_block_names"] and not initial_guess:
+        op_key = caching.operator_key(eq_lhs, eq_bcs, solver_parameters, matrix_class)
+        diag_name = caching.block_name(op_key, u, frozen_expressions, frozen_constants)
+        if len(diag_coeffs) == 0:
+            cache_key = op_key
+    else:
+        key = '{}{}{}{}'.format(hash(eq_lhs), hash(eq_rhs), u, random.random()).encode('utf8')
+        diag_name = hashlib.md5(key).hexdigest() # we don't have a useful human-readable name, so take the md5sum of the string representation of the forms
+
     if initial_guess and linear: # if the initial guess matters, we're going to have to add this in as a dependency of the system
         initial_guess_var = adjglobals.adj_variables[u]
         diag_deps.append(initial_guess_var)
@@ -167,15 +188,6 @@ def annotate(*args, **kwargs):
     # With the initial conditions out of the way, let us now define the callbacks that
     # define the actions of the operator the user has passed in on the lhs of this equation.
 
-    # Our equation may depend on Expressions, and those Expressions may have parameters
-    # (e.g. for time-dependent boundary conditions).
-    # In order to successfully replay the forward solve, we need to keep those parameters around.
-    # In expressions.py, we overloaded the Expression class to record all of the parameters
-    # as they are set. We're now going to copy that dictionary as it is at the annotation time,
-    # so that we can get back to this exact state:
-    frozen_expressions = expressions.freeze_dict()
-    frozen_constants = constant.freeze_dict()
-
     def diag_assembly_cb(dependencies, values, hermitian, coefficient, context):
         '''This callback must conform to the libadjoint Python block assembly
         interface. It returns either the form or its transpose, depending on
@@ -189,6 +201,9 @@ def annotate(*args, **kwargs):
         eq_l = backend.replace(eq_lhs, dict(zip(diag_coeffs, value_coeffs)))
 
         kwargs = {"cache": eq_l in caching.assembled_fwd_forms} # should we cache our matrices on the way backwards?
+        if cache_key is not None:
+            kwargs['cache'] = True
+            kwargs['key'] = cache_key + (":adjoint" if hermitian else ":forward")
 
         if hermitian:
             # Homogenise the adjoint boundary conditions. This creates the adjoint
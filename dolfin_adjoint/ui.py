@@ -12,6 +12,7 @@ from .controls import ConstantControls
 from .solving import solve, adj_checkpointing, annotate, record
 from .adjglobals import adj_start_timestep, adj_inc_timestep, adjointer, adj_check_checkpoints, adj_html, adj_reset
 from .gst import compute_gst, compute_propagator_matrix, perturbed_replay
+from .lowrank import LowRankFactorisation, low_rank_hessian, randomised_eig, randomised_svd
 from .utils import convergence_order, DolfinAdjointVariable
 from .utils import taylor_test
 from .utils import taylor_test_expression
@@ -35,6 +36,7 @@ from .optimization.riesz_maps import *
 
 from .reduced_functional import ReducedFunctional
 from .reduced_functional_numpy import ReducedFunctionalNumPy, ReducedFunctionalNumpy
+from .ensemble import Ensemble, EnsembleReducedFunctional
 from .optimization.constraints import InequalityConstraint, EqualityConstraint
 from .optimization.optimization import minimize, maximize, print_optimization_methods, minimise, maximise
 from .optimization.tao_solver import TAOSolver
@@ -432,7 +432,7 @@ def taylor_remainder_with_gradient(m, Jm, dJdm, functional_value, perturbation,
     return remainder
 
 @noannotations
-def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None, value=None, size=None):
+def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None, value=None, size=None, ensemble=None):
     '''J must be a function that takes in a parameter value m and returns the value
        of the functional:
 
@@ -450,7 +450,12 @@ def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None
        direction and returns the Hessian of the functional in that direction
        (i.e., takes in a vector and returns a vector). In that case, an additional
        Taylor remainder is computed, which should converge at order 3 if the Hessian
-       is correct.'''
+       is correct.
+
+       If ensemble is an Ensemble, the evaluations of J at the perturbed controls
+       are shared out between its members. J, m and the gradient must then live
+       on the spatial communicator of the member of this process, and a random
+       perturbation direction is taken from the first member.'''
 
     from . import controls
     from .controls import ListControl
@@ -463,12 +468,12 @@ def taylor_test(J, m, Jm, dJdm, HJm=None, seed=None, perturbation_direction=None
     # Handle the multi-control case
     # We do this by performing a separate Taylor test for each control.
     if isinstance(m, controls.ListControl):
-        return _taylor_test_multi_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction, value, size=size)
+        return _taylor_test_multi_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction, value, size=size, ensemble=ensemble)
     else:
-        return _taylor_test_single_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction, value, size=size)
+        return _taylor_test_single_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction, value, size=size, ensemble=ensemble)
 
 
-def _taylor_test_multi_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction, value, size=None):
+def _taylor_test_multi_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction, value, size=None, ensemble=None):
     if perturbation_direction is None:
         perturbation_direction = [None] * len(m.controls)
     perturbation_direction = enlist(perturbation_direction)
@@ -506,13 +511,13 @@ def _taylor_test_multi_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction
     for i in range(len(m.controls)):
         print("\nRunning Taylor test for control {}".format(i))
         conv = _taylor_test_single_control(J_cmp(J, i), m[i], Jm, dJdm[i],
-                                           HJm_cmp(i), seed, perturbation_direction[i], value[i], size)
+                                           HJm_cmp(i), seed, perturbation_direction[i], value[i], size, ensemble)
         min_conv = min(min_conv, conv)
 
     return min_conv
 
 
-def _taylor_test_single_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction, value, size=None):
+def _taylor_test_single_control(J, m, Jm, dJdm, HJm, seed, perturbation_direction, value, size=None, ensemble=None):
     from . import function, controls
 
     # Default to five runs/perturbations is none given
@@ -574,6 +579,10 @@ def _taylor_test_single_control(J, m, Jm, dJdm, HJm, seed, perturbation_directio
 
             compatibility.randomise(perturbation_direction)
 
+            # All members must perturb in the same direction
+            if ensemble is not None:
+                ensemble.bcast(perturbation_direction)
+
         else:
             raise libadjoint.exceptions.LibadjointErrorNotImplemented("Don't know how to compute a perturbation direction")
     else:
@@ -620,10 +629,10 @@ def _taylor_test_single_control(J, m, Jm, dJdm, HJm, seed, perturbation_directio
             HJm_values.append(HJmp)
 
     # At last: the common bit!
-    functional_values = []
-    for pinput in pinputs:
-        Jp = J(pinput)
-        functional_values.append(Jp)
+    if ensemble is None:
+        functional_values = [J(pinput) for pinput in pinputs]
+    else:
+        functional_values = ensemble.map(J, pinputs)
 
     # First-order Taylor remainders (not using adjoint)
     no_gradient = [abs(perturbed_J - Jm) for perturbed_J in functional_values]
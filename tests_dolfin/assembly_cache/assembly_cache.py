@@ -0,0 +1,56 @@
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import caching
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(ic, annotate=True):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = Function(V, name="Solution")
+    u_0.assign(ic, annotate=False)
+
+    dt = Constant(0.1)
+
+    a = (u/dt*v + inner(grad(u), grad(v)))*dx
+    L = u_0/dt*v*dx
+
+    bc = DirichletBC(V, 1.0, "on_boundary")
+    A = assemble(a, annotate=annotate)
+    bc.apply(A)
+
+    for i in range(5):
+        b = assemble(L, annotate=annotate)
+        bc.apply(b)
+        solve(A, u_0.vector(), b, "lu", annotate=annotate)
+
+    return u_0
+
+if __name__ == "__main__":
+
+    ic = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="InitialCondition")
+    u = main(ic)
+
+    J = Functional(u*u*dx*dt[FINISH_TIME])
+    m = Control(ic)
+    Jhat = ReducedFunctional(J, m)
+
+    Jhat(ic)
+    dJdm = Jhat.derivative(forget=False)[0]
+    misses = caching.assembled_adj_forms.misses
+
+    # The operator does not depend on the control, so a second evaluation
+    # at a new point reuses every assembled matrix
+    ic_new = interpolate(Expression("sin(2*pi*x[0])", degree=1), V)
+    Jhat(ic_new)
+    Jhat.derivative(forget=False)
+    assert caching.assembled_adj_forms.misses == misses
+    assert caching.assembled_adj_forms.hits > 0
+
+    # ... and gives the same gradient as before when evaluated at the old point
+    Jhat(ic)
+    assert (Jhat.derivative(forget=False)[0].vector() - dJdm.vector()).norm("linf") < 1.0e-12
+
+    assert Jhat.taylor_test(ic) > 1.9
@@ -0,0 +1,96 @@
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint import adjglobals, checkpoint_storage
+import numpy
+import os
+import sys
+import tempfile
+
+parameters["adjoint"]["fussy_replay"] = True
+
+# A budget of a single checkpoint forces the older ones into the compressed and
+# on-disk tiers
+adjglobals.checkpoint_store.max_bytes = lambda: 512
+
+adj_checkpointing(strategy='multistage', steps=4,
+                  snaps_on_disk=3, snaps_in_ram=1, verbose=True)
+
+n = 30
+mesh = UnitIntervalMesh(n)
+V = FunctionSpace(mesh, "CG", 2)
+
+ic = project(Expression("sin(2*pi*x[0])", degree=1),  V)
+
+def main(nu):
+    u = ic.copy(deepcopy=True)
+    u_next = Function(V)
+    v = TestFunction(V)
+
+    timestep = Constant(1.0/n)
+
+    F = ((u_next - u)/timestep*v
+        + u_next*u_next.dx(0)*v
+        + nu*u_next.dx(0)*v.dx(0))*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+
+    t = 0.0
+    end = 0.1
+    while (t <= end):
+        solve(F == 0, u_next, bc)
+        u.assign(u_next)
+        t += float(timestep)
+        adj_inc_timestep()
+
+    return u
+
+if __name__ == "__main__":
+    nu = Constant(0.0001)
+    u = main(nu)
+
+    stats = adjglobals.checkpoint_store.stats()
+    assert stats["compressed"] + stats["disk"] > 0
+    assert stats["bytes"] <= 512
+
+    adj_check_checkpoints()
+
+    J = Functional(inner(u,u)*dx*dt[FINISH_TIME])
+    dJdnu = compute_gradient(J, Control(nu))
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    Jnu = assemble(inner(u, u)*dx) # current value
+
+    def Jhat(nu): # the functional as a pure function of nu
+        u = main(nu)
+        return assemble(inner(u, u)*dx)
+
+    conv_rate = taylor_test(Jhat, Control(nu), Jnu, dJdnu)
+
+    if conv_rate < 1.9:
+        sys.exit(1)
+
+    # Asynchronous writes to disk give back the stored arrays
+    parameters["adjoint"]["asynchronous_checkpoint_writes"] = True
+    dirname = tempfile.mkdtemp()
+    store = checkpoint_storage.TieredStorage(dirname=dirname)
+    store.max_bytes = lambda: 1
+    arrays = [numpy.random.random(100) for i in range(10)]
+    for (i, array) in enumerate(arrays):
+        store[i] = array
+    assert store.stats()["disk"] == len(arrays)
+
+    # Stores sharing a directory use separate files
+    other = checkpoint_storage.TieredStorage(dirname=dirname)
+    other.max_bytes = lambda: 1
+    other[0] = arrays[0]
+    assert other.file_name != store.file_name
+    other.clear()
+    assert len(os.listdir(dirname)) == 1
+
+    # Reading blocks back from disk does not grow the file without bound
+    for repeat in range(5):
+        for (i, array) in enumerate(arrays):
+            assert (store[i] == array).all()
+            assert os.path.getsize(store.file_name) < 2 * store.file_live
+    store.clear()
+    assert len(os.listdir(dirname)) == 0
@@ -0,0 +1,63 @@
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+# One process per ensemble member, so each member runs the model in serial
+ensemble = Ensemble(M=1)
+
+mesh = UnitSquareMesh(ensemble.comm, 8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+test = TestFunction(V)
+
+def main(m, nu):
+    u = Function(V, name="Solution")
+    F = inner(nu*grad(u), grad(test))*dx + inner(u**3, test)*dx - inner(m, test)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+
+    return u
+
+if __name__ == "__main__":
+    m = interpolate(Expression("sin(pi*x[0])*x[1]", degree=2), V, name="Parameter")
+    nu = Constant(1.0)
+    u = main(m, nu)
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    J = Functional(inner(u, u)*dx + inner(m, m)*dx)
+    rf = ReducedFunctionalNumPy(ReducedFunctional(J, [Control(m), Control(nu)]))
+    erf = EnsembleReducedFunctional(rf, ensemble)
+    assert ensemble.members == MPI.size(mpi_comm_world())
+
+    m0 = rf.get_controls()
+    m_arrays = [m0*(1.0 + 0.1*i) for i in range(5)]
+
+    (js, djs) = erf.value_and_gradient(m_arrays)
+    assert len(js) == len(djs) == len(m_arrays)
+
+    # Every member returns all the results, which match those computed by
+    # this member alone
+    for (m_array, j, dj) in zip(m_arrays, js, djs):
+        (j_serial, dj_serial) = rf.value_and_gradient(m_array)
+        assert abs(j - j_serial) < 1.0e-12*abs(j_serial)
+        assert numpy.allclose(dj, dj_serial, rtol=1.0e-10, atol=1.0e-14)
+
+    assert numpy.allclose(erf(m_arrays), js, rtol=1.0e-12)
+
+    # Each member evaluates several points with a Function control, and the
+    # batch is evaluated again, so the controls must survive the adjoint
+    # sweeps of earlier evaluations
+    rf_m = ReducedFunctionalNumPy(ReducedFunctional(J, Control(m)))
+    erf_m = EnsembleReducedFunctional(rf_m, ensemble)
+    m0 = rf_m.get_controls()
+    m_arrays = [m0*(1.0 + 0.1*i) for i in range(3*ensemble.members)]
+
+    (js, djs) = erf_m.value_and_gradient(m_arrays)
+    (js_again, djs_again) = erf_m.value_and_gradient(m_arrays)
+    assert numpy.allclose(js, js_again, rtol=1.0e-12)
+    for (dj, dj_again) in zip(djs, djs_again):
+        assert numpy.allclose(dj, dj_again, rtol=1.0e-10, atol=1.0e-14)
+
+    for (m_array, j) in zip(m_arrays, js):
+        assert abs(j - rf_m(m_array)) < 1.0e-12*abs(j)
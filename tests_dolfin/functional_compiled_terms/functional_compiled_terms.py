@@ -0,0 +1,54 @@
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "R", 0)
+f = Constant(1.0)
+
+# Solve the 'PDE' du/dt = 1 over many timesteps,
+# with initial condition u(0) = c
+# this gives the solution u(t) = c + t.
+def run_forward(ic):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = ic.copy(deepcopy=True, name="Value")
+
+    dt = 0.05
+    T = 1.0
+
+    F = ((u - u_0)/dt*v - f*v)*dx
+    a, L = lhs(F), rhs(F)
+
+    t = float(dt)
+    adjointer.time.start(0)
+    while t <= T + 1.0e-12:
+        solve(a == L, u_0)
+        adj_inc_timestep(time=t, finished=t + dt > T + 1.0e-12)
+        t += float(dt)
+
+    return u_0
+
+if __name__ == "__main__":
+    ic = interpolate(Constant(1.0), V)
+    u = run_forward(ic)
+
+    J = Functional(inner(u, u)*dx*dt[0:1] + inner(u, u)*dx*dt[0.225])
+    rf = ReducedFunctional(J, Control(u))
+
+    # The trapezoidal rule for the integral of (1 + t)**2 over [0, 1], and
+    # the point evaluation at t = 0.225, where u is linear in time
+    times = [0.05*i for i in range(21)]
+    expected = sum(0.5*0.05*((1.0 + t0)**2 + (1.0 + t1)**2) for (t0, t1) in zip(times[:-1], times[1:]))
+    expected += 1.225**2
+
+    for i in range(2):
+        value = rf(ic)
+        assert abs(value - expected) < 1.0e-12
+
+    # Each term was compiled once, and reused for every timestep
+    assert len(J._compiled_terms) == 2
+
+    dJdic = compute_gradient(J, Control(u), forget=False)
+    # Work out the derivative by hand -- it's 2*3/2 + 2*1.225
+    assert abs(dJdic.vector().array()[0] - 3.0 - 2.45) < 1.0e-12
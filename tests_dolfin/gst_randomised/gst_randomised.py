@@ -0,0 +1,39 @@
+from __future__ import print_function
+
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(20, 20)
+V = FunctionSpace(mesh, "CG", 1)
+dolfin.parameters["adjoint"]["record_all"] = True
+
+def main(ic, annotate=False):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    mass = inner(u, v)*dx
+    soln = Function(V)
+
+    solve(mass == action(mass, ic), soln, annotate=annotate,
+            solver_parameters={"linear_solver": "cg"})
+    return soln
+
+if __name__ == "__main__":
+
+    ic = project(Expression("x[0]*(x[0]-1)*x[1]*(x[1]-1)", degree=1), V)
+    soln = main(ic, annotate=True)
+
+    parameters["adjoint"]["cache_factorizations"] = True
+
+    # The propagator is the identity, so all singular values are one
+    svd = compute_gst(ic, soln, 3, ic_norm="mass", final_norm="mass", method="randomised",
+                      oversampling=2, power_iterations=0)
+    assert svd.ncv == 3
+
+    for i in range(svd.ncv):
+        (sigma, u, v) = svd.get_gst(i, return_vectors=True)
+        print("Singular value: ", sigma)
+        assert abs(sigma - 1.0) < 1.0e-6
+
+        assert abs(assemble(inner(u, u)*dx) - 1.0) < 1.0e-6
+        assert abs(assemble(inner(v, v)*dx) - 1.0) < 1.0e-6
@@ -0,0 +1,92 @@
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+parameters["adjoint"]["cache_hessian_adjoint"] = True
+
+mesh = UnitIntervalMesh(10)
+V = FunctionSpace(mesh, "CG", 1)
+
+test = TestFunction(V)
+
+def main(m):
+    u = Function(V, name="Solution")
+    F = inner(grad(u), grad(test))*dx + inner(u**3, test)*dx - inner(m, test)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+
+    return u
+
+if __name__ == "__main__":
+    m = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="Parameter")
+    u = main(m)
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    J = Functional(inner(u, u)**2*dx + inner(m, m)*dx)
+    rf = ReducedFunctional(J, Control(m))
+    rf(m)
+
+    # The derivative leaves its adjoint solutions for the Hessian
+    rf.derivative(forget=False)
+    assert len(rf.H.adjoint_cache) > 0
+    assert rf.H.adjoint_key == rf.H.control_key()
+
+    m_dot = interpolate(Expression("x[0]*x[0]", degree=2), V)
+    H_cached = rf.hessian(m_dot)
+
+    # Repeated actions overwrite the tangent linear solutions of the previous action
+    H_again = rf.hessian(m_dot)
+    assert numpy.abs(H_cached.vector().get_local() - H_again.vector().get_local()).max() < 1.0e-12
+
+    # Without the cache the action must agree
+    parameters["adjoint"]["cache_hessian_adjoint"] = False
+    H = rf.hessian(m_dot)
+    assert numpy.abs(H.vector().get_local() - H_cached.vector().get_local()).max() < 1.0e-12
+
+    def fd_hessian(m0, h=1.0e-4):
+        # A central finite difference of the gradient in the direction m_dot
+        dJs = []
+        for sign in [1.0, -1.0]:
+            m1 = Function(V)
+            m1.assign(m0)
+            m1.vector().axpy(sign * h, m_dot.vector())
+            rf(m1)
+            dJs.append(rf.derivative(forget=False)[0].vector().get_local())
+        rf(m0)
+        return (dJs[0] - dJs[1]) / (2.0 * h)
+
+    def assert_close(H, H_fd):
+        err = numpy.abs(H.vector().get_local() - H_fd).max()
+        assert err < 1.0e-5 * numpy.abs(H_fd).max()
+
+    parameters["adjoint"]["cache_hessian_adjoint"] = True
+    assert_close(H_cached, fd_hessian(m))
+
+    # Moving to a new point discards the cached solutions
+    m_new = interpolate(Expression("2*sin(pi*x[0])", degree=1), V)
+    H_fd = fd_hessian(m_new)
+    assert numpy.abs(H_fd - H_cached.vector().get_local()).max() > 1.0e-3 * numpy.abs(H_fd).max()
+    rf(m_new)
+    rf.derivative(forget=False)
+    assert rf.H.adjoint_key == rf.H.control_key()
+    assert_close(rf.hessian(m_dot), H_fd)
+    assert_close(rf.hessian(m_dot), H_fd)
+
+    # Hessian actions at a new point without a derivative there must not use the
+    # adjoint values held by libadjoint from the previous point
+    m_newer = interpolate(Expression("3*sin(pi*x[0])", degree=1), V)
+    H_fd = fd_hessian(m_newer)
+    rf(m_new)
+    rf.derivative(forget=False)
+    rf(m_newer)
+    assert_close(rf.hessian(m_dot), H_fd)
+    assert rf.H.adjoint_key == rf.H.control_key()
+
+    # Copies of adjoint solutions which libadjoint forgets are limited by the budget
+    rf(m_newer)
+    rf.derivative(forget=True)
+    assert 0 < rf.H.adjoint_cache_bytes <= parameters["adjoint"]["hessian_adjoint_cache_size"] * 1024 * 1024
+
+    # Check the Hessian at the new point with a Taylor test
+    assert rf.taylor_test(m_new, test_hessian=True) > 2.9
@@ -0,0 +1,50 @@
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+parameters["adjoint"]["cache_factorizations"] = True
+
+mesh = UnitIntervalMesh(10)
+V = FunctionSpace(mesh, "CG", 1)
+
+test = TestFunction(V)
+trial = TrialFunction(V)
+
+def main(m):
+    u = Function(V, name="Solution")
+    F = inner(grad(u), grad(test))*dx + inner(u**3, test)*dx - inner(m, test)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+
+    return u
+
+if __name__ == "__main__":
+    m = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="Parameter")
+    u = main(m)
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    J = Functional(inner(u, u)**2*dx + inner(m, m)*dx)
+    rf = ReducedFunctional(J, Control(m))
+    rf(m)
+    rf.derivative(forget=False)
+
+    directions = [interpolate(Expression("x[0]", degree=1), V),
+                  interpolate(Expression("x[0]*x[0]", degree=2), V),
+                  interpolate(Constant(1.0), V)]
+
+    # The block of Hessian actions must agree with the individual actions
+    block = rf.hessian_block(directions)
+    assert len(block) == len(directions)
+    for (m_dot, H_block) in zip(directions, block):
+        H = rf.hessian(m_dot)
+        err = numpy.abs(H.vector().get_local() - H_block.vector().get_local()).max()
+        assert err < 1.0e-12
+
+    # The NumPy wrapper accepts the directions as the rows of an array
+    rf_np = ReducedFunctionalNumPy(rf)
+    m_dots = numpy.array([rf_np.obj_to_array(m_dot) for m_dot in directions])
+    H_np = rf_np.hessian(None, m_dots)
+    assert H_np.shape == m_dots.shape
+    for (H_row, H_block) in zip(H_np, block):
+        assert numpy.abs(H_row - rf_np.obj_to_array(H_block)).max() < 1.0e-12
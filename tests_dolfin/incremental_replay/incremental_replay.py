@@ -0,0 +1,43 @@
+from dolfin import *
+from dolfin_adjoint import *
+
+mesh = UnitSquareMesh(4, 4)
+V = FunctionSpace(mesh, "CG", 1)
+
+def main(f, annotate=True):
+    u = TrialFunction(V)
+    v = TestFunction(V)
+
+    u_0 = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="Solution", annotate=annotate)
+    dt = Constant(0.1)
+
+    a = (u*v + dt*inner(grad(u), grad(v)))*dx
+
+    # The first timesteps do not depend on the forcing ...
+    for i in range(4):
+        solve(a == u_0*v*dx, u_0, annotate=annotate)
+
+    # ... which only enters the last one
+    solve(a == (u_0 + dt*f)*v*dx, u_0, annotate=annotate)
+
+    return u_0
+
+if __name__ == "__main__":
+
+    f = interpolate(Constant(1.0), V, name="Forcing")
+    u = main(f)
+
+    replayed = []
+    J = Functional(u*u*dx)
+    Jhat = ReducedFunctional(J, Control(f), replay_cb=lambda var, value, m: replayed.append(var))
+
+    f_new = interpolate(Expression("x[1]", degree=1), V)
+    Jf = Jhat(f_new)
+
+    # Only the forcing and the last solve are replayed
+    assert len(replayed) == 2
+
+    u = main(f_new, annotate=False)
+    assert abs(Jf - assemble(u*u*dx)) < 1.0e-12
+
+    assert Jhat.taylor_test(f) > 1.9
@@ -0,0 +1,56 @@
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+mesh = UnitIntervalMesh(40)
+V = FunctionSpace(mesh, "CG", 1)
+
+test = TestFunction(V)
+trial = TrialFunction(V)
+
+def main(m):
+    u = Function(V, name="Solution")
+    a = inner(grad(trial), grad(test))*dx + inner(trial, test)*dx
+    L = inner(m, test)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(a == L, u, bc)
+
+    return u
+
+if __name__ == "__main__":
+    m = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="Parameter")
+    u = main(m)
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    # The misfit of a smoothing operator has a rapidly decaying spectrum
+    J = Functional(0.5*inner(u, u)*dx)
+    rf = ReducedFunctional(J, Control(m))
+    rf(m)
+    rf.derivative(forget=False)
+
+    H = low_rank_hessian(rf, 4, oversampling=6, power_iterations=2)
+    assert H.ncv == 4
+    assert (numpy.diff(H.s) <= 0.0).all()
+
+    # The leading eigenpairs satisfy H u = s M u
+    for i in range(2):
+        u_i = H.U[i]
+        assert abs(assemble(inner(u_i, u_i)*dx) - 1.0) < 1.0e-10
+
+        Hu = rf.hessian(u_i, project=True)
+        res = Hu.vector() - H.s[i]*u_i.vector()
+        assert res.norm("l2") < 1.0e-6*Hu.vector().norm("l2")
+
+    # The inverse of I + H is exact on the range of the approximation
+    x = interpolate(Expression("x[0]*(1 - x[0])", degree=2), V)
+    y = H.apply(x)
+    y.vector().axpy(1.0, x.vector())
+    z = H.apply_inverse(y)
+    assert (z.vector() - x.vector()).norm("linf") < 1.0e-10
+
+    # The factorisation can be stored and reloaded
+    H.save("low_rank_hessian.npz")
+    H_loaded = LowRankFactorisation.load("low_rank_hessian.npz", V)
+    assert numpy.allclose(H_loaded.s, H.s)
+    assert (H_loaded.apply(x).vector() - H.apply(x).vector()).norm("linf") < 1.0e-12
@@ -0,0 +1,67 @@
+from dolfin import *
+from dolfin_adjoint import *
+try:
+    import moola
+except ImportError:
+    import sys
+    info_blue("moola bindings unavailable, skipping test")
+    sys.exit(0)
+import numpy
+
+dolfin.set_log_level(ERROR)
+
+def solve_pde(u, V, m):
+    v = TestFunction(V)
+    F = (inner(grad(u), grad(v)) + inner(u**3, v) - m*v)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+
+if __name__ == "__main__":
+    mesh = UnitSquareMesh(16, 16)
+    V = FunctionSpace(mesh, "CG", 1)
+    u = Function(V, name='State')
+    m = Function(V, name='Control')
+
+    solve_pde(u, V, m)
+    J = Functional(inner(u, u)*dx*dt[FINISH_TIME])
+    rf = ReducedFunctional(J, Control(m, value=m))
+
+    problem = MoolaOptimizationProblem(rf, memoize=2)
+    functional = problem.obj
+
+    x1 = moola.DolfinPrimalVector(interpolate(Constant(1.0), V))
+    x2 = moola.DolfinPrimalVector(interpolate(Constant(2.0), V))
+
+    j1 = functional(x1)
+
+    # A direct evaluation of rf, or another problem sharing it, moves the tape
+    # to x2 without this problem's knowledge. The derivative at x1 must still
+    # be evaluated at x1
+    rf(x2.data)
+    d1 = functional.derivative(x1)
+    rf(x1.data)
+    d1_ref = rf.derivative(forget=False)[0]
+    assert numpy.abs(d1.data.vector().get_local() - d1_ref.vector().get_local()).max() < 1.0e-12
+
+    # The same after an evaluation of this problem at x2
+    j2 = functional(x2)
+    functional.derivs.clear()
+    d1 = functional.derivative(x1)
+    rf(x1.data)
+    d1_ref = rf.derivative(forget=False)[0]
+    assert numpy.abs(d1.data.vector().get_local() - d1_ref.vector().get_local()).max() < 1.0e-12
+
+    # Revisited points are served from the memo
+    assert functional(x1) == j1
+    assert functional.derivative(x1) is d1
+
+    # Equal control values give equal keys, whatever the object
+    x1_copy = moola.DolfinPrimalVector(interpolate(Constant(1.0), V))
+    assert functional(x1_copy) == j1
+
+    # Memos are per problem, and evict the least recently used point
+    other = MoolaOptimizationProblem(rf, memoize=2).obj
+    assert len(other.evals) == 0
+    x3 = moola.DolfinPrimalVector(interpolate(Constant(3.0), V))
+    functional(x3)
+    assert len(functional.evals) == 2
@@ -0,0 +1,63 @@
+""" Solves a MMS problem with a Function and a Constant control """
+from __future__ import print_function
+from dolfin import *
+from dolfin_adjoint import *
+try:
+    from petsc4py import PETSc
+    PETSc.TAO
+except Exception:
+    import sys
+    info_blue("PETSc bindings with TAO support unavailable, skipping test")
+    sys.exit(0)
+
+dolfin.set_log_level(ERROR)
+parameters['std_out_all_processes'] = False
+
+def solve_pde(u, V, m, c):
+    v = TestFunction(V)
+    F = (inner(grad(u), grad(v)) - (m + c)*v)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+
+if __name__ == "__main__":
+
+    n = 32
+    mesh = UnitSquareMesh(n, n)
+    V = FunctionSpace(mesh, "CG", 1)
+    u = Function(V, name='State')
+    W = FunctionSpace(mesh, "DG", 0)
+    m = Function(W, name='Control')
+    c = Constant(0.5)
+
+    x = SpatialCoordinate(mesh)
+
+    u_d = 1/(2*pi**2)*sin(pi*x[0])*sin(pi*x[1])
+
+    # The Constant is driven to 1 by its own term, the Function makes up the rest
+    J = Functional((inner(u-u_d, u-u_d))*dx*dt[FINISH_TIME] + 1e-6*(c - 1)**2*dx*dt[FINISH_TIME])
+
+    # Run the forward model once to create the annotation
+    solve_pde(u, V, m, c)
+
+    # Run the optimisation over both controls at once
+    rf = ReducedFunctional(J, [FunctionControl(m, value=m), Control(c)])
+    problem = MinimizationProblem(rf)
+    parameters = { 'method': 'lmvm',
+                   'max_it': 200,
+                   'fatol' : 0.0,
+                   'frtol' : 0.0,
+                   'gatol' : 1e-10,
+                   'grtol' : 0.0
+                 }
+
+    solver = TAOSolver(problem, parameters=parameters)
+    (m_opt, c_opt) = solver.solve()
+
+    # TAO works on a copy of the value of the Function control
+    assert m_opt is not m
+
+    solve_pde(u, V, m_opt, c_opt)
+    assert assemble(inner(u-u_d, u-u_d)*dx) < 1e-8
+
+    tao_p = solver.get_tao()
+    assert tao_p.getIterationNumber() <= 200
@@ -0,0 +1,44 @@
+from dolfin import *
+from dolfin_adjoint import *
+import numpy as np
+np.random.seed(seed=21)
+
+
+# Define mesh
+mesh = UnitSquareMesh(10, 10)
+U    = FunctionSpace(mesh, "CG", 2)
+
+adj_start_timestep()
+
+def forward(c):
+    u  = Function(U)
+    u0 = Function(U)
+    v  = TestFunction(U)
+    F  = inner(u - u0 - c*Expression("x[0]*x[1]", degree=2), v)*dx
+    for t in range(1, 5):
+        solve(F == 0, u)
+        u0.assign(u)
+        adj_inc_timestep(t, t == 4)
+    return u0
+
+c = Constant(3.)
+u = forward(c)
+
+# Many observations, including points on cell boundaries shared between processes
+coords = [Point(np.array(x)) for x in np.random.rand(500, 2)] + [Point(np.array([0.5, 0.5]))]
+refs = [list(np.random.rand(4)) for p in coords]
+
+mJ = PointwiseFunctional(u, refs, coords, [1, 2, 3, 4], u_ind=[None]*len(coords))
+mJr = ReducedFunctional(mJ, Control(c))
+
+mJr3 = mJr(Constant(3))
+
+# The observations agree with pointwise evaluation; the state at time t is t*c*x*y
+expected = 0.0
+for (p, ref) in zip(coords, refs):
+    for t in range(1, 5):
+        expected += (3.0*t*p[0]*p[1] - ref[t - 1])**2
+assert abs(mJr3 - expected) < 1e-8*expected, abs(mJr3 - expected)
+
+assert mJr.taylor_test(Constant(5), seed=1e-2) > 1.9
+info_green("Test passed")
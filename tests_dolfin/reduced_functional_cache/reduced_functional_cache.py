@@ -1,5 +1,7 @@
 from dolfin import *
 from dolfin_adjoint import *
+from dolfin_adjoint import memo_store
+from dolfin_adjoint.reduced_functional import value_hash
 import os
 import os.path
 
@@ -40,7 +42,7 @@ def main(ic, annotate=False):
     return u_
 
 if __name__ == "__main__":
-    cache_file = "cache.pck"
+    cache_file = "cache.dat"
 
     try:
         os.remove(cache_file)
@@ -68,6 +70,7 @@ if __name__ == "__main__":
 
     assert a == b
     assert time_a/time_b > 50 # Check that speed-up is significant
+    J_value = a
 
     # Now let's test the caching of the functional gradient
     t = dolfin.Timer("")
@@ -89,4 +92,24 @@ if __name__ == "__main__":
     del rf
     assert os.path.isfile(cache_file)
 
+    # Check that a new run reuses the stored evaluations
+    memo_store._stores.clear()
+    rf = ReducedFunctional(J, [m1, m2], cache=cache_file)
+    assert rf([interpolate(Constant(2), V), Constant(4)]) == J_value
+
+    # Check that permuted control values, which have the same norms, are told apart
+    f = interpolate(Expression("x[0]", degree=1), V)
+    g = Function(V)
+    g.vector().set_local(f.vector().get_local()[::-1].copy())
+    g.vector().apply("insert")
+    assert value_hash(f) != value_hash(g)
+
+    # Check that the store is bounded by size as well as by the number of entries
+    store = memo_store.open_store(cache_file)
+    store.max_bytes = lambda: 1
+    store.put("functional", value_hash(f), [f.vector().get_local()])
+    assert len(store) == 1
+    assert store.get("functional", value_hash(f)) is not None
+    assert os.path.getsize(cache_file) <= 2 * store.live
+
     info_green("Test passed")
@@ -0,0 +1,66 @@
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint.reduced_functional_numpy import DistributedArray
+import numpy
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+test = TestFunction(V)
+
+def main(m, nu):
+    u = Function(V, name="Solution")
+    F = inner(nu*grad(u), grad(test))*dx + inner(u**3, test)*dx - inner(m, test)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+
+    return u
+
+if __name__ == "__main__":
+    m = interpolate(Expression("sin(pi*x[0])*x[1]", degree=2), V, name="Parameter")
+    nu = Constant(1.0)
+    u = main(m, nu)
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    J = Functional(inner(u, u)*dx + inner(m, m)*dx)
+    rf = ReducedFunctional(J, [Control(m), Control(nu)])
+
+    rf_global = ReducedFunctionalNumPy(rf)
+    rf_owned = ReducedFunctionalNumPy(rf, distributed=True)
+
+    # Each process only holds the values it owns; the Constant lives on process 0
+    x_global = rf_global.get_controls()
+    x_owned = rf_owned.get_controls()
+    assert isinstance(x_owned, DistributedArray)
+    assert x_owned.global_size() == len(x_global)
+
+    # A single Function is viewed, not copied
+    view = rf_owned.obj_to_array(m)
+    assert numpy.may_share_memory(view, as_backend_type(m.vector()).vec().array)
+
+    # Reductions are performed over all processes
+    assert abs(numpy.dot(x_owned, x_owned) - numpy.dot(x_global, x_global)) < 1.0e-10
+    assert abs(numpy.linalg.norm(x_owned) - numpy.linalg.norm(x_global)) < 1.0e-10
+    assert abs(x_owned.max() - x_global.max()) < 1.0e-12
+    assert abs(x_owned.sum() - x_global.sum()) < 1.0e-10
+
+    # Both modes compute the same functional and gradient
+    j_global = rf_global(2*x_global)
+    j_owned = rf_owned(2*x_owned)
+    assert abs(j_global - j_owned) < 1.0e-12
+
+    dj_global = rf_global.derivative(forget=False)
+    dj_owned = rf_owned.derivative(forget=False)
+    assert abs(numpy.linalg.norm(dj_owned) - numpy.linalg.norm(dj_global)) < 1.0e-10
+    assert abs(dj_owned.dot(x_owned) - numpy.dot(dj_global, x_global)) < 1.0e-10
+
+    # minimize passes the owned values to NumPy based custom algorithms
+    def steepest_descent(J, x, dJ, H, bounds, iterations=5, step=1.0):
+        for i in range(iterations):
+            x = x - step*dJ(x)
+        return x
+
+    j_init = rf_global(x_global)
+    m_opt = minimize(rf, method="Custom", algorithm=steepest_descent, distributed=True)
+    assert rf_global(rf_global.obj_to_array(m_opt)) < j_init
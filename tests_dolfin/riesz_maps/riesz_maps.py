@@ -0,0 +1,53 @@
+from dolfin import *
+from dolfin_adjoint import *
+import numpy
+
+mesh = UnitSquareMesh(8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+if __name__ == "__main__":
+    x = interpolate(Expression("sin(pi*x[0])*x[1]", degree=2), V)
+    y = interpolate(Expression("x[0]*x[0]", degree=2), V)
+
+    for riesz_map in [L2(V), H1(V, alpha=Constant(0.1)), H1(V, solver="amg")]:
+        # The Gram matrix is assembled once, and its solver set up once
+        A = riesz_map.assemble()
+        assert A is riesz_map.assemble()
+        assert riesz_map.solver() is riesz_map.solver()
+
+        # apply_inverse undoes apply, for single and batched right-hand sides
+        for (z, zz) in zip([x, y], riesz_map.apply_inverse(riesz_map.apply([x, y]))):
+            assert numpy.abs(z.vector().get_local() - zz.vector().get_local()).max() < 1.0e-8
+
+    # Maps on distinct spaces, or with distinct inner products, have their own matrices
+    assert L2(V).assemble() is not L2(FunctionSpace(mesh, "DG", 0)).assemble()
+    assert H1(V, alpha=Constant(0.1)).assemble() is not H1(V).assemble()
+
+    # The L2 gradient representer of a derivative uses the factorised mass matrix
+    m = Function(V, name="Control")
+    u = project(m, V, annotate=True)
+    J = Functional(inner(u, u)*dx + inner(u, x)*dx)
+    dJ = compute_gradient(J, Control(m), forget=False, project=True)
+    expected = L2(V).apply_inverse(compute_gradient(J, Control(m), forget=False))
+    assert numpy.abs(dJ.vector().get_local() - expected.vector().get_local()).max() < 1.0e-12
+
+    # The H^1_0 map applies homogeneous Dirichlet boundary conditions, so its
+    # stiffness matrix can be factorised
+    z = interpolate(Expression("sin(pi*x[0])*sin(pi*x[1])", degree=2), V)
+    zz = H10(V).apply_inverse(H10(V).apply(z))
+    assert numpy.abs(z.vector().get_local() - zz.vector().get_local()).max() < 1.0e-8
+
+    # The Gram matrix is reassembled after mesh motion, once the map is invalidated
+    mesh2 = UnitSquareMesh(8, 8)
+    V2 = FunctionSpace(mesh2, "CG", 1)
+    riesz_map = L2(V2)
+    one = interpolate(Constant(1.0), V2)
+    assert abs(riesz_map.apply(one).inner(one.vector()) - 1.0) < 1.0e-12
+    A = riesz_map.assemble()
+    mesh2.coordinates()[:] *= 2.0
+    assert riesz_map.assemble() is A
+    riesz_map.invalidate()
+    assert riesz_map.assemble() is not A
+    assert abs(riesz_map.apply(one).inner(one.vector()) - 4.0) < 1.0e-12
+    z = riesz_map.apply_inverse(riesz_map.apply(one))
+    assert numpy.abs(z.vector().get_local() - 1.0).max() < 1.0e-8
@@ -0,0 +1,41 @@
+from dolfin import *
+from dolfin_adjoint import *
+import sys
+
+# One process per ensemble member, so the perturbed evaluations of the Taylor
+# test are shared between the processes
+ensemble = Ensemble(M=1)
+
+mesh = UnitSquareMesh(ensemble.comm, 8, 8)
+V = FunctionSpace(mesh, "CG", 1)
+
+test = TestFunction(V)
+
+def main(m, nu):
+    u = Function(V, name="Solution")
+    F = inner(nu*grad(u), grad(test))*dx + inner(u**3, test)*dx - inner(m, test)*dx
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    solve(F == 0, u, bc)
+
+    return u
+
+if __name__ == "__main__":
+    m = interpolate(Expression("sin(pi*x[0])*x[1]", degree=2), V, name="Parameter")
+    nu = Constant(1.0)
+    u = main(m, nu)
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    J = Functional(inner(u, u)*dx + inner(m, m)*dx)
+    rf = ReducedFunctional(J, [Control(m), Control(nu)])
+
+    calls = []
+    rf.eval_cb_pre = lambda m: calls.append(m)
+
+    minconv = rf.taylor_test(ensemble=ensemble, size=4)
+    if minconv < 1.9:
+        sys.exit(1)
+
+    # Each member evaluated its share of the four perturbations of each control,
+    # on top of the evaluation at the base point
+    assert len(calls) == 1 + 2*len(range(ensemble.member, 4, ensemble.members))
@@ -0,0 +1,68 @@
+from dolfin import *
+from dolfin_adjoint import *
+from dolfin_adjoint.adjglobals import adjointer, adj_variables
+import numpy
+
+mesh = UnitIntervalMesh(20)
+V = FunctionSpace(mesh, "CG", 1)
+
+test = TestFunction(V)
+
+def main(m):
+    u = Function(V, name="Solution")
+    u_old = Function(V, name="OldSolution")
+    bc = DirichletBC(V, 0.0, "on_boundary")
+    for i in range(5):
+        F = inner(u - u_old, test)*dx + 0.1*inner(grad(u), grad(test))*dx + 0.1*inner(u**3, test)*dx - 0.1*inner(m, test)*dx
+        solve(F == 0, u, bc)
+        u_old.assign(u)
+        adj_inc_timestep()
+
+    return u
+
+if __name__ == "__main__":
+    m = interpolate(Expression("sin(pi*x[0])", degree=1), V, name="Parameter")
+    u = main(m)
+
+    parameters["adjoint"]["stop_annotating"] = True
+
+    J = Functional(inner(u, u)*dx*dt[FINISH_TIME] + inner(m, m)*dx*dt[START_TIME])
+    rf = ReducedFunctional(J, Control(m))
+
+    m_new = interpolate(Expression("2*sin(pi*x[0])", degree=1), V)
+    j_ref = rf(m_new)
+    dj_ref = rf.derivative(forget=False)[0]
+
+    # The fused evaluation agrees with the separate calls, and forgets the forward state
+    (j, dj) = rf.value_and_gradient(m_new)
+    assert abs(j - j_ref) < 1.0e-12
+    assert numpy.abs(dj[0].vector().get_local() - dj_ref.vector().get_local()).max() < 1.0e-12
+    assert not adjointer.variable_known(adj_variables[u])
+
+    # The controls are still available, and the next evaluation replays the whole tape
+    assert numpy.abs(rf.controls[0].data().vector().get_local() - m_new.vector().get_local()).max() < 1.0e-12
+    (j, dj) = rf.value_and_gradient(m)
+    assert abs(j - rf(m)) < 1.0e-12
+
+    # The same through the NumPy interface
+    rf_np = ReducedFunctionalNumPy(rf)
+    x = rf_np.obj_to_array(m_new)
+    (j, dj) = rf_np.value_and_gradient(x)
+    assert abs(j - j_ref) < 1.0e-12
+    assert numpy.abs(dj - rf_np.obj_to_array(dj_ref)).max() < 1.0e-12
+
+    # The controls remain available to later NumPy evaluations
+    assert numpy.abs(rf_np.get_global([p.data() for p in rf_np.controls]) - x).max() < 1.0e-12
+    y = rf_np.obj_to_array(m)
+    (j, dj) = rf_np.value_and_gradient(y)
+    assert abs(j - rf_np(y)) < 1.0e-12
+    (j, dj) = rf_np.value_and_gradient(x)
+    assert abs(j - j_ref) < 1.0e-12
+
+    # Optimisers using the fused evaluation forget the forward state, and still
+    # converge to the same minimiser
+    dj_init = numpy.linalg.norm(rf_np.obj_to_array(dj_ref))
+    m_opt = minimize(rf, method="L-BFGS-B", tol=1.0e-10, options={"maxiter": 50})
+    assert not adjointer.variable_known(adj_variables[u])
+    (j_opt, dj_opt) = rf_np.value_and_gradient(rf_np.obj_to_array(m_opt))
+    assert numpy.linalg.norm(dj_opt) < 1.0e-3*dj_init
@@ -26,6 +26,7 @@ from . import embedded_cpp
 from . import exceptions
 from . import fenics_overrides
 from . import fenics_utils
+from . import numpy_kernels
 from . import pre_assembled_adjoint
 from . import pre_assembled_equations
 from . import pre_assembled_forms
@@ -43,6 +44,7 @@ from .embedded_cpp import *
 from .exceptions import *
 from .fenics_overrides import *
 from .fenics_utils import *
+from .numpy_kernels import *
 from .pre_assembled_adjoint import *
 from .pre_assembled_equations import *
 from .pre_assembled_forms import *
@@ -74,6 +76,7 @@ __all__ = \
   fenics_overrides.__all__ + \
   fenics_patches.__all__ + \
   fenics_utils.__all__ + \
+  numpy_kernels.__all__ + \
   parameters.__all__ + \
   pre_assembled_adjoint.__all__ + \
   pre_assembled_equations.__all__ + \
@@ -92,6 +95,7 @@ __all__ = \
     "exceptions",
     "fenics_overrides",
     "fenics_utils",
+    "numpy_kernels",
     "pre_assembled_adjoint",
     "pre_assembled_equations",
     "pre_assembled_forms",
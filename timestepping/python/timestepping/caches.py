@@ -17,7 +17,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import OrderedDict
-import copy
+import threading
 
 import dolfin
 import ufl
@@ -34,7 +34,8 @@ __all__ = \
     "assembly_cache",
     "linear_solver_cache",
     "cache_info",
-    "clear_caches"
+    "clear_caches",
+    "storage_bytes"
   ]
 
 def cache_info(msg, info = dolfin.info):
@@ -91,20 +92,156 @@ def parameters_key(parameters):
             fparameters.append((key, parameters[key]))
     return tuple(fparameters)
 
-class AssemblyCache(object):
+def storage_bytes(tensor):
+    """
+    Return an estimate of the memory used by an assembled tensor, in bytes.
+    """
+
+    if isinstance(tensor, dolfin.GenericMatrix):
+        # Values and column indices
+        return tensor.nnz() * 12
+    elif isinstance(tensor, dolfin.GenericVector):
+        return tensor.local_size() * 8
+    else:
+        return 0
+
+def form_dependencies(form):
+    """
+    Return the counts of the Constant s and Function s upon which a Form depends.
+    """
+
+    if isinstance(form, ufl.form.Form):
+        return tuple(c.count() for c in ufl.algorithms.extract_coefficients(form))
+    else:
+        return tuple()
+
+class _LRUCache(object):
+    """
+    Storage for AssemblyCache and SolverCache. Entries are kept in least recently
+    used order, together with an estimate of their size in bytes and the counts
+    of the Constant s and Function s upon which they depend. A reverse index maps
+    each dependency to the keys of the entries which depend upon it, so that
+    clearing the entries associated with a dependency only visits the affected
+    entries. Once the entries exceed the budget returned by max_bytes (in bytes,
+    with zero indicating an unbounded cache) the least recently used entries are
+    evicted. Eviction only removes the reference held by the cache, and so the
+    budget only bounds memory usage if the caller keeps no other reference to the
+    evicted entries. Access to the entries is serialised, so that a cache can be
+    shared by solves performed concurrently.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._entries = OrderedDict()
+        self._index = {}
+        self._nbytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+        return
+
+    def max_bytes(self):
+        return 0
+
+    def _get(self, key):
+        with self._lock:
+            if key in self._entries:
+                # Mark the entry as the most recently used
+                entry = self._entries.pop(key)
+                self._entries[key] = entry
+                self._hits += 1
+                return entry[0]
+            else:
+                self._misses += 1
+                return None
+
+    def _set(self, key, value, nbytes, deps):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (value, nbytes, deps)
+            self._nbytes += nbytes
+            for dep in deps:
+                if not dep in self._index:
+                    self._index[dep] = set()
+                self._index[dep].add(key)
+
+            max_bytes = self.max_bytes()
+            while max_bytes > 0 and self._nbytes > max_bytes and len(self._entries) > 1:
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+        return
+
+    def _remove(self, key):
+        value, nbytes, deps = self._entries.pop(key)
+        self._nbytes -= nbytes
+        for dep in deps:
+            keys = self._index[dep]
+            keys.discard(key)
+            if len(keys) == 0:
+                del(self._index[dep])
+
+        return
+
+    def _clear(self, *args):
+        if len(args) == 0:
+            with self._lock:
+                self._entries = OrderedDict()
+                self._index = {}
+                self._nbytes = 0
+        else:
+            for dep in args:
+                if not isinstance(dep, (dolfin.Constant, dolfin.Function)):
+                    raise InvalidArgumentException("Arguments must be Constant s or Function s")
+
+            with self._lock:
+                for dep in args:
+                    for key in list(self._index.get(dep.count(), [])):
+                        self._remove(key)
+
+        return
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """
+        Return a dictionary of cache statistics: the number of entries, their
+        estimated size in bytes, the number of cache hits and misses, and the
+        number of entries evicted to keep within the budget.
+        """
+
+        return {"entries":len(self._entries), "bytes":self._nbytes,
+                "hits":self._hits, "misses":self._misses,
+                "evictions":self._evictions}
+
+class AssemblyCache(_LRUCache):
     """
     A cache of assembled Form s. The assemble method can be used to assemble a
     given Form. If an assembled version of the Form exists in the cache, then the
     cached result is returned. Note that this does not check that the Form
     dependencies are unchanged between subsequent assemble calls -- that is
     deemed the responsibility of the caller.
+
+    Once the assembled Form s exceed the
+    parameters["timestepping"]["pre_assembly"]["assembly_cache_size"] budget (in
+    megabytes, with zero indicating an unbounded cache) the least recently used
+    are evicted. The budget is unbounded by default. PAEquationSolver s and
+    PAForm s keep references to the matrices which they use, and so an evicted
+    matrix is only freed once the solvers and forms using it are also freed.
     """
 
     def __init__(self):
-        self.__cache = {}
+        _LRUCache.__init__(self)
 
         return
 
+    def max_bytes(self):
+        return dolfin.parameters["timestepping"]["pre_assembly"]["assembly_cache_size"] * 1024 * 1024
+
     def assemble(self, form, form_compiler_parameters = {}, bcs = [],
       symmetric_bcs = False):
         """
@@ -135,9 +272,11 @@ class AssemblyCache(object):
         rank = form_rank(form)
         if len(bcs) == 0:
             key = (form_key(form), parameters_key(form_compiler_parameters), bc_key(bcs, symmetric_bcs))
-            if not key in self.__cache:
+            tensor = self._get(key)
+            if tensor is None:
                 cache_info("Assembling form with rank %i" % rank, dolfin.info_red)
-                self.__cache[key] = assemble(form, form_compiler_parameters = form_compiler_parameters)
+                tensor = assemble(form, form_compiler_parameters = form_compiler_parameters)
+                self._set(key, tensor, storage_bytes(tensor), form_dependencies(form))
             else:
                 cache_info("Using cached assembled form with rank %i" % rank, dolfin.info_green)
         else:
@@ -145,15 +284,16 @@ class AssemblyCache(object):
                 raise InvalidArgumentException("form must be rank 2 when applying boundary conditions")
 
             key = (form_key(form), parameters_key(form_compiler_parameters), bc_key(bcs, symmetric_bcs))
-            if not key in self.__cache:
+            tensor = self._get(key)
+            if tensor is None:
                 cache_info("Assembling form with rank 2, with boundary conditions", dolfin.info_red)
-                mat = assemble(form, form_compiler_parameters = form_compiler_parameters)
-                apply_bcs(mat, bcs, symmetric_bcs = symmetric_bcs)
-                self.__cache[key] = mat
+                tensor = assemble(form, form_compiler_parameters = form_compiler_parameters)
+                apply_bcs(tensor, bcs, symmetric_bcs = symmetric_bcs)
+                self._set(key, tensor, storage_bytes(tensor), form_dependencies(form))
             else:
                 cache_info("Using cached assembled form with rank 2, with boundary conditions", dolfin.info_green)
 
-        return self.__cache[key]
+        return tensor
 
     def info(self):
         """
@@ -161,12 +301,15 @@ class AssemblyCache(object):
         """
 
         counts = [0, 0, 0]
-        for key in self.__cache.keys():
+        for key in self._entries.keys():
             counts[form_rank(key[0])] += 1
+        stats = self.stats()
 
         dolfin.info("Assembly cache status:")
         for i in range(3):
             dolfin.info("Pre-assembled rank %i forms: %i" % (i, counts[i]))
+        dolfin.info("Estimated size: %.1f MB" % (stats["bytes"] / (1024.0 * 1024.0)))
+        dolfin.info("Hits: %i, misses: %i, evictions: %i" % (stats["hits"], stats["misses"], stats["evictions"]))
 
         return
 
@@ -176,38 +319,35 @@ class AssemblyCache(object):
         Form s which depend upon the supplied Constant s or Function s.
         """
 
-        if len(args) == 0:
-            self.__cache = {}
-        else:
-            for dep in args:
-                if not isinstance(dep, (dolfin.Constant, dolfin.Function)):
-                    raise InvalidArgumentException("Arguments must be Constant s or Function s")
-
-            for dep in args:
-                for key in copy.copy(list(self.__cache.keys())):
-                    form = key[0]
-                    if dep in ufl.algorithms.extract_coefficients(form):
-                        del(self.__cache[key])
+        self._clear(*args)
 
         return
 
-class SolverCache(object):
+class SolverCache(_LRUCache):
     """
     A cache of LUSolver s and KrylovSolver s. The linear_solver method can be used
     to return an LUSolver or KrylovSolver suitable for solving an equation with
     the supplied rank 2 Form defining the LHS matrix.
+
+    Once the linear solvers exceed the
+    parameters["timestepping"]["pre_assembly"]["linear_solver_cache_size"] budget
+    (in megabytes, with zero indicating an unbounded cache) the least recently
+    used are evicted. dolfin does not report the size of a factorisation, and so
+    the size of a linear solver is estimated by the size of its matrix, when this
+    is supplied via the a argument of linear_solver. Other linear solvers do not
+    count towards the budget. The budget is unbounded by default. PAEquationSolver
+    s keep references to the linear solvers which they use, and so an evicted
+    linear solver is only freed once the equation solvers using it are also
+    freed.
     """
 
     def __init__(self):
-        self.__cache = OrderedDict()
+        _LRUCache.__init__(self)
 
         return
 
-    def __del__(self):
-        for key in self.__cache:
-            del(self.__cache[key])
-
-        return
+    def max_bytes(self):
+        return dolfin.parameters["timestepping"]["pre_assembly"]["linear_solver_cache_size"] * 1024 * 1024
 
     def linear_solver(self, form, linear_solver_parameters,
       pre_assembly_parameters = None,
@@ -319,6 +459,8 @@ class SolverCache(object):
                    None if pre_assembly_parameters is None else parameters_key(pre_assembly_parameters),
                    bc_key(bcs, symmetric_bcs),
                    None)
+            nbytes = 0
+            deps = form_dependencies(form) if static else tuple()
         else:
             if not isinstance(a, dolfin.GenericMatrix):
                 raise InvalidArgumentException("a must be a GenericMatrix")
@@ -337,19 +479,37 @@ class SolverCache(object):
                    None,
                    bc_key(bcs, symmetric_bcs),
                    a.id())
+            nbytes = storage_bytes(a)
+            deps = form_dependencies(form)
 
-        if not key in self.__cache:
+        linear_solver = self._get(key)
+        if linear_solver is None:
             if static:
                 cache_info("Creating new static linear solver", dolfin.info_red)
             else:
                 cache_info("Creating new non-static linear solver", dolfin.info_red)
-            self.__cache[key] = LinearSolver(linear_solver_parameters)
+            linear_solver = LinearSolver(linear_solver_parameters)
+            self._set(key, linear_solver, nbytes, deps)
         else:
             if static:
                 cache_info("Using cached static linear solver", dolfin.info_green)
             else:
                 cache_info("Using cached non-static linear solver", dolfin.info_green)
-        return self.__cache[key]
+        return linear_solver
+
+    def info(self):
+        """
+        Print some cache status information.
+        """
+
+        stats = self.stats()
+
+        dolfin.info("Linear solver cache status:")
+        dolfin.info("Linear solvers: %i" % stats["entries"])
+        dolfin.info("Estimated size: %.1f MB" % (stats["bytes"] / (1024.0 * 1024.0)))
+        dolfin.info("Hits: %i, misses: %i, evictions: %i" % (stats["hits"], stats["misses"], stats["evictions"]))
+
+        return
 
     def clear(self, *args):
         """
@@ -358,18 +518,7 @@ class SolverCache(object):
         Function s.
         """
 
-        if len(args) == 0:
-            for key in self.__cache.keys():
-                del(self.__cache[key])
-        else:
-            for dep in args:
-                if not isinstance(dep, (dolfin.Constant, dolfin.Function)):
-                    raise InvalidArgumentException("Arguments must be Constant s or Function s")
-
-            for key in self.__cache:
-                form = key[0]
-                if isinstance(form, ufl.form.Form) and dep in ufl.algorithms.extract_coefficients(form):
-                    del(self.__cache[key])
+        self._clear(*args)
 
         return
 
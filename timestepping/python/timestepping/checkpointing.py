@@ -17,11 +17,14 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 from collections import OrderedDict
-import six.moves.cPickle as pickle
 import copy
 import os
+import six.moves.queue as queue
+import tempfile
+import threading
 
 import dolfin
+import numpy
 
 from .exceptions import *
 
@@ -29,9 +32,56 @@ __all__ = \
   [
     "Checkpointer",
     "DiskCheckpointer",
-    "MemoryCheckpointer"
+    "MemoryCheckpointer",
+    "binomial_advance"
   ]
 
+def binomial(n, k):
+    """
+    Return the binomial coefficient n choose k.
+    """
+
+    k = min(k, n - k)
+    if k < 0:
+        return 0
+    b = 1
+    for i in range(1, k + 1):
+        b = (b * (n - k + i)) // i
+
+    return b
+
+def binomial_advance(steps, snapshots):
+    """
+    Return the number of timesteps by which the forward model should be advanced
+    before the next snapshot is stored, when the states at the end of the
+    following steps timesteps are to be recovered in reverse order using at most
+    snapshots stored states (including the current state). This is the optimal
+    binomial checkpointing schedule of Griewank and Walther (ACM TOMS 26, 2000,
+    pp. 19-45): with s snapshots and at most t recomputations of any single
+    timestep, at most binomial(s + t, s) timesteps can be reversed.
+
+    Arguments:
+      steps: The number of timesteps to be reversed. This must be >= 1.
+      snapshots: The number of available snapshots, including the current
+        state. This must be >= 1.
+    """
+
+    if not isinstance(steps, int) or steps < 1:
+        raise InvalidArgumentException("steps must be a positive integer")
+    if not isinstance(snapshots, int) or snapshots < 1:
+        raise InvalidArgumentException("snapshots must be a positive integer")
+
+    if steps == 1 or snapshots == 1:
+        return steps
+
+    t = 0
+    while binomial(snapshots + t, snapshots) < steps:
+        t += 1
+
+    # Any advance in [steps - beta(snapshots - 1, t), beta(snapshots, t - 1)] is
+    # optimal. Choose the smallest.
+    return max(1, steps - binomial(snapshots - 1 + t, snapshots - 1))
+
 class Checkpointer(object):
     """
     A template for Constant and Function storage.
@@ -239,18 +289,112 @@ class MemoryCheckpointer(Checkpointer):
 
         return
 
+class BackgroundWriter(object):
+    """
+    Performs writes in a background thread, so that they overlap with subsequent
+    computation. Writes are performed in the order in which they are submitted.
+
+    Constructor arguments:
+      depth: The maximum number of queued writes. submit blocks while the queue
+        is full.
+    """
+
+    def __init__(self, depth = 4):
+        if not isinstance(depth, int) or depth <= 0:
+            raise InvalidArgumentException("depth must be a positive integer")
+
+        self.__queue = queue.Queue(maxsize = depth)
+        self.__pending = {}
+        self.__error = None
+        self.__thread = None
+
+        return
+
+    def __run(self):
+        while True:
+            write, event = self.__queue.get()
+            try:
+                write()
+            except Exception as e:
+                self.__error = e
+            event.set()
+            # Do not hold a reference to the write while idle
+            write = None
+            self.__queue.task_done()
+
+        return
+
+    def __check(self):
+        if not self.__error is None:
+            e = self.__error
+            self.__error = None
+            raise CheckpointException("Background write failed: %s" % str(e))
+
+        return
+
+    def submit(self, key, write):
+        """
+        Queue the callable write, performing a write associated with the given key.
+        """
+
+        if self.__thread is None:
+            self.__thread = threading.Thread(target = self.__run)
+            self.__thread.daemon = True
+            self.__thread.start()
+
+        event = threading.Event()
+        self.__pending[key] = event
+        self.__queue.put((write, event))
+
+        return
+
+    def wait(self, key):
+        """
+        Wait for any queued writes associated with the given key to complete.
+        """
+
+        if key in self.__pending:
+            self.__pending.pop(key).wait()
+        self.__check()
+
+        return
+
+    def wait_all(self):
+        """
+        Wait for all queued writes to complete.
+        """
+
+        self.__queue.join()
+        self.__pending = {}
+        self.__check()
+
+        return
+
 class DiskCheckpointer(Checkpointer):
     """
     Constant and Function storage on disk. All keys handled by a DiskCheckpointer
     are internally cast to strings.
 
+    Data are appended as float64 blocks to a single uniquely named file per
+    DiskCheckpointer and process, and located using an in-memory index. Data are
+    restored via a memory map of the file. Space freed by remove or clear is
+    reclaimed by compacting the file once at least half of it is unused. The file
+    is removed by close, or when the DiskCheckpointer is destroyed.
+
     Constructor arguments:
       dirname: The directory in which data is to be stored.
+      asynchronous: Whether data are written to disk in a background thread. In
+        this case checkpoint returns once the data have been copied, and
+        restoring data waits for the associated write to complete.
+      queue_depth: The maximum number of checkpoints with pending writes, if
+        asynchronous is True.
     """
 
-    def __init__(self, dirname = "checkpoints~"):
+    def __init__(self, dirname = "checkpoints~", asynchronous = False, queue_depth = 4):
         if not isinstance(dirname, str):
             raise InvalidArgumentException("dirname must be a string")
+        if not isinstance(asynchronous, bool):
+            raise InvalidArgumentException("asynchronous must be a bool")
 
         Checkpointer.__init__(self)
 
@@ -259,14 +403,128 @@ class DiskCheckpointer(Checkpointer):
                 os.mkdir(dirname)
         dolfin.MPI.barrier(dolfin.mpi_comm_world())
 
-        self.__dirname = dirname
-        self.__filenames = {}
+        fd, self.__filename = tempfile.mkstemp(prefix = "checkpoints_%i_" % dolfin.MPI.rank(dolfin.mpi_comm_world()), dir = dirname)
+        self.__handle = os.fdopen(fd, "w+b")
+        self.__map = None
+        self.__size = 0
+        self.__live = 0
+        self.__index = {}
         self.__id_map = {}
+        self.__lock = threading.Lock()
+        if asynchronous:
+            self.__writer = BackgroundWriter(depth = queue_depth)
+        else:
+            self.__writer = None
+
+        return
+
+    def __del__(self):
+        # The constructor may have failed before the file was opened
+        if not getattr(self, "_DiskCheckpointer__handle", None) is None:
+            self.close()
+
+        return
+
+    def close(self):
+        """
+        Discard all stored data, and close and remove the checkpoint file. The
+        DiskCheckpointer cannot be used after it is closed.
+        """
+
+        if self.__handle is None:
+            return
+
+        try:
+            self.__wait()
+        finally:
+            self.__map = None
+            self.__handle.close()
+            self.__handle = None
+            os.remove(self.__filename)
+            self.__size = 0
+            self.__live = 0
+            self.__index = {}
+            self.__id_map = {}
+
+        return
+
+    def __reserve(self, n):
+        offset = self.__size
+        self.__size += n
+        self.__live += n
+
+        return offset
+
+    def __write(self, blocks):
+        self.__lock.acquire()
+        try:
+            for offset, data in blocks:
+                self.__handle.seek(offset * 8)
+                self.__handle.write(data.tobytes())
+        finally:
+            self.__lock.release()
+
+        return
+
+    def __wait(self, key = None):
+        if not self.__writer is None:
+            if key is None:
+                self.__writer.wait_all()
+            else:
+                self.__writer.wait(key)
 
         return
 
-    def __filename(self, key):
-        return os.path.join(self.__dirname, "checkpoint_%s_%i" % (str(key), dolfin.MPI.rank(dolfin.mpi_comm_world())))
+    def __block(self, offset, n):
+        if n == 0:
+            return numpy.empty(0, dtype = numpy.float64)
+        if self.__map is None or self.__map.shape[0] < offset + n:
+            # The map covers the whole file, so all pending writes must complete
+            self.__wait()
+            self.__handle.flush()
+            self.__map = numpy.memmap(self.__filename, dtype = numpy.float64, mode = "r", shape = (self.__size,))
+
+        return self.__map[offset:offset + n]
+
+    def __load(self, key, c_id):
+        c = self.__id_map[key][c_id]
+        block = self.__block(*self.__index[key][c_id])
+        if isinstance(c, dolfin.Constant):
+            return float(block[0])
+        else:
+            return block
+
+    def __compact(self):
+        if 2 * self.__live > self.__size:
+            return
+
+        self.__wait()
+        self.__map = None
+        if self.__live == 0:
+            self.__handle.seek(0)
+            self.__handle.truncate()
+            self.__size = 0
+            return
+
+        filename = "%s.tmp" % self.__filename
+        handle = open(filename, "w+b")
+        offset = 0
+        for key in sorted(self.__index.keys()):
+            index = self.__index[key]
+            for c_id in index:
+                block_offset, n = index[c_id]
+                self.__handle.seek(block_offset * 8)
+                handle.write(self.__handle.read(n * 8))
+                index[c_id] = (offset, n)
+                offset += n
+        self.__handle.close()
+        handle.close()
+        os.rename(filename, self.__filename)
+
+        self.__handle = open(self.__filename, "r+b")
+        self.__size = offset
+
+        return
 
     def checkpoint(self, key, cs):
         """
@@ -275,24 +533,30 @@ class DiskCheckpointer(Checkpointer):
         """
 
         key = str(key)
-        if key in self.__filenames:
+        if self.__handle is None:
+            raise CheckpointException("Attempting to checkpoint with a closed DiskCheckpointer")
+        if key in self.__index:
             raise CheckpointException("Attempting to overwrite checkpoint with key %s" % key)
         cs = self._Checkpointer__check_cs(cs)
 
-        c_cs = OrderedDict()
+        index = OrderedDict()
         id_map = {}
+        blocks = []
         for c in cs:
             c_id = c.id()
-            c_cs[c_id] = self._Checkpointer__pack(c)
+            data = numpy.asarray(self._Checkpointer__pack(c), dtype = numpy.float64).reshape(-1)
+            offset = self.__reserve(data.shape[0])
+            index[c_id] = (offset, data.shape[0])
             id_map[c_id] = c
+            blocks.append((offset, data))
 
-        filename = self.__filename(key)
-        handle = open(filename, "wb")
-        pickler = pickle.Pickler(handle, -1)
-        pickler.dump(c_cs)
-
-        self.__filenames[key] = filename
+        self.__index[key] = index
         self.__id_map[key] = id_map
+        # The packed data are copies, and so can be written after this returns
+        if self.__writer is None:
+            self.__write(blocks)
+        else:
+            self.__writer.submit(key, lambda: self.__write(blocks))
 
         return
 
@@ -304,22 +568,19 @@ class DiskCheckpointer(Checkpointer):
         """
 
         key = str(key)
-        if not key in self.__filenames:
+        if not key in self.__index:
             raise CheckpointException("Missing checkpoint with key %s" % key)
         if not cs is None:
             cs = self._Checkpointer__check_cs(cs)
             cs = [c.id() for c in cs]
-
-        handle = open(self.__filename(key), "rb")
-        pickler = pickle.Unpickler(handle)
-        c_cs = pickler.load()
-        if cs is None:
-            cs = list(c_cs.keys())
+        else:
+            cs = list(self.__index[key].keys())
+        self.__wait(key)
 
         id_map = self.__id_map[key]
         for c_id in cs:
             c = id_map[c_id]
-            self._Checkpointer__unpack(c, c_cs[c_id])
+            self._Checkpointer__unpack(c, self.__load(key, c_id))
 
         return
 
@@ -330,7 +591,11 @@ class DiskCheckpointer(Checkpointer):
         """
 
         key = str(key)
-        return key in self.__filenames
+        if not key in self.__index:
+            return False
+        self.__wait(key)
+
+        return True
 
     def verify(self, key, tolerance = 0.0):
         """
@@ -339,19 +604,17 @@ class DiskCheckpointer(Checkpointer):
         """
 
         key = str(key)
-        if not key in self.__filenames:
+        if not key in self.__index:
             raise CheckpointException("Missing checkpoint with key %s" % key)
         if not isinstance(tolerance, float) or tolerance < 0.0:
             raise InvalidArgumentException("tolerance must be a non-negative float")
-        handle = open(self.__filename(key), "rb")
-        pickler = pickle.Unpickler(handle)
-        c_cs = pickler.load()
+        self.__wait(key)
 
         try:
             id_map = self.__id_map[key]
-            for c_id in c_cs:
+            for c_id in self.__index[key]:
                 c = id_map[c_id]
-                self._Checkpointer__verify(c, c_cs[c_id], tolerance = tolerance)
+                self._Checkpointer__verify(c, self.__load(key, c_id), tolerance = tolerance)
             dolfin.info("Verified checkpoint with key %s" % key)
         except CheckpointException as e:
             dolfin.info(str(e))
@@ -359,6 +622,14 @@ class DiskCheckpointer(Checkpointer):
 
         return
 
+    def __remove(self, key):
+        for offset, n in self.__index[key].values():
+            self.__live -= n
+        del(self.__index[key])
+        del(self.__id_map[key])
+
+        return
+
     def remove(self, key):
         """
         Remove data associated with the given key. The key is internally cast to a
@@ -366,12 +637,11 @@ class DiskCheckpointer(Checkpointer):
         """
 
         key = str(key)
-        if not key in self.__filenames:
+        if not key in self.__index:
             raise CheckpointException("Missing checkpoint with key %s" % key)
 
-#    os.remove(self.__filenames[key])
-        del(self.__filenames[key])
-        del(self.__id_map[key])
+        self.__remove(key)
+        self.__compact()
 
         return
 
@@ -384,17 +654,10 @@ class DiskCheckpointer(Checkpointer):
         if not isinstance(keep, list):
             raise InvalidArgumentException("keep must be a list")
 
-        if len(keep) == 0:
-#      for key in self.__filenames:
-#        os.remove(self.__filenames[key])
-            self.__filenames = {}
-            self.__id_map = {}
-        else:
-            keep = [str(key) for key in keep]
-            for key in copy.copy(list(self.__filenames.keys())):
-                if not key in keep:
-         #         os.remove(self.__filenames[key])
-                    del(self.__filenames[key])
-                    del(self.__id_map[key])
+        keep = [str(key) for key in keep]
+        for key in copy.copy(list(self.__index.keys())):
+            if not key in keep:
+                self.__remove(key)
+        self.__compact()
 
         return
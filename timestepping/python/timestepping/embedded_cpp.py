@@ -18,6 +18,7 @@
 
 import copy
 import ctypes
+import hashlib
 import os
 
 import dolfin
@@ -30,6 +31,7 @@ __all__ = \
   [
     "EmbeddedCpp",
     "CellKernel",
+    "compile_kernels",
     "double_arr",
     "int_arr",
     "long_arr"
@@ -51,6 +53,11 @@ class EmbeddedCpp(object):
       type:          One of int, float, int_arr, long_arr, double_arr,
                      DirichletBC, Function, GenericMatrix, GenericVector, or Mesh,
                      identifying the variable type.
+
+    Compiled code is cached on disk, in the Instant cache directory or in
+    dolfin.parameters["timestepping"]["embedded_cpp"]["cache_dir"], keyed by a
+    hash of the generated code, header file directories, compiler flags and
+    DOLFIN version. Instances with the same signature share one loaded library.
     """
 
     __boost_classes = {dolfin.cpp.DirichletBC:dolfin.DirichletBC,
@@ -62,6 +69,9 @@ class EmbeddedCpp(object):
 
     __default_includes = """#include "dolfin.h" """
 
+    # Compiled libraries, keyed by signature
+    __libraries = {}
+
     def __init__(self, code, includes = "", include_dirs = [], **kwargs):
         if not isinstance(code, str):
             raise InvalidArgumentException("code must be a string")
@@ -103,14 +113,11 @@ class EmbeddedCpp(object):
         self.__include_dirs = copy.copy(include_dirs)
         self.__args = args
         self.__lib = None
+        self.__generate()
 
         return
 
-    def compile(self):
-        """
-        Compile the code.
-        """
-
+    def __generate(self):
         args = ""
         argtypes = []
         cast_code = ""
@@ -160,15 +167,45 @@ class EmbeddedCpp(object):
       }
     }""" % (self.__includes, args, cast_code, self.__code)
 
-        mod = instant.build_module(code = code,
-          cppargs = dolfin.parameters["form_compiler"]["cpp_optimize_flags"],
-          lddargs = "-ldolfin", include_dirs = self.__include_dirs,
-          cmake_packages = ["DOLFIN"])
-        path = os.path.dirname(mod.__file__)
-        name = os.path.split(path)[-1]
-        self.__lib = ctypes.cdll.LoadLibrary(os.path.join(path, "_%s.so" % name))
-        self.__lib.code.argtypes = argtypes
-        self.__lib.code.restype = int
+        self.__generated_code = code
+        self.__argtypes = argtypes
+
+        return
+
+    def signature(self):
+        """
+        Return the signature used to identify the compiled code.
+        """
+
+        cppargs = dolfin.parameters["form_compiler"]["cpp_optimize_flags"]
+        return "timestepping_embedded_cpp_%s" % hashlib.sha1(str((self.__generated_code,
+          self.__include_dirs, cppargs, dolfin.__version__)).encode("utf-8")).hexdigest()
+
+    def compile(self):
+        """
+        Compile the code, or load it from the cache if it has already been
+        compiled.
+        """
+
+        signature = self.signature()
+        if not signature in self.__libraries:
+            cache_dir = dolfin.parameters["timestepping"]["embedded_cpp"]["cache_dir"]
+            if cache_dir == "":
+                cache_dir = None
+            # Instant locks the module in the cache directory while it is built,
+            # so concurrent processes wait for a single build
+            mod = instant.build_module(code = self.__generated_code,
+              cppargs = dolfin.parameters["form_compiler"]["cpp_optimize_flags"],
+              lddargs = "-ldolfin", include_dirs = self.__include_dirs,
+              cmake_packages = ["DOLFIN"], signature = signature,
+              cache_dir = cache_dir)
+            path = os.path.dirname(mod.__file__)
+            name = os.path.split(path)[-1]
+            lib = ctypes.cdll.LoadLibrary(os.path.join(path, "_%s.so" % name))
+            lib.code.argtypes = self.__argtypes
+            lib.code.restype = int
+            self.__libraries[signature] = lib
+        self.__lib = self.__libraries[signature]
 
         return
 
@@ -239,7 +276,10 @@ class CellKernel(EmbeddedCpp):
       include_dirs:         Header file directories.
     Remaining keyword arguments are as for the EmbeddedCpp constructor. An
     additional size_t variable cell is defined in the cell iteration, indicating
-    the cell number.
+    the cell number, and an additional int variable n_cells is equal to the
+    number of cells in the mesh. The number of cells is passed when the code is
+    run, so that the same compiled code is used for any mesh, and on all
+    processes.
     """
 
     def __init__(self, mesh, kernel_code, initialisation_code = "", finalisation_code = "", includes = "", include_dirs = [], **kwargs):
@@ -251,15 +291,67 @@ class CellKernel(EmbeddedCpp):
             raise InvalidArgumentException("initialisation_code must be a string")
         if not isinstance(finalisation_code, str):
             raise InvalidArgumentException("finalisation_code must be a string")
+        if "n_cells" in kwargs:
+            raise InvalidArgumentException("n_cells is a reserved argument name")
 
         code = \
     """
     %s
-        for(size_t cell = 0;cell < %i;cell++) {
+        for(size_t cell = 0;cell < (size_t)n_cells;cell++) {
     %s
         }
-    %s""" % (initialisation_code, mesh.num_cells(), kernel_code, finalisation_code)
+    %s""" % (initialisation_code, kernel_code, finalisation_code)
 
+        kwargs = copy.copy(kwargs)
+        kwargs["n_cells"] = int
         EmbeddedCpp.__init__(self, code, includes = includes, include_dirs = include_dirs, **kwargs)
+        self.__n_cells = mesh.num_cells()
+
+        return
+
+    def run(self, **kwargs):
+        """
+        Run the code. Arguments are as for EmbeddedCpp.run, excluding n_cells.
+        """
+
+        if "n_cells" in kwargs:
+            raise InvalidArgumentException("n_cells is a reserved argument name")
+        kwargs = copy.copy(kwargs)
+        kwargs["n_cells"] = self.__n_cells
+        EmbeddedCpp.run(self, **kwargs)
 
         return
+
+def compile_kernels(kernels):
+    """
+    Compile the supplied EmbeddedCpp or list of EmbeddedCpp s, for example to
+    warm up the cache ahead of a batch of runs. This must be called on all
+    processes. In parallel the code is first compiled on the root process, and
+    other processes then load it from the cache.
+    """
+
+    if isinstance(kernels, EmbeddedCpp):
+        kernels = [kernels]
+    if not isinstance(kernels, list):
+        raise InvalidArgumentException("kernels must be an EmbeddedCpp or a list of EmbeddedCpp s")
+    for kernel in kernels:
+        if not isinstance(kernel, EmbeddedCpp):
+            raise InvalidArgumentException("kernels must be an EmbeddedCpp or a list of EmbeddedCpp s")
+
+    comm = dolfin.mpi_comm_world()
+    if dolfin.MPI.size(comm) > 1:
+        if dolfin.MPI.rank(comm) == 0:
+            try:
+                for kernel in kernels:
+                    kernel.compile()
+            finally:
+                dolfin.MPI.barrier(comm)
+        else:
+            dolfin.MPI.barrier(comm)
+            for kernel in kernels:
+                kernel.compile()
+    else:
+        for kernel in kernels:
+            kernel.compile()
+
+    return
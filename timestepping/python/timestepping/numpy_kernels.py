@@ -0,0 +1,161 @@
+#!/usr/bin/env python2
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, version 3 of the License
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import copy
+
+import dolfin
+import numpy
+
+from .embedded_cpp import *
+from .exceptions import *
+
+__all__ = \
+  [
+    "NumPyCellKernel"
+  ]
+
+class CellDofs(object):
+    """
+    The degrees of freedom of each cell of a function space.
+    """
+
+    def __init__(self, space):
+        dof = space.dofmap()
+        n_cells = space.mesh().num_cells()
+        if n_cells == 0:
+            nodes = numpy.empty((0, dof.max_cell_dimension()), dtype = numpy.intc)
+        else:
+            nodes = numpy.array([dof.cell_dofs(i) for i in range(n_cells)], dtype = numpy.intc)
+        ownership_range = dof.ownership_range()
+
+        self.nodes = nodes
+        self.global_nodes = dof.tabulate_local_to_global_dofs()[nodes.ravel()]
+        self.owned = nodes < ownership_range[1] - ownership_range[0]
+
+        return
+
+    def gather(self, fn):
+        """
+        Return an (n_cells, n_dofs) array containing the values of the supplied
+        Function at the degrees of freedom of each cell.
+        """
+
+        return fn.vector().gather(self.global_nodes).reshape(self.nodes.shape)
+
+    def scatter(self, values, fn):
+        """
+        Set the values of the supplied Function from an (n_cells, n_dofs) array of
+        values at the degrees of freedom of each cell. Where a degree of freedom is
+        shared by multiple cells, the value from the cell with the highest cell
+        index is used.
+        """
+
+        data = fn.vector().get_local()
+        data[self.nodes[self.owned]] = values[self.owned]
+        fn.vector().set_local(data)
+        fn.vector().apply("insert")
+
+        return
+
+__cell_dofs = {}
+def cell_dofs(space):
+    """
+    Return the CellDofs for the supplied FunctionSpace. The CellDofs are cached,
+    and reused by subsequent calls with the same function space.
+    """
+
+    if not isinstance(space, dolfin.FunctionSpaceBase):
+        raise InvalidArgumentException("space must be a FunctionSpace")
+
+    key = space.id()
+    if not key in __cell_dofs:
+        __cell_dofs[key] = CellDofs(space)
+    return __cell_dofs[key]
+
+class NumPyCellKernel(object):
+    """
+    A vectorised alternative to CellKernel, which requires no compiler. The
+    kernel is applied to all cells at once using NumPy array operations.
+
+    Constructor arguments:
+      mesh:     A Mesh.
+      kernel:   A callable, called with the keyword arguments passed to run. Each
+                Function argument is replaced by an (n_cells, n_dofs) array,
+                containing the values of the Function at the degrees of freedom
+                of each cell in the mesh, ordered as by the dofmap.
+      outputs:  A list of names of Function arguments. The arrays for these
+                arguments are scattered back to the Function s after the kernel
+                has been called, and hence the kernel should modify these arrays
+                in place. Where a degree of freedom is shared by multiple cells,
+                the value from the cell with the highest cell index is used.
+    Remaining keyword arguments form a list of name:type pairs, with:
+      name:     The name of an argument of the kernel.
+      type:     One of int, float, int_arr, long_arr, double_arr, or Function,
+                identifying the argument type.
+    """
+
+    def __init__(self, mesh, kernel, outputs = [], **kwargs):
+        if not isinstance(mesh, dolfin.Mesh):
+            raise InvalidArgumentException("mesh must be a Mesh")
+        if not callable(kernel):
+            raise InvalidArgumentException("kernel must be callable")
+        if not isinstance(outputs, list):
+            raise InvalidArgumentException("outputs must be a list of strings")
+        for arg in kwargs.values():
+            if not arg in [int, float, int_arr, long_arr, double_arr, dolfin.Function]:
+                raise InvalidArgumentException("Argument type must be int, float, int_arr, long_arr, double_arr or Function")
+        for name in outputs:
+            if not name in kwargs or not kwargs[name] == dolfin.Function:
+                raise InvalidArgumentException("outputs must name Function arguments")
+
+        self.__mesh = mesh
+        self.__kernel = kernel
+        self.__outputs = copy.copy(outputs)
+        self.__args = copy.copy(kwargs)
+
+        return
+
+    def run(self, **kwargs):
+        """
+        Run the kernel. The keyword arguments form a list of name:variable pairs,
+        with:
+          name:     The name of an argument of the kernel.
+          variable: The variable to be passed to the kernel. The type must be
+                    consistent with the type passed to the constructor.
+        """
+
+        args = kwargs
+        if not tuple(sorted(args.keys())) == tuple(sorted(self.__args.keys())):
+            raise InvalidArgumentException("Invalid argument names")
+        for name in args.keys():
+            arg = args[name]
+            if isinstance(arg, numpy.ndarray):
+                if not {int_arr:"int32", long_arr:"int64", double_arr:"float64"}.get(self.__args[name], None) == arg.dtype:
+                    raise InvalidArgumentException("Argument %s is of invalid type" % name)
+            elif self.__args[name] in [int_arr, long_arr, double_arr] or not isinstance(arg, self.__args[name]):
+                raise InvalidArgumentException("Argument %s is of invalid type" % name)
+            if isinstance(arg, dolfin.Function) and not arg.function_space().mesh().id() == self.__mesh.id():
+                raise InvalidArgumentException("Argument %s is on an invalid mesh" % name)
+
+        largs = copy.copy(args)
+        for name in largs:
+            if isinstance(largs[name], dolfin.Function):
+                largs[name] = cell_dofs(largs[name].function_space()).gather(largs[name])
+
+        self.__kernel(**largs)
+
+        for name in self.__outputs:
+            cell_dofs(args[name].function_space()).scatter(largs[name], args[name])
+
+        return
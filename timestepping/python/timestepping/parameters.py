@@ -74,3 +74,8 @@ add_parameter(dolfin.parameters["timestepping"]["pre_assembly"]["bilinear_forms"
 add_parameter(dolfin.parameters["timestepping"]["pre_assembly"]["bilinear_forms"], "term_optimisation", False)
 add_parameter(dolfin.parameters["timestepping"]["pre_assembly"]["equations"], "symmetric_boundary_conditions", False)
 add_parameter(dolfin.parameters["timestepping"]["pre_assembly"], "verbose", True)
+add_parameter(dolfin.parameters["timestepping"]["pre_assembly"], "assembly_cache_size", 0) # in megabytes, 0 for unbounded
+add_parameter(dolfin.parameters["timestepping"]["pre_assembly"], "linear_solver_cache_size", 0) # in megabytes, 0 for unbounded
+add_parameter(dolfin.parameters["timestepping"], "solve_threads", 1) # 1 to perform timestep solves in sequence. Experimental if greater than 1
+nest_parameters(dolfin.parameters["timestepping"], "embedded_cpp")
+add_parameter(dolfin.parameters["timestepping"]["embedded_cpp"], "cache_dir", "") # empty for the Instant default
@@ -310,6 +310,23 @@ class PAEquationSolver(EquationSolver):
 
         return self.__linear_solver
 
+    def pre_assembled_lhs(self):
+        """
+        Return the pre-assembled LHS. This is a GenericMatrix obtained from the
+        assembly cache, or a PAForm. For a non-linear solve this is the
+        pre-assembled Jacobian.
+        """
+
+        return self.__a
+
+    def pre_assembled_rhs(self):
+        """
+        Return the pre-assembled RHS, as a PAForm. For a non-linear solve this is
+        the pre-assembled residual.
+        """
+
+        return self.__L
+
     def solve(self):
         """
         Solve the equation
@@ -191,6 +191,14 @@ class PAFilter(object):
 
         return
 
+    def tensors(self):
+        """
+        Return a list of internally stored tensors. Pre-assembled tensors are
+        obtained from the assembly cache, and may be shared with other PAFilter s.
+        """
+
+        return []
+
     def match_tensor(self, tensor = None):
         """
         Addition of GenericMatrix s can be more efficient if the sparsity patterns
@@ -269,6 +277,17 @@ class PAStaticFilter(PAFilter):
 
         return
 
+    def tensors(self):
+        """
+        Return a list of internally stored tensors. Pre-assembled tensors are
+        obtained from the assembly cache, and may be shared with other PAFilter s.
+        """
+
+        if self.__pre_assembled is None:
+            return []
+        else:
+            return [self.__pre_assembled]
+
     def match_tensor(self, tensor = None):
         """
         Addition of GenericMatrix s can be more efficient if the sparsity patterns
@@ -389,6 +408,17 @@ class PAMatrixFilter(PAFilter):
 
         return
 
+    def tensors(self):
+        """
+        Return a list of internally stored tensors. Pre-assembled tensors are
+        obtained from the assembly cache, and may be shared with other PAFilter s.
+        """
+
+        if self.__pre_assembled is None:
+            return []
+        else:
+            return list(self.__pre_assembled.values())
+
     def assemble(self, tensor = None, same_nonzero_pattern = False, copy = False):
         """
         Return the result of assembling the Form associated with the PAFilter.
@@ -452,6 +482,17 @@ class NonPAFilter(PAFilter):
         self.__tensor = None
         return ufl.form.Form([]), 1
 
+    def tensors(self):
+        """
+        Return a list of internally stored tensors. This is the temporary
+        GenericMatrix, if any, into which the Form is assembled.
+        """
+
+        if self.__tensor is None:
+            return []
+        else:
+            return [self.__tensor]
+
     def match_tensor(self, tensor = None):
         """
         Addition of GenericMatrix s can be more efficient if the sparsity patterns
@@ -659,6 +700,18 @@ class PAForm(object):
                 tensor = filter.assemble(tensor = tensor, same_nonzero_pattern = self.__same_nonzero_pattern, copy = False)
             return tensor
 
+    def tensors(self):
+        """
+        Return a list of tensors stored by the PAForm. These include pre-assembled
+        tensors obtained from the assembly cache, which may be shared with other
+        PAForm s, and temporaries which are modified by assemble.
+        """
+
+        tensors = []
+        for filter in self.__filters:
+            tensors += filter.tensors()
+        return tensors
+
     def rank(self):
         """
         Return the PAForm rank.
@@ -19,6 +19,7 @@
 from collections import OrderedDict
 import copy
 from fractions import Fraction
+import multiprocessing.pool
 
 import dolfin
 import numpy
@@ -60,6 +61,7 @@ class TimeSystem(object):
         self.__x_tfns = [[], True]
         self.__tfns = [[], True]
         self.__sorted_solves = [[[], [], []], True]
+        self.__solve_stages = [[], [], []]
 
         self.__update = None
 
@@ -448,31 +450,62 @@ class TimeSystem(object):
             self.check_function_levels()
             self.check_dependencies()
 
-            def sort_solves(fn, deps, solves, ssolves, added_solves):
+            def sort_solves(fn, deps, solves, ssolves, added_solves, stages):
                 if fn in added_solves:
                     return
+                stage = 0
                 for dep in deps[fn]:
                     if not dep is fn and dep in solves:
-                        sort_solves(dep, deps, solves, ssolves, added_solves)
+                        sort_solves(dep, deps, solves, ssolves, added_solves, stages)
+                        stage = max(stage, stages[dep] + 1)
                 added_solves.append(fn)
                 ssolves.append(solves[fn])
+                stages[fn] = stage
                 return
 
-            added_solves = []
+            def solve_stages(ssolves, stages):
+                # Group the indices of the sorted solves by stage
+                lstages = []
+                for i, x in enumerate(ssolves):
+                    while len(lstages) <= stages[x]:
+                        lstages.append([])
+                    lstages[stages[x]].append(i)
+                return lstages
+
+            stages = {}
             init_solves = []
-            solves = []
-            final_solves = []
+            init_xs = []
             for x in self.__init_solves:
-                sort_solves(x, self.__deps, self.__init_solves, init_solves, added_solves)
+                sort_solves(x, self.__deps, self.__init_solves, init_solves, init_xs, stages)
+            solves = []
+            xs = []
             for x in self.__solves:
-                sort_solves(x, self.__deps, self.__solves, solves, added_solves)
+                sort_solves(x, self.__deps, self.__solves, solves, xs, stages)
+            final_solves = []
+            final_xs = []
             for x in self.__final_solves:
-                sort_solves(x, self.__deps, self.__final_solves, final_solves, added_solves)
+                sort_solves(x, self.__deps, self.__final_solves, final_solves, final_xs, stages)
 
             self.__sorted_solves[0], self.__sorted_solves[1] = [init_solves, solves, final_solves], True
+            self.__solve_stages = [solve_stages(init_xs, stages),
+                                   solve_stages(xs, stages),
+                                   solve_stages(final_xs, stages)]
 
         return copy.copy(init_solves), copy.copy(solves), copy.copy(final_solves)
 
+    def solve_stages(self):
+        """
+        Return the stages of the dependency graph of the solves. Returns a tuple of
+        lists, (initial stages, timestep stages, final stages), corresponding to the
+        lists returned by sorted_solves. Each stage is a list of indices into the
+        corresponding list of sorted solves. A solve depends only upon solves in
+        earlier stages, and hence the solves in a stage can be performed in any
+        order.
+        """
+
+        self.sorted_solves()
+        return tuple(copy.deepcopy(self.__solve_stages))
+
     def assemble(self, *args, **kwargs):
         """
         Return a ForwardModel if adjoint is False, and a ManagedModel with an
@@ -503,6 +536,15 @@ class ForwardModel(object):
     """
     Used to solve timestep equations with timestep specific optimisations applied.
 
+    If dolfin.parameters["timestepping"]["solve_threads"] is greater than one then
+    independent timestep solves, in the same stage of the dependency graph (see
+    TimeSystem.solve_stages), are performed concurrently using a pool of threads.
+    This is experimental. PAEquationSolver s which share a linear solver, a
+    cached LHS matrix, or a pre-assembled LHS or RHS tensor are performed in
+    sequence, as are solves of any other type apart from AssignmentSolver s. Solves only run in parallel where the backend releases
+    the global interpreter lock during assembly and solves, and the backend must
+    then be thread safe. The pool is closed by finalise.
+
     Constructor arguments:
       tsystem: A TimeSystem defining the timestep equations.
       initialise: Whether the initialise method is to be called.
@@ -516,6 +558,7 @@ class ForwardModel(object):
 
         tfns = tsystem.tfns()
         init_solves, solves, final_solves = tsystem.sorted_solves()
+        solve_stages = tsystem.solve_stages()[1]
 
         for i, solve in enumerate(init_solves):
             if isinstance(solve, (AssignmentSolver, EquationSolver)):
@@ -546,6 +589,8 @@ class ForwardModel(object):
         self.__init_solves = init_solves
         self.__solves = solves
         self.__final_solves = final_solves
+        self.__solve_stages = [[solves[i] for i in stage] for stage in solve_stages]
+        self.__pool = None
         self.__update = tsystem._TimeSystem__update
         self.__s = 0
 
@@ -612,8 +657,67 @@ class ForwardModel(object):
         """
 
 #    dolfin.info("Performing forward timestep")
-        for solve in self.__solves:
-            solve.solve()
+        threads = dolfin.parameters["timestepping"]["solve_threads"]
+        if threads > 1:
+            if self.__pool is None or not self.__pool[0] == threads:
+                self.__close_pool()
+                self.__pool = [threads, multiprocessing.pool.ThreadPool(threads)]
+            for stage in self.__solve_stages:
+                # Computed on each timestep, as reassembly may change the linear
+                # solvers
+                for batch in self.__solve_batches(stage):
+                    if len(batch) == 1:
+                        batch[0].solve()
+                    else:
+                        self.__pool[1].map(lambda solve : solve.solve(), batch)
+        else:
+            for solve in self.__solves:
+                solve.solve()
+
+        return
+
+    def __solve_batches(self, stage):
+        # Split a stage into batches of solves which can be performed
+        # concurrently. PAEquationSolver s sharing a linear solver, a cached LHS
+        # matrix, or any tensor stored by a pre-assembled LHS or RHS PAForm are
+        # placed in different batches. Solves of unknown type, which may hold any
+        # shared data, are performed alone.
+        def resources(solve):
+            if isinstance(solve, AssignmentSolver):
+                return set()
+            elif isinstance(solve, PAEquationSolver):
+                res = set()
+                linear_solver = solve.linear_solver()
+                if not linear_solver is None:
+                    res.add(id(linear_solver))
+                for form in [solve.pre_assembled_lhs(), solve.pre_assembled_rhs()]:
+                    if isinstance(form, dolfin.GenericMatrix):
+                        res.add(id(form))
+                    elif isinstance(form, PAForm):
+                        for tensor in form.tensors():
+                            res.add(id(tensor))
+                return res
+            else:
+                return None
+
+        batches = []
+        for solve in stage:
+            res = resources(solve)
+            for batch in batches:
+                if not res is None and not batch[1] is None and res.isdisjoint(batch[1]):
+                    batch[0].append(solve)
+                    batch[1].update(res)
+                    break
+            else:
+                batches.append([[solve], res])
+
+        return [batch[0] for batch in batches]
+
+    def __close_pool(self):
+        if not self.__pool is None:
+            self.__pool[1].close()
+            self.__pool[1].join()
+            self.__pool = None
 
         return
 
@@ -656,6 +760,8 @@ class ForwardModel(object):
         for solve in self.__final_solves:
             solve.solve()
 
+        self.__close_pool()
+
         return
 
     def reassemble(self, *args, **kwargs):
@@ -961,9 +1067,17 @@ class ManagedModel(object):
       initialise: Whether the initialise method is to be called.
       reassemble: Whether the reassemble methods of solvers defined by the
         TimeSystem should be called.
+      snaps_in_ram: If supplied, at most snaps_in_ram intermediate forward
+        solutions are held in memory when computing an adjoint solution, and the
+        forward solution is recomputed between the storage points using an
+        optimal binomial (revolve) checkpointing schedule. If disk_period is equal
+        to None then only the first timestep is stored, and the schedule spans the
+        entire forward model.
+      asynchronous_checkpoints: Whether data are written to disk in a background
+        thread, overlapping disk output with subsequent timesteps.
     """
 
-    def __init__(self, tsystem, functional = None, disk_period = None, initialise = True, reassemble = False):
+    def __init__(self, tsystem, functional = None, disk_period = None, initialise = True, reassemble = False, snaps_in_ram = None, asynchronous_checkpoints = False):
         if not isinstance(tsystem, TimeSystem):
             raise InvalidArgumentException("tsystem must be a TimeSystem")
         if not functional is None and not isinstance(functional, (ufl.form.Form, TimeFunctional)):
@@ -971,6 +1085,9 @@ class ManagedModel(object):
         if not disk_period is None:
             if not isinstance(disk_period, int) or disk_period <= 0:
                 raise InvalidArgumentException("disk_period must be a positive integer")
+        if not snaps_in_ram is None:
+            if not isinstance(snaps_in_ram, int) or snaps_in_ram < 0:
+                raise InvalidArgumentException("snaps_in_ram must be a non-negative integer")
 
         forward = assemble(tsystem, adjoint = False, initialise = False, reassemble = reassemble)
         adjoint = AdjointModel(forward)
@@ -1019,9 +1136,12 @@ class ManagedModel(object):
         if disk_period is None:
             self.__disk_checkpointer = None
         else:
-            self.__disk_checkpointer = DiskCheckpointer()
+            self.__disk_checkpointer = DiskCheckpointer(asynchronous = asynchronous_checkpoints)
         self.__disk_period = disk_period
         self.__disk_m = -1
+        self.__snaps_in_ram = snaps_in_ram
+        self.__snaps = []
+        self.__snaps_m = -1
         self.__init_cp_cs1 = init_cp_cs1
         self.__init_cp_cs2 = init_cp_cs2
         self.__cp_cs = cp_cs
@@ -1039,7 +1159,12 @@ class ManagedModel(object):
         return
 
     def __timestep_checkpoint(self, s, cp_cs):
-        if self.__disk_period is None:
+        if not self.__snaps_in_ram is None and s >= 0:
+            m = self.__block(s)
+            if not m == self.__disk_m:
+                self.__block_checkpointer().checkpoint(m, cp_cs)
+                self.__disk_m = m
+        elif self.__disk_period is None:
             self.__memory_checkpointer.checkpoint(s, cp_cs)
         elif s < 0:
             self.__disk_checkpointer.checkpoint(s, cp_cs)
@@ -1052,6 +1177,24 @@ class ManagedModel(object):
 
         return
 
+    def __block(self, s):
+        if self.__disk_period is None:
+            return 0
+        else:
+            return s // self.__disk_period
+
+    def __block_start(self, m):
+        if self.__disk_period is None:
+            return 1
+        else:
+            return max(m * self.__disk_period, 1)
+
+    def __block_checkpointer(self):
+        if self.__disk_period is None:
+            return self.__memory_checkpointer
+        else:
+            return self.__disk_checkpointer
+
     def __restore_timestep_checkpoint(self, s, cp_cs = None, update_cs = None):
         if update_cs is None:
             def lupdate_cs(s):
@@ -1073,7 +1216,9 @@ class ManagedModel(object):
             assert(callable(cp_cs))
             lcp_cs = cp_cs
 
-        if self.__disk_period is None:
+        if not self.__snaps_in_ram is None and s >= 0:
+            self.__restore_binomial_checkpoint(s, lcp_cs, lupdate_cs)
+        elif self.__disk_period is None:
             if s >= 0:
                 self.__forward.timestep_update(s = s, cs = lupdate_cs(s))
                 self.__memory_checkpointer.restore(s, cs = lcp_cs(s))
@@ -1085,7 +1230,7 @@ class ManagedModel(object):
             m = s // self.__disk_period
             i = s % self.__disk_period
 
-            if (m, i) in self.__memory_checkpointer:
+            if self.__memory_checkpointer.has_key((m, i)):
                 self.__forward.timestep_update(s = s, cs = lupdate_cs(s))
                 self.__memory_checkpointer.restore((m, i))
             else:
@@ -1121,15 +1266,69 @@ class ManagedModel(object):
 
         return
 
+    def __restore_binomial_checkpoint(self, s, lcp_cs, lupdate_cs):
+        # Timesteps are restored in reverse order within each storage block, so
+        # any snapshot beyond s is no longer required
+        m = self.__block(s)
+        if not m == self.__snaps_m:
+            self.__clear_rerun_checkpoints()
+            self.__snaps_m = m
+        while len(self.__snaps) > 0 and self.__snaps[-1] > s:
+            self.__memory_checkpointer.remove(("snap", self.__snaps.pop()))
+
+        if len(self.__snaps) > 0 and self.__snaps[-1] == s:
+            self.__forward.timestep_update(s = s, cs = lupdate_cs(s))
+            self.__memory_checkpointer.restore(("snap", s))
+            self.__memory_checkpointer.remove(("snap", self.__snaps.pop()))
+            return
+
+        ls = self.__block_start(m)
+        if s == ls:
+            self.__forward.timestep_update(s = s, cs = lupdate_cs(s))
+            self.__block_checkpointer().restore(m)
+            return
+
+        if len(self.__snaps) > 0:
+            ls = self.__snaps[-1]
+            self.__memory_checkpointer.restore(("snap", ls))
+        else:
+            self.__block_checkpointer().restore(m)
+
+        # Advance from the most recent snapshot, storing further snapshots in the
+        # free memory slots according to the binomial schedule
+        while ls < s:
+            n = binomial_advance(s - ls, self.__snaps_in_ram - len(self.__snaps) + 1)
+            for j in range(ls + 1, ls + n + 1):
+                self.__forward.timestep_cycle()
+                self.__forward.timestep_update(s = j)
+                self.__forward.timestep_solve()
+            ls += n
+            if ls < s:
+                self.__memory_checkpointer.checkpoint(("snap", ls), lcp_cs(ls))
+                self.__snaps.append(ls)
+
+        return
+
     def __clear_rerun_checkpoints(self):
-        if not self.__disk_period is None:
+        if not self.__snaps_in_ram is None:
+            for ls in self.__snaps:
+                self.__memory_checkpointer.remove(("snap", ls))
+            self.__snaps = []
+            self.__snaps_m = -1
+        elif not self.__disk_period is None:
             self.__memory_checkpointer.clear()
             self.__disk_m = -1
 
         return
 
     def __clear_timestep_checkpoints(self, keep = []):
-        if self.__disk_period is None:
+        if not self.__snaps_in_ram is None:
+            self.__clear_rerun_checkpoints()
+            self.__memory_checkpointer.clear(keep = keep)
+            if not self.__disk_period is None:
+                self.__disk_checkpointer.clear(keep = keep)
+            self.__disk_m = -1
+        elif self.__disk_period is None:
             self.__memory_checkpointer.clear(keep = keep)
         else:
             self.__disk_checkpointer.clear(keep = keep)
@@ -1138,7 +1337,11 @@ class ManagedModel(object):
         return
 
     def __verify_timestep_checkpoint(self, s, tolerance = 0.0):
-        if self.__disk_period is None:
+        if not self.__snaps_in_ram is None and s >= 0:
+            m = self.__block(s)
+            if s == self.__block_start(m):
+                self.__block_checkpointer().verify(m, tolerance = tolerance)
+        elif self.__disk_period is None:
             self.__memory_checkpointer.verify(s, tolerance = tolerance)
         elif s < 0:
             self.__disk_checkpointer.verify(s, tolerance = tolerance)
@@ -1147,7 +1350,7 @@ class ManagedModel(object):
             i = s % self.__disk_period
             if i == 0:
                 self.__disk_checkpointer.verify(m, tolerance = tolerance)
-            if (m, i) in self.__memory_checkpointer:
+            if self.__memory_checkpointer.has_key((m, i)):
                 self.__memory_checkpointer.verify((m, i), tolerance = tolerance)
 
         return
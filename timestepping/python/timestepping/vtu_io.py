@@ -15,14 +15,13 @@
 #
 # You should have received a copy of the GNU Lesser General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
-
 from collections import OrderedDict
-import copy
 
 import dolfin
 import numpy
 import ufl
 import vtk
+from vtk.util import numpy_support
 
 from .exceptions import *
 from .fenics_overrides import *
@@ -33,169 +32,342 @@ __all__ = \
     "write_vtu"
   ]
 
-def read_vtu(filename, space):
+def check_element(e, dim, name):
     """
-    Read a vtu file with the supplied filename base, with fields on the supplied
-    FunctionSpace. Return a dict with the Function names as keys and the
-    Function s as values.
-
-    Vector fields are not currently supported. Currently only works with a single
-    MPI process.
+    Check that the supplied scalar element can be represented by VTK cells.
     """
 
-    if not isinstance(filename, str):
-        raise InvalidArgumentException("filename must be a string")
-    if not isinstance(space, dolfin.FunctionSpaceBase):
-        raise InvalidArgumentException("space must be a FunctionSpace")
-    if dolfin.MPI.size(dolfin.mpi_comm_world()) > 1:
-        raise NotImplementedException("read_vtu cannot be used with more than one MPI process")
-
-    mesh = space.mesh()
-    dim = mesh.geometry().dim()
-
-    if isinstance(space, dolfin.VectorFunctionSpace):
-        raise NotImplementedException("VectorFunctionSpace s not supported by read_vtu")
-    elif not space.num_sub_spaces() == 0:
-        raise NotImplementedException("Subspaces not supported by read_vtu")
-    e = space.ufl_element()
-    degree = e.degree()
     assert(e.cell().geometric_dimension() == dim)
     assert(e.cell().topological_dimension() == dim)
     if (not e.family() in ["Lagrange", "Discontinuous Lagrange"]
         or not dim in [1, 2, 3]
-        or (dim == 1 and not degree in [1, 2, 3])
-        or (dim in [2, 3] and not degree in [1, 2])) and \
+        or (dim == 1 and not e.degree() in [1, 2, 3])
+        or (dim in [2, 3] and not e.degree() in [1, 2])) and \
       (not e.family() == "Discontinuous Lagrange"
         or not dim in [1, 2, 3]
-        or not degree == 0):
-        raise NotImplementedException('Element family "%s" with degree %i in %i dimension(s) not supported by read_vtu' % (e.family(), degree, dim))
+        or not e.degree() == 0):
+        raise NotImplementedException('Element family "%s" with degree %i in %i dimension(s) not supported by %s' % (e.family(), e.degree(), dim, name))
+
+    return
+
+def scalar_sub_spaces(space, suffix = ""):
+    """
+    Return a list of (suffix, sub-space) pairs for the scalar components of the
+    supplied function space, in the order and with the name suffixes used by
+    write_vtu.
+    """
+
+    n_sub_spaces = space.num_sub_spaces()
+    if n_sub_spaces == 0:
+        return [(suffix, space)]
+    else:
+        sub_spaces = []
+        for i in range(n_sub_spaces):
+            sub_spaces += scalar_sub_spaces(space.sub(i), suffix = "%s_%i" % (suffix, i + 1))
+        return sub_spaces
+
+def cell_dofs(space, cell_map = None):
+    """
+    Return an array containing the process local degrees of freedom of each
+    locally owned cell, permuted by cell_map if this is supplied.
+    """
 
-    n = space.dim()
-    n_cells = mesh.num_cells()
     dof = space.dofmap()
+    cells = numpy.array([dof.cell_dofs(i) for i in range(space.mesh().num_cells())], dtype = numpy.intc)
+    if not cell_map is None:
+        cells = cells[:, cell_map]
+    return cells
+
+class VTUElementLayout(object):
+    """
+    The VTK points and cells used to represent fields with the supplied scalar
+    Lagrange element on the locally owned cells of a mesh. Each VTK point (or,
+    for degree 0, each VTK cell) is associated with a node of a cell, recorded as
+    a cell index and a cell local node index. Only the topology is stored, and
+    the point coordinates are computed by the points method.
+    """
 
-    if dim == 1:
-        cell_map = None
-    elif dim == 2:
-        if degree in [0, 1]:
+    def __init__(self, mesh, e):
+        dim = mesh.geometry().dim()
+        degree = e.degree()
+        check_element(e, dim, "read_vtu and write_vtu")
+
+        if dim == 1:
+            if degree in [0, 1]:
+                cell_type = vtk.vtkLine().GetCellType()
+            elif degree == 2:
+                cell_type = vtk.vtkQuadraticEdge().GetCellType()
+            else:
+                cell_type = vtk.vtkCubicLine().GetCellType()
             cell_map = None
+        elif dim == 2:
+            if degree in [0, 1]:
+                cell_type = vtk.vtkTriangle().GetCellType()
+                cell_map = None
+            else:
+                cell_type = vtk.vtkQuadraticTriangle().GetCellType()
+                cell_map = [0, 1, 2, 5, 3, 4]
         else:
-            cell_map = {0:0, 1:1, 2:2, 3:5, 4:3, 5:4}
-    else:
-        if degree in [0, 1]:
-            cell_map = None
+            if degree in [0, 1]:
+                cell_type = vtk.vtkTetra().GetCellType()
+                cell_map = None
+            else:
+                cell_type = vtk.vtkQuadraticTetra().GetCellType()
+                cell_map = [0, 1, 2, 3, 9, 6, 8, 7, 5, 4]
+
+        if degree == 0:
+            xspace = dolfin.FunctionSpace(mesh, "CG", 1)
+            xcell_map = None
+        else:
+            xspace = dolfin.FunctionSpace(mesh, e)
+            xcell_map = cell_map
+        xcells = cell_dofs(xspace, cell_map = xcell_map)
+        # The VTK points are the process local nodes of the local cells
+        xnodes, first, cells = numpy.unique(xcells, return_index = True, return_inverse = True)
+        cells = cells.reshape(xcells.shape)
+
+        self.key = str(e)
+        self.family = e.family()
+        self.degree = degree
+        self.n_cells = mesh.num_cells()
+        self.n_points = xnodes.shape[0]
+        self.cell_type = cell_type
+        self.cell_map = cell_map
+        self.cells = cells
+        if degree == 0:
+            self.first_cell = numpy.arange(self.n_cells, dtype = numpy.intc)
+            self.first_node = numpy.zeros(self.n_cells, dtype = numpy.intc)
         else:
-            cell_map = {0:0, 1:1, 2:2, 3:3, 4:9, 5:6, 6:8, 7:7, 8:5, 9:4}
+            self.first_cell = first // xcells.shape[1]
+            self.first_node = first % xcells.shape[1]
+        self.__dim = dim
+        self.__xspace = xspace
+        self.__global_xnodes = xspace.dofmap().tabulate_local_to_global_dofs()[xnodes]
+
+        return
+
+    def points(self):
+        """
+        Return an array containing the coordinates of the VTK points. These are
+        computed on each call, and hence follow any motion of the mesh.
+        """
+
+        points = numpy.zeros((self.n_points, 3), dtype = numpy.float64)
+        for i, coord in enumerate(["x[0]", "x[1]", "x[2]"][:self.__dim]):
+            points[:, i] = dolfin.interpolate(dolfin.Expression(coord), self.__xspace).vector().gather(self.__global_xnodes)
+
+        return points
 
-    filename = "%s.vtu" % filename
+    def n_values(self):
+        """
+        Return the number of values in a field, one per VTK point or, for degree 0,
+        one per VTK cell.
+        """
 
-    reader = vtk.vtkXMLUnstructuredGridReader()
-    reader.SetFileName(filename)
-    reader.Update()
-    vtu = reader.GetOutput()
-    if degree == 0:
-        assert(vtu.GetNumberOfCells() == n)
+        return self.first_cell.shape[0]
+
+class VTULayout(object):
+    """
+    The permutation from the VTK points (or, for degree 0, VTK cells) of a
+    VTUElementLayout to the degrees of freedom of a scalar function space, which
+    may be a sub-space of a vector or mixed function space.
+    """
+
+    def __init__(self, space, root_space, element):
+        self.element = element
+
+        cells = cell_dofs(space, cell_map = self.element.cell_map)
+        # The process local and global indices of the degrees of freedom, in the
+        # root space, associated with each VTK point (or VTK cell)
+        self.nodes = cells[self.element.first_cell, self.element.first_node]
+        self.global_nodes = root_space.dofmap().tabulate_local_to_global_dofs()[self.nodes]
+        ownership_range = root_space.dofmap().ownership_range()
+        self.owned = self.nodes < ownership_range[1] - ownership_range[0]
+
+        return
+
+    def values(self, fn):
+        """
+        Return the values of the supplied Function on the root space in VTK order.
+        """
+
+        return fn.vector().gather(self.global_nodes)
+
+    def set_values(self, data, values):
+        """
+        Set the entries of the array data, holding the values of the locally owned
+        degrees of freedom of the root space, from the supplied values in VTK
+        order.
+        """
+
+        data[self.nodes[self.owned]] = values[self.owned]
+
+        return
+
+# Layouts for the most recently used function spaces, from least to most
+# recently used
+_layouts = OrderedDict()
+_max_layouts = 16
+def vtu_layouts(space):
+    """
+    Return a list of (suffix, VTULayout) pairs for the scalar components of the
+    supplied function space. Layouts for the most recently used function spaces
+    are cached, and reused by subsequent reads and writes.
+    """
+
+    key = space.id()
+    if key in _layouts:
+        layouts = _layouts.pop(key)
     else:
-        assert(vtu.GetNumberOfPoints() == n)
-    assert(vtu.GetNumberOfCells() == n_cells)
+        mesh = space.mesh()
+        elements = {}
+        layouts = []
+        for suffix, sub_space in scalar_sub_spaces(space):
+            e = sub_space.ufl_element()
+            if not str(e) in elements:
+                elements[str(e)] = VTUElementLayout(mesh, e)
+            layouts.append((suffix, VTULayout(sub_space, space, elements[str(e)])))
+    _layouts[key] = layouts
+    while len(_layouts) > _max_layouts:
+        _layouts.popitem(last = False)
+
+    return layouts
+
+def element_filename(filename, e):
+    """
+    Return the filename base used for fields with the supplied VTUElementLayout,
+    when fields with multiple elements are written.
+    """
 
-    fields = {}
-    x = dolfin.interpolate(dolfin.Expression("x[0]"), space).vector().array()
-    X = numpy.empty((x.shape[0], dim), dtype = x.dtype)
-    X[:, 0] = x
-    if dim > 1:
-        X[:, 1] = dolfin.interpolate(dolfin.Expression("x[1]"), space).vector().array()
-    if dim > 2:
-        X[:, 2] = dolfin.interpolate(dolfin.Expression("x[2]"), space).vector().array()
-    if degree == 0:
-        for i in range(n_cells):
-            cell = dof.cell_dofs(i)
-            x = X[cell[0], :]
-            vtu_cell = vtu.GetCell(i).GetPointIds()
-            vtu_x = numpy.array([vtu.GetPoint(vtu_cell.GetId(j))[:dim] for j in range(vtu_cell.GetNumberOfIds())])
-            mag = abs(vtu_x).max(0)
-            tol = 2.0e-15 * mag
-            if any(abs(vtu_x.mean(0) - x) > tol):
-                dolfin.info_red("Relative coordinate error: %.16e" % (abs(vtu_x.mean(0) - x) / mag).max())
-                raise IOException("Invalid coordinates")
-
-        for i in range(vtu.GetCellData().GetNumberOfArrays()):
-            cell_data = vtu.GetCellData().GetArray(i)
-            if not cell_data.GetNumberOfComponents() == 1:
-                raise NotImplementedException("%i components not supported by read_vtu" % cell_data.GetNumberOfComponents())
-            assert(cell_data.GetNumberOfTuples() == n)
-
-            name = cell_data.GetName()
-            assert(not name in fields)
-            data = numpy.empty(n)
-            for j in range(n_cells):
-                cell = dof.cell_dofs(j)
-                data[cell[0]] = cell_data.GetTuple1(j)
-            field = dolfin.Function(space, name = name)
-            field.vector().set_local(data)
-            field.vector().apply("insert")
-
-            fields[name] = field
+    filename = "%s_P%i" % (filename, e.degree)
+    if e.family == "Discontinuous Lagrange":
+        filename = "%s_DG" % filename
+    return filename
+
+def vtu_filename(filename, index = None):
+    """
+    Return the name of the vtu file written by this process for the supplied
+    filename base and index.
+    """
+
+    if not index is None:
+        filename = "%s_%i" % (filename, index)
+    if dolfin.MPI.size(dolfin.mpi_comm_world()) > 1:
+        # The pieces of a pvtu file
+        return "%s_%i.vtu" % (filename, dolfin.MPI.rank(dolfin.mpi_comm_world()))
     else:
-        for i in range(n_cells):
-            cell = dof.cell_dofs(i)
-            vtu_cell = vtu.GetCell(i).GetPointIds()
-            assert(len(cell) == vtu_cell.GetNumberOfIds())
-            if cell_map is None:
-                for j in range(vtu_cell.GetNumberOfIds()):
-                    if not (X[cell[j]] == vtu.GetPoint(vtu_cell.GetId(j))[:dim]).all():
-                        dolfin.info_red("Coordinate error: %.16e" % (abs(X[cell[j]] - vtu.GetPoint(vtu_cell.GetId(j))[:dim]).max()))
-                        raise IOException("Invalid coordinates")
-            else:
-                for j in range(vtu_cell.GetNumberOfIds()):
-                    if not (X[cell[cell_map[j]]] == vtu.GetPoint(vtu_cell.GetId(j))[:dim]).all():
-                        dolfin.info_red("Coordinate error: %.16e" % (abs(X[cell[cell_map[j]]] - vtu.GetPoint(vtu_cell.GetId(j))[:dim]).max()))
-                        raise IOException("Invalid coordinates")
-
-        for i in range(vtu.GetPointData().GetNumberOfArrays()):
-            point_data = vtu.GetPointData().GetArray(i)
-            if not point_data.GetNumberOfComponents() == 1:
-                raise NotImplementedException("%i components not supported by read_vtu" % point_data.GetNumberOfComponents())
-            assert(point_data.GetNumberOfTuples() == n)
-
-            name = point_data.GetName()
-            assert(not name in fields)
-            data = numpy.empty(n)
-            for j in range(n_cells):
-                cell = dof.cell_dofs(j)
-                vtu_cell = vtu.GetCell(j).GetPointIds()
-                assert(len(cell) == vtu_cell.GetNumberOfIds())
-                if cell_map is None:
-                    for k in range(vtu_cell.GetNumberOfIds()):
-                        data[cell[k]] = point_data.GetTuple1(vtu_cell.GetId(k))
-                else:
-                    for k in range(vtu_cell.GetNumberOfIds()):
-                        data[cell[cell_map[k]]] = point_data.GetTuple1(vtu_cell.GetId(k))
-            field = dolfin.Function(space, name = name)
-            field.vector().set_local(data)
-            field.vector().apply("insert")
-
-            fields[name] = field
+        return "%s.vtu" % filename
+
+def read_vtu(filename, space, index = None):
+    """
+    Read a vtu file with the supplied filename base, with fields on the supplied
+    FunctionSpace. Return a dict with the Function names as keys and the
+    Function s as values. The optional integer index has the same meaning as for
+    write_vtu.
+
+    If the FunctionSpace has sub-spaces, the scalar components written by
+    write_vtu, with names suffixed by the component indices, are gathered into
+    Function s on the FunctionSpace. If the components have different elements,
+    as for a Taylor-Hood space, then the files written by write_vtu for each
+    element are read.
+
+    In parallel each process reads the piece of the pvtu file that it wrote, and
+    hence the file must be read with the same number of processes and the same
+    mesh partition as it was written.
+    """
+
+    if not isinstance(filename, str):
+        raise InvalidArgumentException("filename must be a string")
+    if not isinstance(space, dolfin.FunctionSpaceBase):
+        raise InvalidArgumentException("space must be a FunctionSpace")
+    if not index is None and not isinstance(index, int):
+        raise InvalidArgumentException("index must be an integer")
+
+    mesh = space.mesh()
+    dim = mesh.geometry().dim()
+
+    layouts = vtu_layouts(space)
+    elements = OrderedDict()
+    for suffix, layout in layouts:
+        elements[layout.element.key] = layout.element
+    if len(elements) == 1:
+        filenames = [filename]
+    else:
+        filenames = [element_filename(filename, e) for e in elements.values()]
+
+    arrays = {}
+    for lfilename, e in zip(filenames, elements.values()):
+        lfilename = vtu_filename(lfilename, index = index)
+        reader = vtk.vtkXMLUnstructuredGridReader()
+        reader.SetFileName(lfilename)
+        reader.Update()
+        vtu = reader.GetOutput()
+        if not vtu.GetNumberOfCells() == e.n_cells or not vtu.GetNumberOfPoints() == e.n_points:
+            raise IOException("Invalid mesh in vtu file: %s" % lfilename)
+
+        points = numpy_support.vtk_to_numpy(vtu.GetPoints().GetData())
+        e_points = e.points()
+        if not (points[:, :dim] == e_points[:, :dim]).all():
+            dolfin.info_red("Coordinate error: %.16e" % abs(points[:, :dim] - e_points[:, :dim]).max())
+            raise IOException("Invalid coordinates")
+        cells = numpy_support.vtk_to_numpy(vtu.GetCells().GetData()).reshape((e.n_cells, -1))[:, 1:]
+        if not (cells == e.cells).all():
+            raise IOException("Invalid cells")
+
+        if e.degree == 0:
+            vtu_data = vtu.GetCellData()
+        else:
+            vtu_data = vtu.GetPointData()
+        e_arrays = arrays[e.key] = OrderedDict()
+        for i in range(vtu_data.GetNumberOfArrays()):
+            array = vtu_data.GetArray(i)
+            if not array.GetNumberOfComponents() == 1:
+                raise NotImplementedException("%i components not supported by read_vtu" % array.GetNumberOfComponents())
+            assert(array.GetNumberOfTuples() == e.n_values())
+            name = array.GetName()
+            assert(not name in e_arrays)
+            e_arrays[name] = numpy_support.vtk_to_numpy(array)
+
+    fields = {}
+    suffix0, layout0 = layouts[0]
+    for name in arrays[layout0.element.key]:
+        if not name.endswith(suffix0):
+            continue
+        base = name[:len(name) - len(suffix0)]
+        if not all(("%s%s" % (base, suffix)) in arrays[layout.element.key] for suffix, layout in layouts):
+            continue
+
+        field = dolfin.Function(space, name = base)
+        data = field.vector().get_local()
+        for suffix, layout in layouts:
+            layout.set_values(data, arrays[layout.element.key]["%s%s" % (base, suffix)])
+        field.vector().set_local(data)
+        field.vector().apply("insert")
+        fields[base] = field
 
     return fields
 
-def write_vtu(filename, fns, index = None, t = None):
+def write_vtu(filename, fns, index = None, t = None, compress = True):
     """
     Write the supplied Function or Function s to a vtu or pvtu file with the
     supplied filename base. If the Function s are defined on multiple function
     spaces then separate output files are written for each function space. The
     optional integer index can be used to add an index to the output filenames.
     If t is supplied then a scalar field equal to t and with name "time" is added
-    to the output files.
-
-    All Function s should be on the same mesh and have unique names. In 1D all
-    Function s must have Lagrange basis functions (continuous or discontinous)
-    with degree 0 to 3. In 2D and 3D all Function s must have Lagrange basis
-    functions (continuous or discontinuous) with degree 0 to 2.
+    to the output files. The data are written as binary appended data, which are
+    zlib compressed if compress is true. In parallel each process writes its own
+    piece of a pvtu file.
+
+    All Function s should be on the same mesh and have unique names. Function s
+    with sub-spaces, such as vector fields, are written as scalar components,
+    with names suffixed by the component indices. In 1D all components must have
+    Lagrange basis functions (continuous or discontinous) with degree 0 to 3. In
+    2D and 3D all components must have Lagrange basis functions (continuous or
+    discontinuous) with degree 0 to 2.
     """
 
     if isinstance(fns, dolfin.Function):
-        return write_vtu(filename, [fns], index = index, t = t)
+        return write_vtu(filename, [fns], index = index, t = t, compress = compress)
     if not isinstance(filename, str):
         raise InvalidArgumentException("filename must be a string")
     if not isinstance(fns, list):
@@ -215,208 +387,77 @@ def write_vtu(filename, fns, index = None, t = None):
     if not dim in [1, 2, 3]:
         raise NotImplementedException("Mesh dimension %i not supported by write_vtu" % dim)
 
-    def expand_sub_fns(fn):
-        n_sub_spaces = fn.function_space().num_sub_spaces()
-        if n_sub_spaces > 1:
-            fns = fn.split(deepcopy = True)
-            for i, sfn in enumerate(copy.copy(fns)):
-                sfn.rename("%s_%i" % (fn.name(), i + 1), "%s_%i" % (fn.name(), i + 1))
-                if sfn.function_space().num_sub_spaces() > 0:
-                    fns.remove(sfn)
-                    fns += expand_sub_fns(sfn)
-            return fns
-        elif n_sub_spaces == 1:
-            e = fn.function_space().ufl_element().extract_component(0)[1]
-            space = dolfin.FunctionSpace(mesh, e.family(), e.degree())
-            sfn = dolfin.Function(space, name = "%s_1" % fn.name())
-            sfn.vector()[:] = fn.vector()
-            return [sfn]
-        else:
-            return [fn]
-
-    nfns = []
-    for i, fn in enumerate(fns):
-        space = fn.function_space()
-        if not space.mesh().id() == mesh.id():
-            raise InvalidArgumentException("Require exactly one mesh in write_vtu")
-        n_sub_spaces = space.num_sub_spaces()
-        nfns += expand_sub_fns(fn)
-    fns = nfns;  del(nfns)
-
-    spaces = []
+    # Group the scalar components of the Function s by element
+    elements = {}
     lfns = OrderedDict()
     for fn in fns:
         space = fn.function_space()
-        assert(space.mesh().id() == mesh.id())
-        e = space.ufl_element()
-        assert(e.cell().geometric_dimension() == dim)
-        assert(e.cell().topological_dimension() == dim)
-        if (not e.family() in ["Lagrange", "Discontinuous Lagrange"]
-            or not dim in [1, 2, 3]
-            or (dim == 1 and not e.degree() in [1, 2, 3])
-            or (dim in [2, 3] and not e.degree() in [1, 2])) and \
-          (not e.family() == "Discontinuous Lagrange"
-            or not dim in [1, 2, 3]
-            or not e.degree() == 0):
-            raise NotImplementedException('Element family "%s" with degree %i in %i dimension(s) not supported by write_vtu' % (e.family(), e.degree(), dim))
-        if e in lfns:
-            lfns[e].append(fn)
-        else:
-            spaces.append(space)
-            lfns[e] = [fn]
-    fns = lfns
+        if not space.mesh().id() == mesh.id():
+            raise InvalidArgumentException("Require exactly one mesh in write_vtu")
+        for suffix, layout in vtu_layouts(space):
+            key = layout.element.key
+            if not key in elements:
+                elements[key] = layout.element
+            e = elements[key]
+            if e in lfns:
+                lfns[e].append(("%s%s" % (fn.name(), suffix), layout, fn))
+            else:
+                lfns[e] = [("%s%s" % (fn.name(), suffix), layout, fn)]
+    fns = lfns;  del(lfns)
 
-    if len(spaces) == 1:
+    if len(fns) == 1:
         filenames = [filename]
     else:
-        filenames = []
-        for space in spaces:
-            e = space.ufl_element()
-            lfilename = "%s_P%i" % (filename, e.degree())
-            if e.family() == "Discontinuous Lagrange":
-                lfilename = "%s_DG" % lfilename
-            filenames.append(lfilename)
+        filenames = [element_filename(filename, e) for e in fns]
 
     if not t is None:
-        for space in spaces:
-            lt = dolfin.Function(space, name = "time")
-            if isinstance(t, float):
-                lt.vector()[:] = t
-            else:
-                lt.assign(t)
-            fns[space.ufl_element()].append(lt)
+        t = float(t)
+        for e in fns:
+            fns[e].append(("time", None, numpy.full(e.n_values(), t)))
 
-    names = {e:[] for e in fns}
     for e in fns:
-        for fn in fns[e]:
-            name = fn.name()
-            if name in names[e]:
+        names = set()
+        for name, layout, fn in fns[e]:
+            if name in names:
                 raise InvalidArgumentException("Duplicate Function name: %s" % name)
-            names[e].append(name)
-
-    for filename, space in zip(filenames, spaces):
-        e = space.ufl_element()
-        degree = e.degree()
+            names.add(name)
 
+    for filename, layout in zip(filenames, fns):
         vtu = vtk.vtkUnstructuredGrid()
 
-        dof = space.dofmap()
-        nodes = set()
-        for i in range(mesh.num_cells()):
-            cell =  dof.cell_dofs(i)
-            for node in cell:
-                nodes.add(node)
-        nodes = numpy.array(sorted(list(nodes)), dtype = numpy.intc)
-
-        if degree == 0:
-            xspace = dolfin.FunctionSpace(mesh, "CG", 1)
-            xdof = xspace.dofmap()
-            xnodes = set()
-            for i in range(mesh.num_cells()):
-                cell =  xdof.cell_dofs(i)
-                for node in cell:
-                    xnodes.add(node)
-            xnodes = numpy.array(sorted(list(xnodes)), dtype = numpy.intc)
-        else:
-            xspace = space
-            xdof = dof
-            xnodes = nodes
-        xnode_map = {node:i for i, node in enumerate(xnodes)}
-
-        x = dolfin.interpolate(dolfin.Expression("x[0]"), xspace).vector().gather(xnodes)
-        if dim > 1:
-            y = dolfin.interpolate(dolfin.Expression("x[1]"), xspace).vector().gather(xnodes)
-        if dim > 2:
-            z = dolfin.interpolate(dolfin.Expression("x[2]"), xspace).vector().gather(xnodes)
-        n = x.shape[0]
-
         points = vtk.vtkPoints()
-        points.SetDataTypeToDouble()
-        points.SetNumberOfPoints(n)
-        if dim == 1:
-            for i in range(n):
-                points.SetPoint(i, x[i], 0.0, 0.0)
-        elif dim == 2:
-            for i in range(n):
-                points.SetPoint(i, x[i], y[i], 0.0)
-        else:
-            for i in range(n):
-                points.SetPoint(i, x[i], y[i], z[i])
+        points.SetData(numpy_support.numpy_to_vtk(layout.points(), deep = 1))
         vtu.SetPoints(points)
 
-        id_list = vtk.vtkIdList()
-        if dim == 1:
-            if degree in [0, 1]:
-                cell_type = vtk.vtkLine().GetCellType()
-                id_list.SetNumberOfIds(2)
-                cell_map = None
-            elif degree == 2:
-                cell_type = vtk.vtkQuadraticEdge().GetCellType()
-                id_list.SetNumberOfIds(3)
-                cell_map = None
-            else:
-                cell_type = vtk.vtkCubicLine().GetCellType()
-                id_list.SetNumberOfIds(4)
-                cell_map = None
-        elif dim == 2:
-            if degree in [0, 1]:
-                cell_type = vtk.vtkTriangle().GetCellType()
-                id_list.SetNumberOfIds(3)
-                cell_map = None
-            else:
-                cell_type = vtk.vtkQuadraticTriangle().GetCellType()
-                id_list.SetNumberOfIds(6)
-                cell_map = {0:0, 1:1, 2:2, 3:5, 4:3, 5:4}
-        else:
-            if degree in [0, 1]:
-                cell_type = vtk.vtkTetra().GetCellType()
-                id_list.SetNumberOfIds(4)
-                cell_map = None
-            else:
-                cell_type = vtk.vtkQuadraticTetra().GetCellType()
-                id_list.SetNumberOfIds(10)
-                cell_map = {0:0, 1:1, 2:2, 3:3, 4:9, 5:6, 6:8, 7:7, 8:5, 9:4}
-        for i in range(mesh.num_cells()):
-            cell = xdof.cell_dofs(i)
-            assert(len(cell) == id_list.GetNumberOfIds())
-            if not cell_map is None:
-                cell = [cell[cell_map[j]] for j in range(len(cell))]
-            for j in range(len(cell)):
-                id_list.SetId(j, xnode_map[cell[j]])
-            vtu.InsertNextCell(cell_type, id_list)
+        cells = numpy.empty((layout.n_cells, layout.cells.shape[1] + 1), dtype = numpy_support.ID_TYPE_CODE)
+        cells[:, 0] = layout.cells.shape[1]
+        cells[:, 1:] = layout.cells
+        cell_array = vtk.vtkCellArray()
+        cell_array.SetCells(layout.n_cells, numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep = 1))
+        vtu.SetCells(layout.cell_type, cell_array)
 
-        if degree == 0:
-            for fn in fns[e]:
-                if not fn.value_rank() == 0:
-                    raise NotImplementedException("Function rank %i not supported by write_vtu" % fn.value_rank())
-                data = fn.vector().gather(nodes)
-                cell_data = vtk.vtkDoubleArray()
-                cell_data.SetNumberOfComponents(1)
-                cell_data.SetNumberOfValues(mesh.num_cells())
-                cell_data.SetName(fn.name())
-                for i, datum in enumerate(data):
-                    cell_data.SetValue(i, datum)
-                vtu.GetCellData().AddArray(cell_data)
-            vtu.GetCellData().SetActiveScalars(names[e][0])
+        if layout.degree == 0:
+            vtu_data = vtu.GetCellData()
         else:
-            for fn in fns[e]:
-                if not fn.value_rank() == 0:
-                    raise NotImplementedException("Function rank %i not supported by write_vtu" % fn.value_rank())
-                data = fn.vector().gather(nodes)
-                point_data = vtk.vtkDoubleArray()
-                point_data.SetNumberOfComponents(1)
-                point_data.SetNumberOfValues(n)
-                point_data.SetName(fn.name())
-                for i, datum in enumerate(data):
-                    point_data.SetValue(i, datum)
-                vtu.GetPointData().AddArray(point_data)
-            vtu.GetPointData().SetActiveScalars(names[e][0])
+            vtu_data = vtu.GetPointData()
+        for name, sub_layout, fn in fns[layout]:
+            if sub_layout is None:
+                values = fn
+            else:
+                values = sub_layout.values(fn)
+            array = numpy_support.numpy_to_vtk(numpy.ascontiguousarray(values, dtype = numpy.float64), deep = 1)
+            array.SetName(name)
+            vtu_data.AddArray(array)
+        vtu_data.SetActiveScalars(fns[layout][0][0])
 
         if dolfin.MPI.size(dolfin.mpi_comm_world()) > 1:
+            rank = dolfin.MPI.rank(dolfin.mpi_comm_world())
             writer = vtk.vtkXMLPUnstructuredGridWriter()
             writer.SetNumberOfPieces(dolfin.MPI.size(dolfin.mpi_comm_world()))
-            writer.SetStartPiece(dolfin.MPI.rank(dolfin.mpi_comm_world()))
-            writer.SetEndPiece(dolfin.MPI.rank(dolfin.mpi_comm_world()))
+            writer.SetStartPiece(rank)
+            writer.SetEndPiece(rank)
+            if hasattr(writer, "SetWriteSummaryFile"):
+                writer.SetWriteSummaryFile(rank == 0)
             ext = ".pvtu"
         else:
             writer = vtk.vtkXMLUnstructuredGridWriter()
@@ -428,10 +469,16 @@ def write_vtu(filename, fns, index = None, t = None):
         writer.SetFileName(filename)
         writer.SetDataModeToAppended()
         writer.EncodeAppendedDataOff()
-        writer.SetCompressorTypeToZLib()
-        writer.GetCompressor().SetCompressionLevel(9)
+        if compress:
+            writer.SetCompressorTypeToZLib()
+            writer.GetCompressor().SetCompressionLevel(9)
+        else:
+            writer.SetCompressor(None)
         writer.SetBlockSize(2 ** 15)
-        writer.SetInput(vtu)
+        if hasattr(writer, "SetInputData"):
+            writer.SetInputData(vtu)
+        else:
+            writer.SetInput(vtu)
         writer.Write()
         if not writer.GetProgress() == 1.0 or not writer.GetErrorCode() == 0:
             raise IOException("Failed to write vtu file: %s" % filename)